@@ -0,0 +1,341 @@
+"""
+Module that contains the functions for planning (dry run) ARCSI processing.
+"""
+############################################################################
+#  arcsiplanner.py
+#
+#  Copyright 2013 ARCSI.
+#
+#  ARCSI: 'Atmospheric and Radiometric Correction of Satellite Imagery'
+#
+#  ARCSI is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  ARCSI is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with ARCSI.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Purpose:  Functions to estimate the number of 6S runs, the disk space
+#           and the run time required to process a scene (or a list of
+#           scenes) without processing any of the image pixels.
+#
+# Author: ARCSI Contributors
+# Email: rsgislib-support@googlegroups.com
+# Date: 18/10/2026
+# Version: 1.0
+#
+# History:
+# Version 1.0 - Created.
+#
+############################################################################
+
+# Import updated print function into python 2.7
+from __future__ import print_function
+# Import updated division operator into python 2.7
+from __future__ import division
+# Import the math module
+import math
+# Import the OS python module
+import os
+# Import the JSON module
+import json
+# Import the ARCSI exception class
+from arcsilib.arcsiexception import ARCSIException
+# Import the ARCSI utilities class
+from arcsilib.arcsiutils import ARCSIUtils
+# Import the ARCSI 6S coefficients LUT class
+from arcsilib.arcsiutils import ARCSI6SCoeffLUT
+# Import the image calculations module from rsgislib
+import rsgislib.imagecalc
+# Import the osgeo gdal library
+import osgeo.gdal as gdal
+
+# The number of reflective bands which are outputted for each sensor.
+ARCSI_PLAN_SENSOR_NBANDS = {'ls1':4, 'ls2':4, 'ls3':4, 'ls4mss':4, 'ls5mss':4, 'ls4tm':6, 'ls5tm':6, 'ls7':6,
+                            'ls8':7, 'rapideye':5, 'planetscope':4, 'wv2':8, 'wv3':8, 'spot5':4, 'spot6':4,
+                            'spot7':4, 'pleiades':4, 'sen2':10}
+
+# The number of thermal bands which are outputted for each sensor.
+ARCSI_PLAN_SENSOR_NTHERMAL = {'ls4tm':1, 'ls5tm':1, 'ls7':2, 'ls8':2}
+
+# Default time (seconds) for a single 6S run.
+ARCSI_PLAN_6S_SECS = 1.0
+
+# Default image data throughput (MB/s) across the pixel processing stages.
+ARCSI_PLAN_IO_MBPS = 50.0
+
+# The maximum number of image segments for which the AOT is predicted (selectClumpsOnGrid 10 x 10).
+ARCSI_PLAN_MAX_AOT_SEGS = 100
+
+
+def _numAOTValTests(minAOT, maxAOT):
+    numTests = int(math.ceil((maxAOT - minAOT)/0.05))+1
+    if numTests < 1:
+        numTests = 1
+    return numTests
+
+def getSceneImageGrid(paramsObj):
+    """
+    A function which finds the dimensions of the output image grid for the scene
+    from the input image headers (i.e., no pixel data is read).
+
+    :param paramsObj: the parameters object from arcsirun.prepParametersObj.
+    :return: (xSize, ySize, xRes, yRes)
+
+    """
+    imgGrids = []
+    for attName, attVal in vars(paramsObj.sensorClass).items():
+        if (attName == 'headerFileName') or (not isinstance(attVal, str)) or (attVal == ''):
+            continue
+        if not os.path.isfile(attVal):
+            continue
+        imgDS = gdal.Open(attVal, gdal.GA_ReadOnly)
+        if imgDS is None:
+            continue
+        geoTransform = imgDS.GetGeoTransform()
+        imgGrids.append((imgDS.RasterXSize, imgDS.RasterYSize, abs(geoTransform[1]), abs(geoTransform[5])))
+        imgDS = None
+
+    if len(imgGrids) == 0:
+        raise ARCSIException("Could not open any of the input images to find the image dimensions for '" + str(paramsObj.inputHeader) + "'.")
+
+    if paramsObj.sensorClass.inImgsDiffRes():
+        # Match the resampling in resampleBands: images are resampled to the
+        # highest resolution image unless resample2LowResImg was specified.
+        imgGrids = sorted(imgGrids, key=lambda grid: grid[2])
+        if paramsObj.resample2LowResImg:
+            xSize, ySize, xRes, yRes = imgGrids[-1]
+        else:
+            xSize, ySize, xRes, yRes = imgGrids[0]
+    else:
+        # The images are not resampled so the output grid is the grid of the
+        # reflective bands, which is the grid shared by most of the input images
+        # (i.e., a panchromatic band, such as Landsat 7/8 band 8, is ignored).
+        xSize, ySize, xRes, yRes = max(set(imgGrids), key=imgGrids.count)
+
+    if paramsObj.reproject and paramsObj.pxlResDefd:
+        xSize = int(math.ceil(xSize * (xRes / paramsObj.xPxlRes)))
+        ySize = int(math.ceil(ySize * (yRes / abs(paramsObj.yPxlRes))))
+        xRes = paramsObj.xPxlRes
+        yRes = abs(paramsObj.yPxlRes)
+    return xSize, ySize, xRes, yRes
+
+def getSceneElevRange(paramsObj):
+    """
+    A function which finds the range of elevations (rounded to the 100 m LUT steps
+    used by calculateSREF) of the DEM within the scene envelope.
+
+    :param paramsObj: the parameters object from arcsirun.prepParametersObj.
+    :return: (minElev, maxElev)
+
+    """
+    arcsiUtils = ARCSIUtils()
+    statsElev = rsgislib.imagecalc.getImageStatsInEnv(paramsObj.demFile, 1, float(paramsObj.demNoDataVal), paramsObj.sensorClass.lonTL, paramsObj.sensorClass.lonBR, paramsObj.sensorClass.latBR, paramsObj.sensorClass.latTL)
+    return arcsiUtils.findMinimumElev(statsElev[0]), arcsiUtils.findMaximumElev(statsElev[1])
+
+def planARCSIScene(paramsObj, sixsSecs=ARCSI_PLAN_6S_SECS, ioMBps=ARCSI_PLAN_IO_MBPS):
+    """
+    A function which estimates, from the headers and the product dependencies defined
+    in paramsObj.prodsToCalc, the number of 6S runs and the bytes written by each of
+    the processing stages for a scene. The bytes are for uncompressed images so are an
+    upper bound when outputting compressed formats (e.g., KEA).
+
+    :param paramsObj: the parameters object from arcsirun.prepParametersObj.
+    :param sixsSecs: the estimated time (seconds) for a single 6S run.
+    :param ioMBps: the estimated throughput (MB/s) of the pixel processing stages.
+    :return: dict with the scene estimate.
+
+    """
+    if paramsObj.sensorStr not in ARCSI_PLAN_SENSOR_NBANDS:
+        raise ARCSIException("The number of output bands for sensor '" + paramsObj.sensorStr + "' is not known to the planner.")
+    nBands = ARCSI_PLAN_SENSOR_NBANDS[paramsObj.sensorStr]
+    nThermal = 0
+    if paramsObj.prodsToCalc["THERMAL"]:
+        nThermal = ARCSI_PLAN_SENSOR_NTHERMAL.get(paramsObj.sensorStr, 0)
+
+    xSize, ySize, xRes, yRes = getSceneImageGrid(paramsObj)
+    nPxls = xSize * ySize
+    useDEM = (paramsObj.demFile is not None) and (paramsObj.demFile != "")
+
+    # Stages: (product, number of bands, bytes per pixel, intermediate)
+    stages = []
+    stages.append(("VALID", 1, 1, False))
+    if paramsObj.sensorStr == 'sen2':
+        stages.append(("VIEWANGLE", 4, 4, False))
+    if paramsObj.prodsToCalc["RAD"]:
+        stages.append(("RAD", nBands, 4, ('RAD' not in paramsObj.productsStr)))
+    if paramsObj.prodsToCalc["SHARP"]:
+        stages.append(("SHARP", nBands, 4, False))
+    if paramsObj.prodsToCalc["SATURATE"]:
+        stages.append(("SATURATE", nBands, 1, False))
+    if nThermal > 0:
+        stages.append(("THERMAL", nThermal, 4, True))
+        stages.append(("THERMAL", nThermal, 2, False))
+    if paramsObj.prodsToCalc["TOA"]:
+        stages.append(("TOA", nBands, 2, ('TOA' not in paramsObj.productsStr)))
+    if paramsObj.prodsToCalc["CLOUDS"]:
+        stages.append(("CLOUDS", nBands, 2, True))
+        stages.append(("CLOUDS", 1, 4, True))
+        stages.append(("CLOUDS", 1, 1, False))
+    if paramsObj.prodsToCalc["CLEARSKY"]:
+        stages.append(("CLEARSKY", 2, 4, True))
+        stages.append(("CLEARSKY", 1, 1, False))
+    if useDEM:
+        stages.append(("DEM", 1, 4, True))
+        stages.append(("DEM", 1, 1, True))
+    if paramsObj.prodsToCalc["TOPOSHADOW"]:
+        stages.append(("TOPOSHADOW", 1, 1, False))
+    if paramsObj.prodsToCalc["DOS"]:
+        stages.append(("DOS", nBands, 2, False))
+    if paramsObj.prodsToCalc["DOSAOT"] or paramsObj.prodsToCalc["DDVAOT"] or paramsObj.prodsToCalc["DOSAOTSGL"]:
+        stages.append(("AOT", 1, 2, True))
+        stages.append(("AOT", 1, 4, True))
+    if paramsObj.prodsToCalc["DOSAOT"] or paramsObj.prodsToCalc["DDVAOT"]:
+        stages.append(("AOT", 1, 4, False))
+    if paramsObj.prodsToCalc["SREF"]:
+        stages.append(("SREF", nBands, 2, ('SREF' not in paramsObj.productsStr)))
+    if paramsObj.prodsToCalc["STDSREF"]:
+        stages.append(("STDSREF", 4 + nBands, 4, True))
+        stages.append(("STDSREF", nBands, 2, False))
+
+    fullImgFactor = 1
+    if paramsObj.reproject and paramsObj.fullImgOuts:
+        fullImgFactor = 2
+
+    # In preview mode the stages following the conversion to radiance
+    # are processed on the decimated image grid.
+    previewPxls = nPxls
+    if paramsObj.previewFactor is not None:
+        previewPxls = int(math.ceil(xSize / paramsObj.previewFactor)) * int(math.ceil(ySize / paramsObj.previewFactor))
+
+    stageBytes = dict()
+    interBytes = 0
+    finalBytes = 0
+    for prod, prodBands, prodPxlBytes, intermediate in stages:
+        if prod in ["VALID", "VIEWANGLE", "RAD", "SHARP", "SATURATE"]:
+            nBytes = nPxls * prodBands * prodPxlBytes
+        else:
+            nBytes = previewPxls * prodBands * prodPxlBytes
+        if prod in ["RAD", "TOA", "SREF", "STDSREF"]:
+            nBytes = nBytes * fullImgFactor
+        if prod not in stageBytes:
+            stageBytes[prod] = 0
+        stageBytes[prod] = stageBytes[prod] + nBytes
+        if intermediate:
+            interBytes = interBytes + nBytes
+        else:
+            finalBytes = finalBytes + nBytes
+
+    # Count the 6S runs using the same LUT sizes as the processing.
+    sixsRuns = dict()
+    minElev = None
+    maxElev = None
+    if paramsObj.prodsToCalc["DOSAOTSGL"]:
+        sixsRuns["DOSAOTSGL"] = _numAOTValTests(paramsObj.minAOT, paramsObj.maxAOT)
+    if paramsObj.prodsToCalc["DOSAOT"] or paramsObj.prodsToCalc["DDVAOT"]:
+        # Upper bound: one set of AOT tests per selected segment.
+        sixsRuns["AOT"] = ARCSI_PLAN_MAX_AOT_SEGS * _numAOTValTests(paramsObj.minAOT, paramsObj.maxAOT)
+    if paramsObj.prodsToCalc["SREF"]:
+        if not useDEM:
+            sixsRuns["SREF"] = nBands
+        else:
+            minElev, maxElev = getSceneElevRange(paramsObj)
+            lutInterp, lutElevStep, lutAOTStep = ARCSI6SCoeffLUT.getLUTConfig()
+            numElevSteps = int(math.ceil((maxElev - minElev) / lutElevStep) + 1)
+            if paramsObj.prodsToCalc["DOSAOT"] or paramsObj.prodsToCalc["DDVAOT"] or ((paramsObj.aotFile is not None) and (paramsObj.aotFile != "")):
+                # The AOT range is only known once the AOT image has been
+                # created so the user AOT range is used (upper bound).
+                numAOTSteps = int(math.ceil((paramsObj.maxAOT - paramsObj.minAOT) / lutAOTStep) + 1) + 1
+                sixsRuns["SREF"] = numElevSteps * numAOTSteps * nBands
+            else:
+                sixsRuns["SREF"] = numElevSteps * nBands
+    total6SRuns = sum(sixsRuns.values())
+
+    totalBytes = interBytes + finalBytes
+    estTime = (total6SRuns * sixsSecs) + ((totalBytes / (1024 * 1024)) / ioMBps)
+
+    scenePlan = dict()
+    scenePlan['header'] = paramsObj.inputHeader
+    scenePlan['sensor'] = paramsObj.sensorStr
+    scenePlan['products'] = sorted([prod for prod in paramsObj.prodsToCalc if paramsObj.prodsToCalc[prod]])
+    scenePlan['img_size'] = [xSize, ySize]
+    scenePlan['img_res'] = [xRes, yRes]
+    scenePlan['n_bands'] = nBands
+    if paramsObj.previewFactor is not None:
+        scenePlan['preview_factor'] = paramsObj.previewFactor
+    if minElev is not None:
+        scenePlan['lut_elev_range'] = [minElev, maxElev]
+    scenePlan['sixs_runs'] = sixsRuns
+    scenePlan['sixs_runs_total'] = total6SRuns
+    scenePlan['stage_bytes'] = stageBytes
+    scenePlan['intermediate_bytes'] = interBytes
+    scenePlan['final_bytes'] = finalBytes
+    scenePlan['est_time_secs'] = estTime
+    return scenePlan
+
+def _fmtBytes(nBytes):
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(nBytes) < 1024.0:
+            return "{0:.1f} {1}".format(nBytes, unit)
+        nBytes = nBytes / 1024.0
+    return "{0:.1f} PB".format(nBytes)
+
+def printARCSIPlan(scenePlans, outJSONFile=None):
+    """
+    A function which prints the per scene and aggregate estimates and optionally
+    writes them to a JSON file.
+
+    :param scenePlans: list of dicts from planARCSIScene.
+    :param outJSONFile: optional output JSON file path.
+
+    """
+    totalPlan = dict()
+    totalPlan['n_scenes'] = len(scenePlans)
+    totalPlan['sixs_runs_total'] = 0
+    totalPlan['intermediate_bytes'] = 0
+    totalPlan['final_bytes'] = 0
+    totalPlan['est_time_secs'] = 0.0
+    totalPlan['max_scene_bytes'] = 0
+
+    for scenePlan in scenePlans:
+        print("Scene: " + str(scenePlan['header']))
+        print("\tImage Size: {0} x {1} ({2} bands at {3} x {4})".format(scenePlan['img_size'][0], scenePlan['img_size'][1], scenePlan['n_bands'], scenePlan['img_res'][0], scenePlan['img_res'][1]))
+        if 'preview_factor' in scenePlan:
+            print("\tPreview: 1/{0} resolution".format(scenePlan['preview_factor']))
+        print("\tProducts: " + ", ".join(scenePlan['products']))
+        if 'lut_elev_range' in scenePlan:
+            print("\tLUT Elevation Range: {0} to {1}".format(scenePlan['lut_elev_range'][0], scenePlan['lut_elev_range'][1]))
+        for stage in sorted(scenePlan['sixs_runs']):
+            print("\t6S Runs ({0}): {1}".format(stage, scenePlan['sixs_runs'][stage]))
+        for stage in sorted(scenePlan['stage_bytes']):
+            print("\tBytes ({0}): {1}".format(stage, _fmtBytes(scenePlan['stage_bytes'][stage])))
+        print("\tIntermediate: " + _fmtBytes(scenePlan['intermediate_bytes']))
+        print("\tFinal: " + _fmtBytes(scenePlan['final_bytes']))
+        print("\tEstimated Time: {0:.1f} minutes".format(scenePlan['est_time_secs'] / 60))
+        totalPlan['sixs_runs_total'] = totalPlan['sixs_runs_total'] + scenePlan['sixs_runs_total']
+        totalPlan['intermediate_bytes'] = totalPlan['intermediate_bytes'] + scenePlan['intermediate_bytes']
+        totalPlan['final_bytes'] = totalPlan['final_bytes'] + scenePlan['final_bytes']
+        totalPlan['est_time_secs'] = totalPlan['est_time_secs'] + scenePlan['est_time_secs']
+        sceneBytes = scenePlan['intermediate_bytes'] + scenePlan['final_bytes']
+        if sceneBytes > totalPlan['max_scene_bytes']:
+            totalPlan['max_scene_bytes'] = sceneBytes
+
+    print("Total ({0} scenes):".format(totalPlan['n_scenes']))
+    print("\t6S Runs: {0}".format(totalPlan['sixs_runs_total']))
+    print("\tIntermediate: " + _fmtBytes(totalPlan['intermediate_bytes']))
+    print("\tFinal: " + _fmtBytes(totalPlan['final_bytes']))
+    print("\tPeak Scene Disk: " + _fmtBytes(totalPlan['max_scene_bytes']))
+    print("\tEstimated Time (1 core): {0:.1f} hours".format(totalPlan['est_time_secs'] / 3600))
+
+    if outJSONFile is not None:
+        with open(outJSONFile, 'w') as outJSONFileObj:
+            json.dump({'scenes':scenePlans, 'total':totalPlan}, outJSONFileObj, sort_keys=True, indent=4, separators=(',', ': '))
+    return totalPlan
+
@@ -61,6 +61,14 @@ from arcsilib.arcsiexception import ARCSIException
 from arcsilib.arcsiutils import ARCSISensorFactory
 # Import the ARCSI utilities class
 from arcsilib.arcsiutils import ARCSIUtils
+# Import the ARCSI profile lookup class
+from arcsilib.arcsiutils import ARCSIProfileLookup
+# Import the ARCSI DEM cache class
+from arcsilib.arcsiutils import ARCSIDEMCache
+# Import the ARCSI 6S coefficients LUT class
+from arcsilib.arcsiutils import ARCSI6SCoeffLUT
+# Import the ARCSI planner module
+import arcsilib.arcsiplanner
 # Import the sensor classes
 from arcsilib.arcsisensor import ARCSIAbstractSensor
 # Import the image utilities module from rsgislib
@@ -93,6 +101,20 @@ from arcsilib import ARCSI_SENSORS_LIST
 from arcsilib import ARCSI_PRODUCTS_LIST
 # Import the multiprocessing Pool module
 from multiprocessing import Pool
+# Import the python resource module (not available on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The memory (MB) used by python, the libraries and 6S before any image data is read.
+ARCSI_MIN_BASE_MEM_MB = 256
+# The minimum GDAL block cache (MB).
+ARCSI_MIN_GDAL_CACHE_MB = 32
+# The memory (bytes per pixel) used by the in memory segmentation (runShepherdSegmentation
+# with processInMem=True) used to estimate the AOT: the stretched segmentation bands, the
+# k-means cluster image and the clumps images.
+ARCSI_SEG_MEM_BYTES_PER_PXL = 24
 
 
 class ARCSIParamsObj (object):
@@ -195,6 +217,8 @@ class ARCSIParamsObj (object):
         outDEMNameMsk=""
         demNoDataVal = -32768.0
         topoShadowImage=""
+        terrainGeomImage=None
+        terrainGeomCalcd=False
         footprintVecFile=""
         metaDataFile=""
         propOfCloud = 0.0
@@ -213,8 +237,18 @@ class ARCSIParamsObj (object):
         aotLUT = False
         fileEnding2Keep = None
         cloud_methods = None
-
-def prepParametersObj(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal, atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, fileEnding2Keep, cloud_methods):
+        demCacheDIR = None
+        demPrepTime = 0.0
+        numThreads = 1
+        maxMemMB = None
+        previewFactor = None
+        warpMemMB = None
+        peakRSSMB = None
+        memUsagePID = None
+        startMaxRSSMB = None
+        peakRSSReset = False
+
+def prepParametersObj(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal, atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, fileEnding2Keep, cloud_methods, demCacheDIR=None, numThreads=1, maxMemMB=None, previewFactor=None, preScreenMaxCloud=None):
     """
     """
     arcsiUtils = ARCSIUtils()
@@ -280,6 +314,14 @@ def prepParametersObj(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKT
     paramsObj.resample2LowResImg = resample2LowResImg
     paramsObj.fileEnding2Keep = fileEnding2Keep
     paramsObj.cloud_methods = cloud_methods
+    paramsObj.demCacheDIR = demCacheDIR
+    paramsObj.demPrepTime = 0.0
+    paramsObj.numThreads = numThreads
+    paramsObj.maxMemMB = maxMemMB
+    paramsObj.previewFactor = previewFactor
+    paramsObj.preScreenMaxCloud = preScreenMaxCloud
+    paramsObj.warpMemMB = None
+    paramsObj.peakRSSMB = None
 
     # Read WKT file if provided.
     paramsObj.wktStr = None
@@ -302,38 +344,12 @@ def prepParametersObj(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKT
     #         the aerosol and atmosphere generic model to use for conversion to SREF
     if paramsObj.aeroProfileOptionImg is not None:
         print("Get aero profile from image...")
-        aeroProfileMode = int(rsgislib.imagecalc.getImageBandModeInEnv(paramsObj.aeroProfileOptionImg, 1, 1, None, paramsObj.sensorClass.lonTL, paramsObj.sensorClass.lonBR, paramsObj.sensorClass.latBR, paramsObj.sensorClass.latTL)[0])
-
-        if aeroProfileMode is 1:
-            paramsObj.aeroProfileOption = "Maritime"
-        elif aeroProfileMode is 2:
-            paramsObj.aeroProfileOption = "Continental"
-        else:
-            raise ARCSIException("The aerosol profile from the input image was not recognised.")
+        paramsObj.aeroProfileOption = ARCSIProfileLookup.getAeroProfile(paramsObj.aeroProfileOptionImg, paramsObj.sensorClass.lonTL, paramsObj.sensorClass.lonBR, paramsObj.sensorClass.latBR, paramsObj.sensorClass.latTL)
         print("Aerosol Profile = ", paramsObj.aeroProfileOption)
         print("")
     if paramsObj.atmosProfileOptionImg is not None:
         print("Get atmos profile from image...")
-        atmosProfileMode = int(rsgislib.imagecalc.getImageBandModeInEnv(paramsObj.atmosProfileOptionImg, 1, 1, None, paramsObj.sensorClass.lonTL, paramsObj.sensorClass.lonBR, paramsObj.sensorClass.latBR, paramsObj.sensorClass.latTL)[0])
-        summerWinter = arcsiUtils.isSummerOrWinter(paramsObj.sensorClass.latCentre, paramsObj.sensorClass.lonCentre, paramsObj.sensorClass.acquisitionTime )
-        if atmosProfileMode is 1:
-            paramsObj.atmosProfileOption = "Tropical"
-        elif atmosProfileMode is 2:
-            if summerWinter is 1:
-                paramsObj.atmosProfileOption = "MidlatitudeSummer"
-            elif summerWinter is 2:
-                paramsObj.atmosProfileOption = "MidlatitudeWinter"
-            else:
-                raise ARCSIException("Not recognised as being summer or winter.")
-        elif atmosProfileMode is 3:
-            if summerWinter is 1:
-                paramsObj.atmosProfileOption = "SubarcticSummer"
-            elif summerWinter is 2:
-                paramsObj.atmosProfileOption = "SubarcticWinter"
-            else:
-                raise ARCSIException("Not recognised as being summer or winter.")
-        else:
-            raise ARCSIException("The atmosphere profile from the input image was not recognised.")
+        paramsObj.atmosProfileOption = ARCSIProfileLookup.getAtmosProfile(paramsObj.atmosProfileOptionImg, paramsObj.sensorClass.lonTL, paramsObj.sensorClass.lonBR, paramsObj.sensorClass.latBR, paramsObj.sensorClass.latTL, paramsObj.sensorClass.latCentre, paramsObj.sensorClass.lonCentre, paramsObj.sensorClass.acquisitionTime)
         print("Atmosphere Profile = ", paramsObj.atmosProfileOption)
         print("")
 
@@ -342,6 +358,13 @@ def prepParametersObj(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKT
         paramsObj.outBaseName = paramsObj.sensorClass.generateOutputBaseName()
         if not paramsObj.projAbbv is None:
             paramsObj.outBaseNameProj = paramsObj.outBaseName + "_" + str(paramsObj.projAbbv)
+    # Mark the outputs of a preview run so they can't be mistaken for the full resolution products.
+    if paramsObj.previewFactor is not None:
+        if paramsObj.previewFactor < 2:
+            raise ARCSIException("The preview factor must be 2 or greater (e.g., 4 or 8).")
+        paramsObj.outBaseName = paramsObj.outBaseName + "_preview" + str(paramsObj.previewFactor)
+        if paramsObj.outBaseNameProj is not None:
+            paramsObj.outBaseNameProj = paramsObj.outBaseNameProj + "_preview" + str(paramsObj.previewFactor)
     print("Image Base Name: " + paramsObj.outBaseName + "\n")
 
     # Check whether output files for this input already exist - if checkOutputs is True.
@@ -540,6 +563,9 @@ def prepParametersObj(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKT
         paramsObj.yPxlRes = paramsObj.yPxlResUsr
 
     paramsObj.sensorClass.setReProjectOutputs(paramsObj.reproject)
+    paramsObj.sensorClass.setNumThreads(paramsObj.numThreads)
+    paramsObj.sensorClass.setMemBudget(paramsObj.maxMemMB)
+    setMemBudget(paramsObj)
 
     paramsObj.validMaskImage=None
     paramsObj.validMaskImageProj=""
@@ -572,10 +598,16 @@ def prepParametersObj(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKT
         if paramsObj.demNoDataVal is None:
             raise ARCSIException("A no data value for the inputted DEM has not been defined - cannot continue without a no data value. A no data value can be define using the --demnodata option.")
     paramsObj.topoShadowImage=""
+    paramsObj.terrainGeomImage=None
+    paramsObj.terrainGeomCalcd=False
+    paramsObj.previewImgs = []
+    paramsObj.demMin=None
+    paramsObj.demMax=None
     paramsObj.footprintVecFile=""
     paramsObj.metaDataFile=""
     paramsObj.propOfCloud = 0.0
     paramsObj.propOfClearSky = 0.0
+    paramsObj.sceneSkipped = False
     paramsObj.projImgBBOX = dict()
     paramsObj.projImgBBOX['MinX'] = 0.0
     paramsObj.projImgBBOX['MaxX'] = 0.0
@@ -585,7 +617,11 @@ def prepParametersObj(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKT
     paramsObj.processStageWholeImgStr = ""
     paramsObj.processSREFStr = ""
     paramsObj.finalOutFiles = dict()
+    paramsObj.outImgStats = dict()
+    paramsObj.numStatsImgsSkipped = 0
     paramsObj.calcdOutVals = dict()
+    if paramsObj.previewFactor is not None:
+        paramsObj.calcdOutVals['ARCSI_PREVIEW_FACTOR'] = paramsObj.previewFactor
     paramsObj.sixsLUTCoeffs = None
     paramsObj.aotLUT = False
 
@@ -596,17 +632,216 @@ def prepParametersObj(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKT
             paramsObj.calcdOutVals["REPROJECT"] = arcsiUtils.readTextFile(paramsObj.outProj4File)
     return paramsObj
 
+def addOutputImageStats(paramsObj, imgFile, useRAT=False, addClrTab=True):
+    """
+    A function which registers an output image for which the statistics and pyramids
+    should be calculated (if calcStatsPy is True). The calculation is deferred to
+    calcOutputImageStats so each final output is only read once and intermediate
+    images, which have been superseded or deleted, are not read at all.
+    """
+    if paramsObj.calcStatsPy and (imgFile is not None) and (imgFile != ""):
+        paramsObj.outImgStats[imgFile] = (useRAT, addClrTab)
+
+def calcOutputImageStats(paramsObj):
+    """
+    A function which calculates the statistics and pyramids (in a single pass) for the
+    registered output images which are final outputs and still exist following the
+    clean up of the output directory.
+    """
+    if paramsObj.calcStatsPy and (len(paramsObj.outImgStats) > 0):
+        finalImgs = set(paramsObj.finalOutFiles.values())
+        finalImgs.update([paramsObj.radianceImage, paramsObj.toaImage, paramsObj.saturateImage, paramsObj.maskImage])
+        numImgsCalcd = 0
+        paramsObj.numStatsImgsSkipped = 0
+        for imgFile in sorted(paramsObj.outImgStats.keys()):
+            if (imgFile in finalImgs) and os.path.exists(imgFile):
+                print("Calculating Statistics: " + imgFile)
+                useRAT, addClrTab = paramsObj.outImgStats[imgFile]
+                if useRAT:
+                    rsgislib.rastergis.populateStats(imgFile, addClrTab, True)
+                else:
+                    rsgislib.imageutils.popImageStats(imgFile, True, 0.0, True)
+                numImgsCalcd = numImgsCalcd + 1
+            else:
+                paramsObj.numStatsImgsSkipped = paramsObj.numStatsImgsSkipped + 1
+        print("Statistics calculated for " + str(numImgsCalcd) + " output images; " + str(paramsObj.numStatsImgsSkipped) + " full image reads saved for intermediate images.")
+        paramsObj.outImgStats = dict()
+        print("")
+
 def checkForValidInput(paramsObj):
     print('Checking Input Images are valid')
     paramsObj.sensorClass.checkInputImageValid()
 
+def preScreenScene(paramsObj):
+    """
+    A function which checks the cloud cover reported within the scene metadata
+    against the pre-screen threshold (paramsObj.preScreenMaxCloud; proportion 0-1,
+    --prescreencloud or ARCSI_PRESCREEN_MAX_CLOUD) so heavily clouded scenes are
+    skipped before any of the full resolution processing. For a skipped scene only
+    the metadata file is produced, with the reason the scene was skipped; it is
+    produced even if the METADATA product was not requested so the skip is always
+    recorded. No pre-screen is performed if the threshold is not defined or the
+    sensor metadata does not provide the cloud cover.
+    """
+    if paramsObj.preScreenMaxCloud is None:
+        return
+    maxCloudCover = paramsObj.preScreenMaxCloud
+    if (maxCloudCover < 0) or (maxCloudCover > 1):
+        raise ARCSIException("The pre-screen cloud cover threshold must be a proportion (0-1).")
+    startTime = time.time()
+    print('Pre-screening the scene using the metadata cloud cover...')
+    cloudCover = paramsObj.sensorClass.getMetadataCloudCover()
+    if cloudCover is None:
+        print("The cloud cover is not available within the metadata so the scene will be processed.")
+    else:
+        print("The scene metadata reports " + str(cloudCover*100) + "% cloud.")
+        paramsObj.calcdOutVals['ARCSI_PRESCREEN_CLOUD_COVER'] = cloudCover
+        if cloudCover > maxCloudCover:
+            paramsObj.sceneSkipped = True
+            paramsObj.calcdOutVals['ARCSI_SCENE_SKIPPED'] = True
+            paramsObj.calcdOutVals['ARCSI_SKIP_REASON'] = "The metadata cloud cover (" + str(cloudCover*100) + "%) is above the pre-screen threshold (" + str(maxCloudCover*100) + "%)."
+            print("Skipping scene: " + paramsObj.calcdOutVals['ARCSI_SKIP_REASON'])
+            # Only the metadata file is produced for a skipped scene, recording why it was skipped.
+            for key in paramsObj.prodsToCalc.keys():
+                paramsObj.prodsToCalc[key] = (key == 'METADATA')
+    print("Pre-screen took {0:.2f} seconds.".format(time.time() - startTime))
+    print("")
+
+def setMemBudget(paramsObj):
+    """
+    A function which checks the scene can be processed within the memory budget
+    (paramsObj.maxMemMB) and sizes the GDAL block cache and warp memory. The
+    image blocks and number of concurrent workers are sized by the sensor class
+    from the same budget. The minimum memory required depends on the number of
+    pixels within the scene, found from the image headers. An ARCSIException is
+    raised if the budget is too small. The GDAL block cache size is only stored
+    (paramsObj.gdalCacheMB) as the cache is process-global; it is set, and restored,
+    around the processing of the scene (runARCSI and the _runARCSIPart functions)
+    so it doesn't leak into the caller (e.g., runARCSIPlan or arcsimpi.py).
+    """
+    paramsObj.warpMemMB = None
+    paramsObj.gdalCacheMB = None
+    if paramsObj.maxMemMB is None:
+        return
+    try:
+        xSize, ySize, xRes, yRes = arcsilib.arcsiplanner.getSceneImageGrid(paramsObj)
+        numPxls = xSize * ySize
+    except ARCSIException as e:
+        print("Warning: the scene size could not be found so the memory budget is not checked against it: {}".format(e), file=sys.stderr)
+        numPxls = 0
+    if paramsObj.previewFactor is not None:
+        numPxls = numPxls / (paramsObj.previewFactor * paramsObj.previewFactor)
+    # The local DOS blocks (up to 1000 x 1000 pixels) are fixed as they define the
+    # region used to find the dark targets; each pixel needs the input and
+    # output bands (uint16) and the float64 histogram data.
+    numBands = arcsilib.arcsiplanner.ARCSI_PLAN_SENSOR_NBANDS.get(paramsObj.sensorStr, 13)
+    dosBlockMB = (min(numPxls, 1000 * 1000) * ((numBands * 2 * 2) + (8 * 3))) / (1024 * 1024)
+    # The segmentation used to estimate the AOT is processed in memory for the whole scene.
+    segMemMB = 0.0
+    if paramsObj.prodsToCalc["DDVAOT"] or paramsObj.prodsToCalc["DOSAOT"]:
+        segMemMB = (numPxls * ARCSI_SEG_MEM_BYTES_PER_PXL) / (1024 * 1024)
+    minMemMB = ARCSI_MIN_BASE_MEM_MB + ARCSI_MIN_GDAL_CACHE_MB + max(dosBlockMB, segMemMB)
+    if paramsObj.maxMemMB < minMemMB:
+        raise ARCSIException("The memory budget ({0:.0f} MB) is too small to process the scene ({1:.0f} pixels); at least {2:.0f} MB is required.".format(paramsObj.maxMemMB, numPxls, minMemMB))
+    paramsObj.gdalCacheMB = max(ARCSI_MIN_GDAL_CACHE_MB, paramsObj.maxMemMB * 0.25)
+    paramsObj.warpMemMB = max(ARCSI_MIN_GDAL_CACHE_MB, paramsObj.maxMemMB * 0.125)
+    print("Memory budget: {0:.0f} MB (GDAL cache {1:.0f} MB; warp memory {2:.0f} MB; at least {3:.0f} MB required)".format(paramsObj.maxMemMB, paramsObj.gdalCacheMB, paramsObj.warpMemMB, minMemMB))
+
+def setGDALCacheMax(paramsObj):
+    """
+    A function which sets the GDAL block cache for the memory budget of the scene
+    (paramsObj.gdalCacheMB; see setMemBudget), if there is one, returning the previous
+    cache size (bytes) which the caller must restore once the scene (or part) is processed.
+    """
+    prevGDALCacheMax = gdal.GetCacheMax()
+    if paramsObj.gdalCacheMB is not None:
+        gdal.SetCacheMax(int(paramsObj.gdalCacheMB * 1024 * 1024))
+    return prevGDALCacheMax
+
+def _getProcStatusMemMB(field):
+    """
+    Get a memory field (e.g., VmRSS or VmHWM) for the current process from
+    /proc/self/status (Linux only) in MB; None is returned if not available.
+    """
+    try:
+        with open('/proc/self/status', 'r') as statusFile:
+            for line in statusFile:
+                if line.startswith(field + ':'):
+                    return float(line.split()[1]) / 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+def _getMaxRSSMB():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS.
+    maxRSSMB = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if sys.platform == 'darwin':
+        maxRSSMB = maxRSSMB / 1024
+    return maxRSSMB
+
+def startMemUsage(paramsObj):
+    """
+    A function which marks the start of the processing of a scene for reportMemUsage.
+    On Linux the peak resident set size (VmHWM) of the process is reset so the peak
+    reported is for the scene rather than the lifetime of the process (i.e., when a
+    worker or a multiprocessing Pool process handles multiple scenes).
+    """
+    paramsObj.memUsagePID = os.getpid()
+    paramsObj.startMaxRSSMB = _getMaxRSSMB()
+    paramsObj.peakRSSReset = False
+    try:
+        # Writing 5 to clear_refs resets the peak RSS (Linux 4.0+).
+        with open('/proc/self/clear_refs', 'w') as clearRefsFile:
+            clearRefsFile.write('5')
+        paramsObj.peakRSSReset = True
+    except (IOError, OSError):
+        paramsObj.peakRSSReset = False
+
+def reportMemUsage(paramsObj):
+    """
+    A function which reports the peak memory (resident set size) used while
+    processing the scene, and whether it was within the memory budget
+    (paramsObj.maxMemMB). Where the peak since startMemUsage is not available
+    (i.e., not Linux, or the scene was started in another process) the current
+    resident set size is reported along with the increase of the process peak.
+    """
+    peakRSSMB = None
+    memDescStr = "Peak memory for the scene"
+    if paramsObj.peakRSSReset and (paramsObj.memUsagePID == os.getpid()):
+        peakRSSMB = _getProcStatusMemMB('VmHWM')
+    if peakRSSMB is None:
+        peakRSSMB = _getProcStatusMemMB('VmRSS')
+        memDescStr = "Current memory"
+        maxRSSMB = _getMaxRSSMB()
+        if (maxRSSMB is not None) and (paramsObj.memUsagePID == os.getpid()) and (paramsObj.startMaxRSSMB is not None):
+            print("Increase in the process peak memory during the scene: {0:.0f} MB".format(maxRSSMB - paramsObj.startMaxRSSMB))
+        if peakRSSMB is None:
+            peakRSSMB = maxRSSMB
+            memDescStr = "Process peak memory"
+    if peakRSSMB is None:
+        return
+    paramsObj.peakRSSMB = peakRSSMB
+    if paramsObj.maxMemMB is None:
+        print("{0}: {1:.0f} MB".format(memDescStr, peakRSSMB))
+    elif peakRSSMB <= paramsObj.maxMemMB:
+        print("{0}: {1:.0f} MB (within budget of {2:.0f} MB)".format(memDescStr, peakRSSMB, paramsObj.maxMemMB))
+    else:
+        print("Warning: {0} of {1:.0f} MB exceeded the budget of {2:.0f} MB".format(memDescStr, peakRSSMB, paramsObj.maxMemMB), file=sys.stderr)
+
+def prefetchInputBands(paramsObj):
+    # Decode input image bands which are slow to read (e.g., JPEG2000) up front.
+    if paramsObj.sensorClass.prefetchImgBands(paramsObj.outFilePath):
+        print("")
+
 def resampleBands(paramsObj):
     # Check if bands need resampling
     if paramsObj.sensorClass.inImgsDiffRes():
         print('Resampling image bands to match one another.')
         if paramsObj.interpAlgorResample == 'near':
             paramsObj.interpAlgorResample = 'nearestneighbour'
-        paramsObj.sensorClass.resampleImgRes(paramsObj.outFilePath, paramsObj.resample2LowResImg, paramsObj.interpAlgorResample, False)
+        paramsObj.sensorClass.resampleImgRes(paramsObj.outFilePath, paramsObj.resample2LowResImg, paramsObj.interpAlgorResample, (paramsObj.numThreads > 1))
 
 def mosaicInputImages(paramsObj):
     if paramsObj.sensorClass.imgNeedMosaicking():
@@ -739,9 +974,7 @@ def createSaturatedImage(paramsObj):
             else:
                 rsgisUtils.deleteFileWithBasename(paramsObj.saturateImage)
                 paramsObj.saturateImage = paramsObj.saturateImageProj
-        if paramsObj.calcStatsPy:
-            print("Calculating Statistics...")
-            rsgislib.rastergis.populateStats(paramsObj.saturateImage, True, True)
+        addOutputImageStats(paramsObj, paramsObj.saturateImage, useRAT=True)
         paramsObj.prodsCalculated["SATURATE"] = True
         print("")
 
@@ -767,10 +1000,8 @@ def convertInputImageToRadiance(paramsObj):
             if paramsObj.maskImage is not None:
                 print("Setting Band Names...")
                 paramsObj.sensorClass.setBandNames(paramsObj.radianceImage)
-                if paramsObj.calcStatsPy:
-                    print("Calculating Statistics...")
-                    rsgislib.imageutils.popImageStats(paramsObj.radianceImage, True, 0.0, True)
-                    rsgislib.rastergis.populateStats(paramsObj.maskImage, True, True)
+                addOutputImageStats(paramsObj, paramsObj.radianceImage)
+                addOutputImageStats(paramsObj, paramsObj.maskImage, useRAT=True)
 
         if paramsObj.validMaskImage is not None:
             print("Masking to valid data area.")
@@ -837,11 +1068,9 @@ def convertInputImageToRadiance(paramsObj):
 
         print("Setting Band Names...")
         paramsObj.sensorClass.setBandNames(paramsObj.radianceImage)
-        if paramsObj.calcStatsPy:
-            print("Calculating Statistics...")
-            rsgislib.imageutils.popImageStats(paramsObj.radianceImage, True, 0.0, True)
-            if paramsObj.thermalRadImage is not None:
-                rsgislib.imageutils.popImageStats(paramsObj.thermalRadImage, True, 0.0, True)
+        addOutputImageStats(paramsObj, paramsObj.radianceImage)
+        if paramsObj.thermalRadImage is not None:
+            addOutputImageStats(paramsObj, paramsObj.thermalRadImage)
         
         paramsObj.finalOutFiles["RADIANCE_WHOLE"] = paramsObj.radianceImage
         paramsObj.finalOutFiles["RADIANCE"] = paramsObj.radianceImage
@@ -852,14 +1081,47 @@ def convertInputImageToRadiance(paramsObj):
         paramsObj.prodsCalculated["RAD"] = True
         print("")
 
+def createPreviewImages(paramsObj):
+    """
+    A function which, in preview mode (paramsObj.previewFactor), decimates the
+    input images by the preview factor when they are read, before any images are
+    produced. The input image bands of the sensor (see
+    ARCSIAbstractSensor.decimateInputImgBands) are replaced by VRTs reading them
+    at the preview resolution, the user cloud mask is decimated to match and a
+    user defined output resolution is coarsened by the same factor. Therefore,
+    all the following stages of the processing chain, including the valid mask,
+    saturation, radiance, DEM and 6S parameterisation, are unchanged but run on
+    the preview image grid.
+    """
+    if paramsObj.previewFactor is not None:
+        startTime = time.time()
+        print("Decimating the input images to 1/" + str(paramsObj.previewFactor) + " resolution for the preview...")
+        paramsObj.previewImgs = paramsObj.sensorClass.decimateInputImgBands(paramsObj.outFilePath, paramsObj.previewFactor)
+        if len(paramsObj.previewImgs) == 0:
+            raise ARCSIException("The input images of the sensor cannot be decimated for a preview.")
+        if paramsObj.cloudMaskUsrImg is not None:
+            # The cloud mask is an output (CLOUD_MASK) so is written rather than a VRT.
+            cloudMaskPreviewImg = os.path.join(paramsObj.outFilePath, paramsObj.outBaseName + "_usrclouds" + paramsObj.outFormatExt)
+            paramsObj.cloudMaskUsrImg = ARCSIUtils().createDecimatedImage(paramsObj.cloudMaskUsrImg, cloudMaskPreviewImg, paramsObj.previewFactor, 'near', paramsObj.outFormat)
+        if paramsObj.pxlResDefd:
+            paramsObj.xPxlRes = paramsObj.xPxlRes * paramsObj.previewFactor
+            paramsObj.yPxlRes = paramsObj.yPxlRes * paramsObj.previewFactor
+        print("Preview decimation took {0:.2f} seconds.".format(time.time() - startTime))
+        print("")
+
+def removePreviewImages(paramsObj):
+    if (len(paramsObj.previewImgs) > 0) and (not paramsObj.debugMode):
+        for previewImg in paramsObj.previewImgs:
+            if os.path.exists(previewImg):
+                os.remove(previewImg)
+        paramsObj.previewImgs = []
+
 def calcThermalBrightness(paramsObj):
     # Execute calibrate thermal to brightness
     if paramsObj.prodsToCalc["THERMAL"]:
         outName = paramsObj.outBaseName + paramsObj.processStageStr + "_thrad_thermbright" + paramsObj.outFormatExt
         paramsObj.thermalBrightImage = paramsObj.sensorClass.convertThermalToBrightness(paramsObj.thermalRadImage, paramsObj.outFilePath, outName, paramsObj.outFormat, paramsObj.scaleFactor)
-        if paramsObj.calcStatsPy:
-            print("Calculating Statistics...")
-            rsgislib.imageutils.popImageStats(paramsObj.thermalBrightImage, True, 0.0, True)
+        addOutputImageStats(paramsObj, paramsObj.thermalBrightImage)
         paramsObj.finalOutFiles["THERMAL_BRIGHT_WHOLE"] = paramsObj.thermalBrightImage
         paramsObj.finalOutFiles["THERMAL_BRIGHT"] = paramsObj.thermalBrightImage
         paramsObj.thermalBrightImageWhole = paramsObj.thermalBrightImage
@@ -879,14 +1141,12 @@ def calcTOAReflectance(paramsObj):
             interpAlgorOpt = paramsObj.interpAlgor
             if paramsObj.interpAlgor == 'near':
                 interpAlgorOpt = 'nearestneighbour'
-            rsgislib.imageutils.resampleImage2Match(paramsObj.radianceImage, tmpImg, paramsObj.toaImage, 'KEA', interpAlgorOpt, rsgislib.TYPE_16UINT, multicore=False)
+            paramsObj.sensorClass.resampleImgBands([(paramsObj.radianceImage, tmpImg, paramsObj.toaImage)], interpAlgorOpt, rsgislib.TYPE_16UINT, None)
             rsgisUtils.deleteFileWithBasename(tmpImg)
 
         print("Setting Band Names...")
         paramsObj.sensorClass.setBandNames(paramsObj.toaImage)
-        if paramsObj.calcStatsPy:
-            print("Calculating Statistics...")
-            rsgislib.imageutils.popImageStats(paramsObj.toaImage, True, 0.0, True)
+        addOutputImageStats(paramsObj, paramsObj.toaImage)
         paramsObj.finalOutFiles["TOA_WHOLE"] = paramsObj.toaImage
         paramsObj.finalOutFiles["TOA"] = paramsObj.toaImage
         paramsObj.toaImageWhole = paramsObj.toaImage
@@ -901,12 +1161,10 @@ def performCloudMasking(paramsObj):
         outName = paramsObj.outBaseName + "_clouds" + paramsObj.outFormatExt
         if paramsObj.cloudMaskUsrImg is None:
             if paramsObj.classmlclouds:
-                paramsObj.cloudsImage = paramsObj.sensorClass.generateCloudMaskML(paramsObj.toaImage, paramsObj.validMaskImage, paramsObj.outFilePath, outName, paramsObj.outFormat, paramsObj.tmpPath, paramsObj.cloudtrainclouds, paramsObj.cloudtrainother, paramsObj.scaleFactor, numCores=1)
+                paramsObj.cloudsImage = paramsObj.sensorClass.generateCloudMaskML(paramsObj.toaImage, paramsObj.validMaskImage, paramsObj.outFilePath, outName, paramsObj.outFormat, paramsObj.tmpPath, paramsObj.cloudtrainclouds, paramsObj.cloudtrainother, paramsObj.scaleFactor, numCores=paramsObj.numThreads)
             else:
                 paramsObj.cloudsImage = paramsObj.sensorClass.generateCloudMask(paramsObj.toaImage, paramsObj.saturateImage, paramsObj.thermalBrightImage, paramsObj.viewAngleImg, paramsObj.validMaskImage, paramsObj.outFilePath, outName, paramsObj.outFormat, paramsObj.tmpPath, paramsObj.scaleFactor, paramsObj.cloud_methods)
-            if paramsObj.calcStatsPy:
-                print("Calculating Statistics...")
-                rsgislib.rastergis.populateStats(paramsObj.cloudsImage, False, True)
+            addOutputImageStats(paramsObj, paramsObj.cloudsImage, useRAT=True, addClrTab=False)
         else:
             paramsObj.cloudsImage = paramsObj.cloudMaskUsrImg
         paramsObj.finalOutFiles["CLOUD_MASK"] = paramsObj.cloudsImage
@@ -924,17 +1182,13 @@ def performCloudMasking(paramsObj):
             paramsObj.radianceImage = outputRADImage
             paramsObj.sensorClass.setBandNames(paramsObj.radianceImage)
             paramsObj.finalOutFiles["RADIANCE"] = paramsObj.radianceImage
-            if paramsObj.calcStatsPy:
-                print("Calculating Statistics...")
-                rsgislib.imageutils.popImageStats(paramsObj.radianceImage, True, 0.0, True)
+            addOutputImageStats(paramsObj, paramsObj.radianceImage)
             outputTOAImage = os.path.join(paramsObj.outFilePath, paramsObj.outBaseName + paramsObj.processStageStr + "_rad_toa" + paramsObj.outFormatExt)
             rsgislib.imageutils.maskImage(paramsObj.toaImage, paramsObj.cloudsImage, outputTOAImage, paramsObj.outFormat, rsgisUtils.getRSGISLibDataTypeFromImg(paramsObj.toaImage), 0, [1,2])
             paramsObj.toaImage = outputTOAImage
             paramsObj.sensorClass.setBandNames(paramsObj.toaImage)
             paramsObj.finalOutFiles["TOA"] = paramsObj.toaImage
-            if paramsObj.calcStatsPy:
-                print("Calculating Statistics...")
-                rsgislib.imageutils.popImageStats(paramsObj.toaImage, True, 0.0, True)
+            addOutputImageStats(paramsObj, paramsObj.toaImage)
         paramsObj.prodsCalculated["CLOUDS"] = True
         print("")
 
@@ -943,9 +1197,7 @@ def performClearSkyMasking(paramsObj):
         rsgisUtils = rsgislib.RSGISPyUtils()
         outName = paramsObj.outBaseName + "_clearsky" + paramsObj.outFormatExt
         paramsObj.clearskyImage = paramsObj.sensorClass.generateClearSkyMask(paramsObj.cloudsImage, paramsObj.validMaskImage, paramsObj.outFilePath, outName, paramsObj.outFormat, paramsObj.tmpPath, paramsObj.initClearSkyRegionDist, paramsObj.initClearSkyRegionMinSize, paramsObj.finalClearSkyRegionDist, paramsObj.clearSkyMorphSize)
-        if paramsObj.calcStatsPy:
-            print("Calculating Statistics...")
-            rsgislib.rastergis.populateStats(paramsObj.clearskyImage, True, True)
+        addOutputImageStats(paramsObj, paramsObj.clearskyImage, useRAT=True)
         paramsObj.finalOutFiles["CLEARSKY_MASK"] = paramsObj.clearskyImage
 
         # Calculate the proportion of the scene which is clear sky.
@@ -961,33 +1213,32 @@ def performClearSkyMasking(paramsObj):
             paramsObj.radianceImage = outputRADImage
             paramsObj.sensorClass.setBandNames(paramsObj.radianceImage)
             paramsObj.finalOutFiles["RADIANCE"] = paramsObj.radianceImage
-            if paramsObj.calcStatsPy:
-                print("Calculating Statistics...")
-                rsgislib.imageutils.popImageStats(paramsObj.radianceImage, True, 0.0, True)
+            addOutputImageStats(paramsObj, paramsObj.radianceImage)
             outputTOAImage = os.path.join(paramsObj.outFilePath, paramsObj.outBaseName + paramsObj.processStageStr + "_rad_toa" + paramsObj.outFormatExt)
             rsgislib.imageutils.maskImage(paramsObj.toaImage, paramsObj.clearskyImage, outputTOAImage, paramsObj.outFormat, rsgisUtils.getRSGISLibDataTypeFromImg(paramsObj.toaImage), 0, 0)
             paramsObj.toaImage = outputTOAImage
             paramsObj.sensorClass.setBandNames(paramsObj.toaImage)
             paramsObj.finalOutFiles["TOA"] = paramsObj.toaImage
-            if paramsObj.calcStatsPy:
-                print("Calculating Statistics...")
-                rsgislib.imageutils.popImageStats(paramsObj.toaImage, True, 0.0, True)
+            addOutputImageStats(paramsObj, paramsObj.toaImage)
         paramsObj.prodsCalculated["CLEARSKY"] = True
         print("")
 
 def prepareDEM(paramsObj):
     if (paramsObj.demFile is not None) and (paramsObj.demFile != ""):
         rsgisUtils = rsgislib.RSGISPyUtils()
-        outDEMNameTmp = os.path.join(paramsObj.outFilePath, (paramsObj.outBaseName + "_demtmp" + paramsObj.outFormatExt))
-        rsgislib.imageutils.createCopyImage(paramsObj.radianceImage, outDEMNameTmp, 1, paramsObj.demNoDataVal, paramsObj.outFormat, rsgislib.TYPE_32FLOAT)
-
-        inDEMDS = gdal.Open(paramsObj.demFile, gdal.GA_ReadOnly)
-        outDEMDS = gdal.Open(outDEMNameTmp, gdal.GA_Update)
-
-        print("Subset and reproject DEM...")
-        gdal.ReprojectImage(inDEMDS, outDEMDS, None, None, gdal.GRA_CubicSpline)
-        inDEMDS = None
-        outDEMDS = None
+        demPrepStart = time.time()
+        demCacheStatus = "not used"
+        if paramsObj.demCacheDIR is not None:
+            print("Get DEM subset from cache...")
+            outDEMNameTmp, demCacheHit = ARCSIDEMCache.getDEMSubset(paramsObj.demFile, paramsObj.radianceImage, paramsObj.demCacheDIR, paramsObj.demNoDataVal, gdal.GRA_CubicSpline, paramsObj.warpMemMB)
+            if demCacheHit:
+                demCacheStatus = "warm"
+            else:
+                demCacheStatus = "cold"
+        else:
+            outDEMNameTmp = os.path.join(paramsObj.outFilePath, (paramsObj.outBaseName + "_demtmp" + paramsObj.outFormatExt))
+            print("Subset and reproject DEM...")
+            ARCSIDEMCache.reprojectDEM(paramsObj.demFile, paramsObj.radianceImage, outDEMNameTmp, paramsObj.outFormat, paramsObj.demNoDataVal, gdal.GRA_CubicSpline, paramsObj.warpMemMB)
 
         paramsObj.outDEMName = os.path.join(paramsObj.outFilePath, (paramsObj.outBaseName + "_dem" + paramsObj.outFormatExt))
         print("Output DEM: ", paramsObj.outDEMName)
@@ -1007,20 +1258,54 @@ def prepareDEM(paramsObj):
         rsgislib.imageutils.popImageStats(paramsObj.outDEMName, True, paramsObj.demNoDataVal, True)
 
         # Remove tmp DEM file.
-        rsgisUtils.deleteFileWithBasename(outDEMNameTmp)
+        if paramsObj.demCacheDIR is None:
+            rsgisUtils.deleteFileWithBasename(outDEMNameTmp)
         paramsObj.finalOutFiles["IMAGE_DEM"] = paramsObj.outDEMName
+        paramsObj.demPrepTime = time.time() - demPrepStart
+        print("DEM preparation took {0:.2f} seconds (DEM cache: {1}).".format(paramsObj.demPrepTime, demCacheStatus))
+
+def calcTerrainGeometry(paramsObj):
+    """
+    A function which calculates, in a single pass over the DEM, the terrain geometry (slope,
+    aspect, incidence and exitance angles) if STDSREF is to be calculated and the direct
+    topographic shadow mask if TOPOSHADOW is to be calculated. It is calculated once per
+    scene and shared by the TOPOSHADOW and STDSREF products.
+    """
+    if not paramsObj.terrainGeomCalcd:
+        terrainStart = time.time()
+        terrainGeomImage = None
+        if paramsObj.prodsToCalc["STDSREF"]:
+            terrainGeomImage = os.path.join(paramsObj.tmpPath, paramsObj.outBaseName + "_terraingeom" + paramsObj.outFormatExt)
+        topoShadowImage = None
+        if paramsObj.prodsToCalc["TOPOSHADOW"]:
+            topoShadowImage = os.path.join(paramsObj.outFilePath, paramsObj.outBaseName + "_toposhad" + paramsObj.outFormatExt)
+        paramsObj.terrainGeomImage, topoShadowImage, paramsObj.demMin, paramsObj.demMax, numDEMPasses = paramsObj.sensorClass.calcTerrainGeometry(paramsObj.outDEMName, terrainGeomImage, paramsObj.outFormat, paramsObj.demNoDataVal, outputShadowImage=topoShadowImage)
+        if topoShadowImage is not None:
+            paramsObj.topoShadowImage = topoShadowImage
+        paramsObj.terrainGeomCalcd = True
+        # The DEM passes of the separate steps: slope, incidence and exitance angles (STDSREF);
+        # DEM range, shadow mask and median filter (TOPOSHADOW).
+        numDEMPassesSep = 0
+        if paramsObj.prodsToCalc["STDSREF"]:
+            numDEMPassesSep = numDEMPassesSep + 3
+        if paramsObj.prodsToCalc["TOPOSHADOW"]:
+            numDEMPassesSep = numDEMPassesSep + 3
+        print("Terrain geometry calculated in {0:.2f} seconds ({1} DEM passes, rather than {2} as separate steps).".format(time.time() - terrainStart, numDEMPasses, numDEMPassesSep))
+    return paramsObj.terrainGeomImage
+
+def removeTerrainGeometry(paramsObj):
+    if (paramsObj.terrainGeomImage is not None) and (not paramsObj.debugMode):
+        rsgisUtils = rsgislib.RSGISPyUtils()
+        rsgisUtils.deleteFileWithBasename(paramsObj.terrainGeomImage)
+        paramsObj.terrainGeomImage = None
 
 def calcTopoShadowMask(paramsObj):
     if paramsObj.prodsToCalc["TOPOSHADOW"]:
         rsgisUtils = rsgislib.RSGISPyUtils()
-        outName = paramsObj.outBaseName + "_toposhad" + paramsObj.outFormatExt
-        tmpDEMFile = paramsObj.outDEMNameMsk
-        if paramsObj.fullImgOuts:
-            tmpDEMFile = paramsObj.outDEMName
-        paramsObj.topoShadowImage = paramsObj.sensorClass.generateTopoDirectShadowMask(tmpDEMFile, paramsObj.outFilePath, outName, paramsObj.outFormat, paramsObj.tmpPath)
-        if paramsObj.calcStatsPy:
-            print("Calculating Statistics...")
-            rsgislib.rastergis.populateStats(paramsObj.topoShadowImage, True, True)
+        print("Calculating a direct topographic shadow mask.")
+        # The shadow mask is calculated in the same DEM pass as the terrain geometry (STDSREF).
+        calcTerrainGeometry(paramsObj)
+        addOutputImageStats(paramsObj, paramsObj.topoShadowImage, useRAT=True)
         paramsObj.finalOutFiles["TOPO_SHADOW_MASK"] = paramsObj.topoShadowImage
 
         paramsObj.processStageStr = paramsObj.processStageStr + "_topshad"
@@ -1029,17 +1314,13 @@ def calcTopoShadowMask(paramsObj):
             rsgislib.imageutils.maskImage(paramsObj.radianceImage, paramsObj.topoShadowImage, outputRADImage, paramsObj.outFormat, rsgisUtils.getRSGISLibDataTypeFromImg(paramsObj.radianceImage), 0, 1)
             paramsObj.radianceImage = outputRADImage
             paramsObj.sensorClass.setBandNames(paramsObj.radianceImage)
-            if paramsObj.calcStatsPy:
-                print("Calculating Statistics...")
-                rsgislib.imageutils.popImageStats(paramsObj.radianceImage, True, 0.0, True)
+            addOutputImageStats(paramsObj, paramsObj.radianceImage)
         if paramsObj.prodsToCalc["TOA"]:
             outputTOAImage = os.path.join(paramsObj.outFilePath, paramsObj.outBaseName + paramsObj.processStageStr + "_rad_toa" + paramsObj.outFormatExt)
             rsgislib.imageutils.maskImage(paramsObj.toaImage, paramsObj.topoShadowImage, outputTOAImage, paramsObj.outFormat, rsgisUtils.getRSGISLibDataTypeFromImg(paramsObj.toaImage), 0, 1)
             paramsObj.toaImage = outputTOAImage
             paramsObj.sensorClass.setBandNames(paramsObj.toaImage)
-            if paramsObj.calcStatsPy:
-                print("Calculating Statistics...")
-                rsgislib.imageutils.popImageStats(paramsObj.toaImage, True, 0.0, True)
+            addOutputImageStats(paramsObj, paramsObj.toaImage)
 
         paramsObj.prodsCalculated["TOPOSHADOW"] = True
         print("")
@@ -1062,12 +1343,9 @@ def performDOS(paramsObj):
             paramsObj.sensorClass.setBandNames(paramsObj.srefDOSWholeImage)
             paramsObj.finalOutFiles["SREF_DOS_IMG_WHOLE"] = paramsObj.srefDOSWholeImage
 
-        if paramsObj.calcStatsPy:
-            print("Calculating Statistics...")
-            rsgislib.imageutils.popImageStats(paramsObj.srefDOSImage, True, 0.0, True)
-            if paramsObj.fullImgOuts:
-                rsgislib.imageutils.popImageStats(paramsObj.srefDOSWholeImage, True, 0.0, True)
-            print("")
+        addOutputImageStats(paramsObj, paramsObj.srefDOSImage)
+        if paramsObj.fullImgOuts:
+            addOutputImageStats(paramsObj, paramsObj.srefDOSWholeImage)
         paramsObj.prodsCalculated["DOS"] = True
 
 
@@ -1091,9 +1369,7 @@ def estimateSceneAOT(paramsObj):
         dataset = gdal.Open(paramsObj.aotFile, gdal.GA_Update)
         dataset.GetRasterBand(1).SetDescription("AOT")
         dataset = None
-        if paramsObj.calcStatsPy:
-            print("Calculating Statistics...")
-            rsgislib.imageutils.popImageStats(paramsObj.aotFile, True, 0.0, True)
+        addOutputImageStats(paramsObj, paramsObj.aotFile)
         paramsObj.finalOutFiles["AOTIMG_DDV"] = paramsObj.aotFile
         paramsObj.calcdOutVals['ARCSI_AOT_RANGE_MIN'] = paramsObj.minAOT
         paramsObj.calcdOutVals['ARCSI_AOT_RANGE_MAX'] = paramsObj.maxAOT
@@ -1106,9 +1382,7 @@ def estimateSceneAOT(paramsObj):
         dataset = gdal.Open(paramsObj.aotFile, gdal.GA_Update)
         dataset.GetRasterBand(1).SetDescription("AOT")
         dataset = None
-        if paramsObj.calcStatsPy:
-            print("Calculating Statistics...")
-            rsgislib.imageutils.popImageStats(paramsObj.aotFile, True, 0.0, True)
+        addOutputImageStats(paramsObj, paramsObj.aotFile)
         paramsObj.finalOutFiles["AOTIMG_DOS"] = paramsObj.aotFile
         paramsObj.calcdOutVals['ARCSI_AOT_RANGE_MIN'] = paramsObj.minAOT
         paramsObj.calcdOutVals['ARCSI_AOT_RANGE_MAX'] = paramsObj.maxAOT
@@ -1162,7 +1436,9 @@ def calculateSREF(paramsObj):
             paramsObj.calcdOutVals['ARCSI_LUT_ELEVATION_MIN'] = paramsObj.minElev
             paramsObj.calcdOutVals['ARCSI_LUT_ELEVATION_MAX'] = paramsObj.maxElev
 
-            elevRange = (paramsObj.maxElev - paramsObj.minElev) / 100
+            lutInterp, lutElevStep, lutAOTStep = ARCSI6SCoeffLUT.getLUTConfig()
+            paramsObj.calcdOutVals['ARCSI_LUT_INTERP'] = lutInterp
+            elevRange = (paramsObj.maxElev - paramsObj.minElev) / lutElevStep
             numElevSteps = math.ceil(elevRange) + 1
             print("Elevation Ranges from ", paramsObj.minElev, " to ", paramsObj.maxElev, " an LUT with ", numElevSteps, " will be created.")
 
@@ -1188,7 +1464,7 @@ def calculateSREF(paramsObj):
                 paramsObj.calcdOutVals['ARCSI_LUT_AOT_MIN'] = paramsObj.minAOT
                 paramsObj.calcdOutVals['ARCSI_LUT_AOT_MAX'] = paramsObj.maxAOT
 
-                aotRange = (paramsObj.maxAOT - paramsObj.minAOT) / 0.05
+                aotRange = (paramsObj.maxAOT - paramsObj.minAOT) / lutAOTStep
                 numAOTSteps = math.ceil(aotRange) + 1
                 print("AOT Ranges from ", paramsObj.minAOT, " to ", paramsObj.maxAOT, " an LUT with ", numAOTSteps, " will be created.")
                 paramsObj.processSREFStr = '_rad_srefdemaot'
@@ -1200,17 +1476,20 @@ def calculateSREF(paramsObj):
                 #paramsObj.calcdOutVals['ARCSI_6S_COEFFICENTS'] = paramsObj.sixsLUTCoeffs
                 paramsObj.aotLUT = True
 
+            # Write the LUT of 6S coefficients used so it can be inspected.
+            sixsLUTFile = os.path.join(paramsObj.outFilePath, paramsObj.outBaseName + "_6scoeffs_lut.json")
+            paramsObj.sixsLUTCoeffs.writeJSONFile(sixsLUTFile)
+            paramsObj.finalOutFiles["SIXS_COEFFS_LUT"] = sixsLUTFile
+
         print("Setting Band Names...")
         paramsObj.sensorClass.setBandNames(paramsObj.srefImage)
         if paramsObj.fullImgOuts:
             paramsObj.sensorClass.setBandNames(paramsObj.sref6SWholeImage)
             paramsObj.finalOutFiles["SREF_DOS_IMG_WHOLE"] = paramsObj.sref6SWholeImage
 
-        if paramsObj.calcStatsPy:
-            print("Calculating Statistics...")
-            rsgislib.imageutils.popImageStats(paramsObj.srefImage, True, 0.0, True)
-            if paramsObj.fullImgOuts:
-                rsgislib.imageutils.popImageStats(paramsObj.sref6SWholeImage, True, 0.0, True)
+        addOutputImageStats(paramsObj, paramsObj.srefImage)
+        if paramsObj.fullImgOuts:
+            addOutputImageStats(paramsObj, paramsObj.sref6SWholeImage)
         paramsObj.finalOutFiles["SREF_6S_IMG"] = paramsObj.srefImage
         if paramsObj.fullImgOuts:
             paramsObj.finalOutFiles["SREF_6S_WHOLE_IMG"] = paramsObj.sref6SWholeImage
@@ -1226,18 +1505,17 @@ def calculateStandarisedSREF(paramsObj):
         paramsObj.processSREFStr = paramsObj.processSREFStr + '_stdsref'
         outName = paramsObj.outBaseName + paramsObj.processStageStr + paramsObj.processSREFStr + paramsObj.outFormatExt
         outNameWhole = paramsObj.outBaseName + paramsObj.processStageWholeImgStr + paramsObj.processSREFStr + paramsObj.outFormatExt
-        paramsObj.stdSREFImg, paramsObj.stdSREFWholeImg = paramsObj.sensorClass.convertSREF2StdisedSREF(paramsObj.srefImage, paramsObj.sref6SWholeImage, paramsObj.outDEMName, paramsObj.topoShadowImage, paramsObj.outFilePath, outName, outNameWhole, paramsObj.outFormat, paramsObj.tmpPath, paramsObj.sixsLUTCoeffs, paramsObj.aotLUT, paramsObj.scaleFactor, brdfBeta=1, outIncidenceAngle=0, outExitanceAngle=0)
+        terrainGeomImage = calcTerrainGeometry(paramsObj)
+        paramsObj.stdSREFImg, paramsObj.stdSREFWholeImg = paramsObj.sensorClass.convertSREF2StdisedSREF(paramsObj.srefImage, paramsObj.sref6SWholeImage, paramsObj.outDEMName, paramsObj.topoShadowImage, paramsObj.outFilePath, outName, outNameWhole, paramsObj.outFormat, paramsObj.tmpPath, paramsObj.sixsLUTCoeffs, paramsObj.aotLUT, paramsObj.scaleFactor, brdfBeta=1, outIncidenceAngle=0, outExitanceAngle=0, inputTerrainGeomImg=terrainGeomImage, inputAOTImage=paramsObj.aotFile)
 
         print("Setting Band Names...")
         paramsObj.sensorClass.setBandNames(paramsObj.stdSREFImg)
         if paramsObj.fullImgOuts:
             paramsObj.sensorClass.setBandNames(paramsObj.stdSREFWholeImg)
 
-        if paramsObj.calcStatsPy:
-            print("Calculating Statistics...")
-            rsgislib.imageutils.popImageStats(paramsObj.stdSREFImg, True, 0.0, True)
-            if paramsObj.fullImgOuts:
-                rsgislib.imageutils.popImageStats(paramsObj.stdSREFWholeImg, True, 0.0, True)
+        addOutputImageStats(paramsObj, paramsObj.stdSREFImg)
+        if paramsObj.fullImgOuts:
+            addOutputImageStats(paramsObj, paramsObj.stdSREFWholeImg)
         paramsObj.finalOutFiles["STD_SREF_IMG"] = paramsObj.stdSREFImg
         if paramsObj.fullImgOuts:
             paramsObj.finalOutFiles["STD_SREF_WHOLE_IMG"] = paramsObj.stdSREFWholeImg
@@ -1261,95 +1539,119 @@ def exportMetaData(paramsObj):
         paramsObj.prodsCalculated["METADATA"] = True
         print("")
 
-def runARCSI(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal,atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, fileEnding2Keep, cloud_methods):
+def runARCSI(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal,atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, fileEnding2Keep, cloud_methods, demCacheDIR=None, numThreads=1, maxMemMB=None, previewFactor=None, preScreenMaxCloud=None):
     """
-    A function contains the main flow of the software
+    A function contains the main flow of the software.
+    Returns the parameters object for the scene (None if it could not be created).
     """
+    prevGDALCacheMax = gdal.GetCacheMax()
     try:
         # Initialise and parameters object.
         paramsObj = None
-        paramsObj = prepParametersObj(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal,atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, fileEnding2Keep, cloud_methods)
+        paramsObj = prepParametersObj(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal,atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, fileEnding2Keep, cloud_methods, demCacheDIR, numThreads, maxMemMB, previewFactor, preScreenMaxCloud)
+        ARCSIProfileLookup.flushCacheFile()
+        # Set the GDAL block cache for the memory budget (restored below).
+        setGDALCacheMax(paramsObj)
+        startMemUsage(paramsObj)
 
         # Check Input image(s) is valid before proceeding.
         checkForValidInput(paramsObj)
 
-        # Check if bands need resampling
-        resampleBands(paramsObj)
+        # Pre-screen the scene so it can be skipped before the full resolution processing.
+        preScreenScene(paramsObj)
+
+        if not paramsObj.sceneSkipped:
+            # Decimate the input images for a preview run.
+            createPreviewImages(paramsObj)
+
+            # Decode the input image bands if slow to read.
+            prefetchInputBands(paramsObj)
 
-        # Check if the image data needs mosaicking.
-        mosaicInputImages(paramsObj)
+            # Check if bands need resampling
+            resampleBands(paramsObj)
 
-        # Create valid image area mask and view angle images
-        createValidMaskViewAngle(paramsObj)
+            # Check if the image data needs mosaicking.
+            mosaicInputImages(paramsObj)
 
-        # Create Vector Footprint
-        createFootprint(paramsObj)
+            # Create valid image area mask and view angle images
+            createValidMaskViewAngle(paramsObj)
 
-        # Create Saturated image
-        createSaturatedImage(paramsObj)
+            # Create Vector Footprint
+            createFootprint(paramsObj)
 
-        # Convert imagery to radiance
-        convertInputImageToRadiance(paramsObj)
+            # Create Saturated image
+            createSaturatedImage(paramsObj)
 
-        # Calculate Thermal Brightness
-        calcThermalBrightness(paramsObj)
+            # Convert imagery to radiance
+            convertInputImageToRadiance(paramsObj)
 
-        # Calculate TOA Reflectance
-        calcTOAReflectance(paramsObj)
+            # Calculate Thermal Brightness
+            calcThermalBrightness(paramsObj)
 
-        # Save the process stage string for using with whole image outputs.
-        paramsObj.processStageWholeImgStr = paramsObj.processStageStr
+            # Calculate TOA Reflectance
+            calcTOAReflectance(paramsObj)
 
-        # Perform a cloud masking
-        performCloudMasking(paramsObj)
+            # Save the process stage string for using with whole image outputs.
+            paramsObj.processStageWholeImgStr = paramsObj.processStageStr
+
+            # Perform a cloud masking
+            performCloudMasking(paramsObj)
         
-        # Don't continue further if there is more than 95% cloud cover in the scene.
-        if  (not paramsObj.prodsToCalc["CLOUDS"]) or (paramsObj.prodsToCalc["CLOUDS"] and paramsObj.propOfCloud < 0.95):
-            # Perform clear sky masking
-            performClearSkyMasking(paramsObj)
+            # Don't continue further if there is more than 95% cloud cover in the scene.
+            if  (not paramsObj.prodsToCalc["CLOUDS"]) or (paramsObj.prodsToCalc["CLOUDS"] and paramsObj.propOfCloud < 0.95):
+                # Perform clear sky masking
+                performClearSkyMasking(paramsObj)
             
-            # Don't continue further if there is less than 5% of the scene of clear sky
-            if (not paramsObj.prodsToCalc["CLEARSKY"]) or (paramsObj.prodsToCalc["CLEARSKY"] and paramsObj.propOfClearSky > 0.05):
-                # Prepare the DEM for later processing stages.
-                prepareDEM(paramsObj)
+                # Don't continue further if there is less than 5% of the scene of clear sky
+                if (not paramsObj.prodsToCalc["CLEARSKY"]) or (paramsObj.prodsToCalc["CLEARSKY"] and paramsObj.propOfClearSky > 0.05):
+                    # Prepare the DEM for later processing stages.
+                    prepareDEM(paramsObj)
 
-                # Calculate Topographic shadow mask
-                calcTopoShadowMask(paramsObj)
+                    # Calculate Topographic shadow mask
+                    calcTopoShadowMask(paramsObj)
 
-                # Perfrom Dark Object Subtraction (DOS)
-                performDOS(paramsObj)
+                    # Perfrom Dark Object Subtraction (DOS)
+                    performDOS(paramsObj)
 
-                # Estimate AOT for the scene
-                estimateSceneAOT(paramsObj)
+                    # Estimate AOT for the scene
+                    estimateSceneAOT(paramsObj)
 
-                # Calculate SREF
-                calculateSREF(paramsObj)
+                    # Calculate SREF
+                    calculateSREF(paramsObj)
 
-                # Calculate Standarised SREF
-                calculateStandarisedSREF(paramsObj)
+                    # Calculate Standarised SREF
+                    calculateStandarisedSREF(paramsObj)
 
+                else:
+                    keys2Del = []
+                    for key in paramsObj.prodsToCalc.keys():
+                        if paramsObj.prodsToCalc[key] is not paramsObj.prodsCalculated[key]:
+                            if key in ['DDVAOT', 'DOSAOT', 'DOSAOTSGL', 'SREF', 'DOS', 'STDSREF', 'TOPOSHADOW']:
+                                keys2Del.append(key)
+                    for key in keys2Del:
+                        del paramsObj.prodsToCalc[key]
             else:
                 keys2Del = []
                 for key in paramsObj.prodsToCalc.keys():
                     if paramsObj.prodsToCalc[key] is not paramsObj.prodsCalculated[key]:
-                        if key in ['DDVAOT', 'DOSAOT', 'DOSAOTSGL', 'SREF', 'DOS', 'STDSREF', 'TOPOSHADOW']:
+                        if key in ['CLEARSKY', 'DDVAOT', 'DOSAOT', 'DOSAOTSGL', 'SREF', 'DOS', 'STDSREF', 'TOPOSHADOW']:
                             keys2Del.append(key)
                 for key in keys2Del:
                     del paramsObj.prodsToCalc[key]
-        else:
-            keys2Del = []
-            for key in paramsObj.prodsToCalc.keys():
-                if paramsObj.prodsToCalc[key] is not paramsObj.prodsCalculated[key]:
-                    if key in ['CLEARSKY', 'DDVAOT', 'DOSAOT', 'DOSAOTSGL', 'SREF', 'DOS', 'STDSREF', 'TOPOSHADOW']:
-                        keys2Del.append(key)
-            for key in keys2Del:
-                del paramsObj.prodsToCalc[key]
 
         # Export metadata output file.
         exportMetaData(paramsObj)
 
         print('Clean up anything left over...')
+        removeTerrainGeometry(paramsObj)
+        removePreviewImages(paramsObj)
         paramsObj.sensorClass.cleanFollowProcessing(paramsObj.outFilePath, paramsObj.fileEnding2Keep)
+
+        # Calculate the statistics and pyramids for the final outputs.
+        calcOutputImageStats(paramsObj)
+
+        # Report the peak memory used for the scene.
+        reportMemUsage(paramsObj)
         
     except ARCSIException as e:
         print('Input Header: \'' + inputHeader + '\'', file=sys.stderr)
@@ -1378,88 +1680,107 @@ def runARCSI(inputHeader, inputImage, cloudMaskUsrImg, sensorStr, inWKTFile, out
                 print('Input Header: \'' + inputHeader + '\'', file=sys.stderr)
                 if paramsObj.outBaseName is not None:
                     print('Output Basename: \'' + paramsObj.outBaseName + '\'', file=sys.stderr)
+        # Restore the GDAL block cache set by setGDALCacheMax.
+        gdal.SetCacheMax(prevGDALCacheMax)
+    return paramsObj
 
 def _runARCSIPart1(paramsObj):
+    prevGDALCacheMax = setGDALCacheMax(paramsObj)
     try:
+        startMemUsage(paramsObj)
+
          # Check Input image(s) is valid before proceeding.
         checkForValidInput(paramsObj)
 
-        # Check if bands need resampling
-        resampleBands(paramsObj)
+        # Pre-screen the scene so it can be skipped before the full resolution processing.
+        preScreenScene(paramsObj)
+
+        if not paramsObj.sceneSkipped:
+            # Decimate the input images for a preview run.
+            createPreviewImages(paramsObj)
+
+            # Decode the input image bands if slow to read.
+            prefetchInputBands(paramsObj)
 
-        # Check if the image data needs mosaicking.
-        mosaicInputImages(paramsObj)
+            # Check if bands need resampling
+            resampleBands(paramsObj)
 
-        # Create valid image area mask and view angle images
-        createValidMaskViewAngle(paramsObj)
+            # Check if the image data needs mosaicking.
+            mosaicInputImages(paramsObj)
 
-        # Create Vector Footprint
-        createFootprint(paramsObj)
+            # Create valid image area mask and view angle images
+            createValidMaskViewAngle(paramsObj)
 
-        # Create Saturated image
-        createSaturatedImage(paramsObj)
+            # Create Vector Footprint
+            createFootprint(paramsObj)
 
-        # Convert imagery to radiance
-        convertInputImageToRadiance(paramsObj)
+            # Create Saturated image
+            createSaturatedImage(paramsObj)
 
-        # Calculate Thermal Brightness
-        calcThermalBrightness(paramsObj)
+            # Convert imagery to radiance
+            convertInputImageToRadiance(paramsObj)
 
-        # Calculate TOA Reflectance
-        calcTOAReflectance(paramsObj)
+            # Calculate Thermal Brightness
+            calcThermalBrightness(paramsObj)
 
-        # Save the process stage string for using with whole image outputs.
-        paramsObj.processStageWholeImgStr = paramsObj.processStageStr
+            # Calculate TOA Reflectance
+            calcTOAReflectance(paramsObj)
 
-        # Perform a cloud masking
-        performCloudMasking(paramsObj)
+            # Save the process stage string for using with whole image outputs.
+            paramsObj.processStageWholeImgStr = paramsObj.processStageStr
+
+            # Perform a cloud masking
+            performCloudMasking(paramsObj)
         
-        # Don't continue further if there is more than 95% cloud cover in the scene.
-        if  (not paramsObj.prodsToCalc["CLOUDS"]) or (paramsObj.prodsToCalc["CLOUDS"] and paramsObj.propOfCloud < 0.95):
-            # Perform clear sky masking
-            performClearSkyMasking(paramsObj)
+            # Don't continue further if there is more than 95% cloud cover in the scene.
+            if  (not paramsObj.prodsToCalc["CLOUDS"]) or (paramsObj.prodsToCalc["CLOUDS"] and paramsObj.propOfCloud < 0.95):
+                # Perform clear sky masking
+                performClearSkyMasking(paramsObj)
             
-            # Don't continue further if there is less than 5% of the scene of clear sky
-            if (not paramsObj.prodsToCalc["CLEARSKY"]) or (paramsObj.prodsToCalc["CLEARSKY"] and paramsObj.propOfClearSky > 0.05):
-                # Prepare the DEM for later processing stages.
-                prepareDEM(paramsObj)
+                # Don't continue further if there is less than 5% of the scene of clear sky
+                if (not paramsObj.prodsToCalc["CLEARSKY"]) or (paramsObj.prodsToCalc["CLEARSKY"] and paramsObj.propOfClearSky > 0.05):
+                    # Prepare the DEM for later processing stages.
+                    prepareDEM(paramsObj)
 
-                # Calculate Topographic shadow mask
-                calcTopoShadowMask(paramsObj)
+                    # Calculate Topographic shadow mask
+                    calcTopoShadowMask(paramsObj)
 
-                # Perfrom Dark Object Subtraction (DOS)
-                performDOS(paramsObj)
+                    # Perfrom Dark Object Subtraction (DOS)
+                    performDOS(paramsObj)
 
-                # Estimate AOT for the scene
-                estimateSceneAOT(paramsObj)
+                    # Estimate AOT for the scene
+                    estimateSceneAOT(paramsObj)
+                else:
+                    keys2Del = []
+                    for key in paramsObj.prodsToCalc.keys():
+                        if paramsObj.prodsToCalc[key] is not paramsObj.prodsCalculated[key]:
+                            if key in ['DDVAOT', 'DOSAOT', 'DOSAOTSGL', 'SREF', 'DOS', 'STDSREF', 'TOPOSHADOW']:
+                                keys2Del.append(key)
+                    for key in keys2Del:
+                        del paramsObj.prodsToCalc[key]
             else:
                 keys2Del = []
                 for key in paramsObj.prodsToCalc.keys():
                     if paramsObj.prodsToCalc[key] is not paramsObj.prodsCalculated[key]:
-                        if key in ['DDVAOT', 'DOSAOT', 'DOSAOTSGL', 'SREF', 'DOS', 'STDSREF', 'TOPOSHADOW']:
+                        if key in ['CLEARSKY', 'DDVAOT', 'DOSAOT', 'DOSAOTSGL', 'SREF', 'DOS', 'STDSREF', 'TOPOSHADOW']:
                             keys2Del.append(key)
                 for key in keys2Del:
                     del paramsObj.prodsToCalc[key]
-        else:
-            keys2Del = []
-            for key in paramsObj.prodsToCalc.keys():
-                if paramsObj.prodsToCalc[key] is not paramsObj.prodsCalculated[key]:
-                    if key in ['CLEARSKY', 'DDVAOT', 'DOSAOT', 'DOSAOTSGL', 'SREF', 'DOS', 'STDSREF', 'TOPOSHADOW']:
-                        keys2Del.append(key)
-            for key in keys2Del:
-                del paramsObj.prodsToCalc[key]
         
     except ARCSIException as e:
         print("Error: {}".format(e), file=sys.stderr)
     except Exception as e:
         print("Error: {}".format(e), file=sys.stderr)
+    finally:
+        gdal.SetCacheMax(prevGDALCacheMax)
 
     return paramsObj
 
 def _runARCSIPart2(paramsObj):
+    prevGDALCacheMax = setGDALCacheMax(paramsObj)
     try:
-        # Don't continue further if there is more than 95% cloud cover in the scene.
-        if  (not paramsObj.prodsToCalc["CLOUDS"]) or (paramsObj.prodsToCalc["CLOUDS"] and paramsObj.propOfCloud < 0.95):
+        # Don't continue further if the scene was skipped or there is more than 95% cloud cover in the scene.
+        if (not paramsObj.sceneSkipped) and ((not paramsObj.prodsToCalc["CLOUDS"]) or (paramsObj.prodsToCalc["CLOUDS"] and paramsObj.propOfCloud < 0.95)):
             # Don't continue further if there is less than 5% of the scene of clear sky
             if (not paramsObj.prodsToCalc["CLEARSKY"]) or (paramsObj.prodsToCalc["CLEARSKY"] and paramsObj.propOfClearSky > 0.05):
 
@@ -1473,28 +1794,44 @@ def _runARCSIPart2(paramsObj):
         print("Error: {}".format(e), file=sys.stderr)
     except Exception as e:
         print("Error: {}".format(e), file=sys.stderr)
+    finally:
+        gdal.SetCacheMax(prevGDALCacheMax)
     return paramsObj
 
 def _runARCSIPart3(paramsObj):
+    prevGDALCacheMax = setGDALCacheMax(paramsObj)
     try:
         exportMetaData(paramsObj)
     except ARCSIException as e:
         print("Error: {}".format(e), file=sys.stderr)
     except Exception as e:
         print("Error: {}".format(e), file=sys.stderr)
+    finally:
+        gdal.SetCacheMax(prevGDALCacheMax)
     return paramsObj
 
 def _runARCSIPart4(paramsObj):
+    prevGDALCacheMax = setGDALCacheMax(paramsObj)
     try:
         print('Clean up anything left over...')
+        removeTerrainGeometry(paramsObj)
+        removePreviewImages(paramsObj)
         paramsObj.sensorClass.cleanFollowProcessing(paramsObj.outFilePath, paramsObj.fileEnding2Keep)
+
+        # Calculate the statistics and pyramids for the final outputs.
+        calcOutputImageStats(paramsObj)
+
+        # Report the peak memory used for the scene.
+        reportMemUsage(paramsObj)
     except ARCSIException as e:
         print("Error: {}".format(e), file=sys.stderr)
     except Exception as e:
         print("Error: {}".format(e), file=sys.stderr)
+    finally:
+        gdal.SetCacheMax(prevGDALCacheMax)
     return paramsObj
 
-def runARCSIMulti(inputHeaders, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal,atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, ncores, fileEnding2Keep, cloud_methods):
+def runARCSIMulti(inputHeaders, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal,atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, ncores, fileEnding2Keep, cloud_methods, demCacheDIR=None, numThreads=1, maxMemMB=None, previewFactor=None, preScreenMaxCloud=None):
     """
     A function contains the main flow of the software
     """
@@ -1511,7 +1848,7 @@ def runARCSIMulti(inputHeaders, sensorStr, inWKTFile, outFormat, outFilePath, ou
             print(inputHeader)
             # Initialise and parameters object.
             paramsObj = None
-            paramsObj = prepParametersObj(inputHeader, None, None, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal,atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, fileEnding2Keep, cloud_methods)
+            paramsObj = prepParametersObj(inputHeader, None, None, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal,atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, fileEnding2Keep, cloud_methods, demCacheDIR, numThreads, maxMemMB, previewFactor, preScreenMaxCloud)
             paramsLst.append(paramsObj)
             if first:
                 if paramsObj.prodsToCalc["DDVAOT"] or paramsObj.prodsToCalc["DOSAOT"] or paramsObj.prodsToCalc["DOSAOTSGL"]:
@@ -1523,9 +1860,14 @@ def runARCSIMulti(inputHeaders, sensorStr, inWKTFile, outFormat, outFilePath, ou
                 if paramsObj.prodsToCalc["METADATA"]:
                     exportMetaData = True
                 first = False
+        ARCSIProfileLookup.flushCacheFile()
 
         plObj = Pool(ncores)
         paramsLst = plObj.map(_runARCSIPart1, paramsLst)
+        for paramsObj in paramsLst:
+            # A skipped scene always exports the meta-data file with the skip reason.
+            if paramsObj.sceneSkipped:
+                exportMetaData = True
         
         if calcAOT:
             if useAOTImage:
@@ -1562,6 +1904,30 @@ def runARCSIMulti(inputHeaders, sensorStr, inWKTFile, outFormat, outFilePath, ou
         if debugMode:
             raise
 
+def runARCSIPlan(inputHeadersLst, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal,atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, fileEnding2Keep, cloud_methods, demCacheDIR=None, numThreads=1, maxMemMB=None, previewFactor=None, planOutFile=None):
+    """
+    A function which plans (dry run) the processing of a list of scenes, estimating
+    the number of 6S runs, the disk space and the run time without processing any
+    of the image pixels.
+    """
+    try:
+        scenePlans = []
+        for inputHeader in inputHeadersLst:
+            print("Planning: " + inputHeader)
+            paramsObj = prepParametersObj(inputHeader, None, None, sensorStr, inWKTFile, outFormat, outFilePath, outBaseName, outWKTFile, outProj4File, projAbbv, xPxlResUsr, yPxlResUsr, productsStr, calcStatsPy, aeroProfileOption, atmosProfileOption, aeroProfileOptionImg, atmosProfileOptionImg,  grdReflOption, surfaceAltitude, atmosOZoneVal,atmosWaterVal, atmosOZoneWaterSpecified, aeroWaterVal, aeroDustVal, aeroOceanicVal, aeroSootVal, aeroComponentsSpecified, aotVal, visVal, tmpPath, minAOT, maxAOT, lowAOT, upAOT, demFile, demNoDataUsrVal, aotFile, globalDOS, dosOutRefl, simpleDOS, debugMode, scaleFactor, interpAlgor, interpAlgorResample, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, clearSkyMorphSize, fullImgOuts, checkOutputs, classmlclouds, cloudtrainclouds, cloudtrainother, resample2LowResImg, fileEnding2Keep, cloud_methods, demCacheDIR, numThreads, maxMemMB, previewFactor)
+            scenePlans.append(arcsilib.arcsiplanner.planARCSIScene(paramsObj))
+        ARCSIProfileLookup.flushCacheFile()
+        print("")
+        arcsilib.arcsiplanner.printARCSIPlan(scenePlans, planOutFile)
+    except ARCSIException as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        if debugMode:
+            raise
+    except Exception as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        if debugMode:
+            raise
+
 def print2ConsoleListSensors():
     """
     A function which lists the currently supported sensors
@@ -1616,4 +1982,34 @@ def print2ConsoleListEnvVars():
     print("ARCSI_USE_SIMPLEDOS    in place of the --simpledos (variable ")
     print("                       values can be either `TRUE' or `FALSE') option")
     print("ARCSI_SCALE_FACTOR     in place of the --scalefac option")
+    print("ARCSI_DEM_CACHE        in place of the --demcache option")
+    print("ARCSI_NUM_THREADS      in place of the --nthreads option")
+    print("ARCSI_MAX_MEMORY       in place of the --maxmem option")
+    print("ARCSI_PRESCREEN_MAX_CLOUD  in place of the --prescreencloud option")
+    print("ARCSI_PROFILE_CACHE    a JSON file used to cache the aerosol and")
+    print("                       atmosphere profiles found from the --aeroimg")
+    print("                       and --atmosimg images between runs.")
+    print("ARCSI_SEG_CACHE        a directory used to store the image segmentation")
+    print("                       (used for the DOS AOT estimation), the clear-sky")
+    print("                       regions and the local DOS clumps so they are reused")
+    print("                       while the image content is unchanged.")
+    print("ARCSI_SEG_RESOLUTION   the resolution at which the image segmentation is")
+    print("                       produced (Default: the image resolution).")
+    print("ARCSI_LUT_INTERP       the look up of the 6S coefficients from the LUT:")
+    print("                       `NEAREST' (Default; the nearest node) or `LINEAR'")
+    print("                       (bilinear interpolation between the nodes).")
+    print("ARCSI_LUT_ELEV_STEP    the elevation step (metres) between the LUT nodes")
+    print("                       (Default: 100).")
+    print("ARCSI_LUT_AOT_STEP     the AOT step between the LUT nodes (Default: 0.05).")
+    print("ARCSI_PREVIEW          in place of the --preview option")
+    print("ARCSI_SREF_BACKEND     the backend used to apply the 6S coefficients:")
+    print("                       `RSGISLIB' (Default), `NUMPY' (block-wise numpy)")
+    print("                       or `VALIDATE' (both, reporting the differences")
+    print("                       and throughput of the two backends).")
+    print("ARCSI_STDSREF_BACKEND  the backend used to calculate the standardised")
+    print("                       reflectance: `RSGISLIB' (Default), `NUMPY' (single")
+    print("                       block-wise pass) or `VALIDATE' (both, reporting")
+    print("                       the differences and runtimes of the two backends;")
+    print("                       with an AOT LUT, which only `NUMPY' supports, the")
+    print("                       elevation LUT at the mean AOT is compared).")
     print("")
@@ -86,6 +86,10 @@ import sys
 import rsgislib.imagemorphology
 # Import the RSGISLib import image utils module
 import rsgislib.imageutils
+# Import the python thread pool
+from multiprocessing.pool import ThreadPool
+# Import the python time module
+import time
 
 class ARCSISen2SpectralBandObj(object):
     """
@@ -146,6 +150,7 @@ class ARCSISentinel2Sensor (ARCSIAbstractSensor):
         self.sen2ImgB8A_10m = None
         self.sen2ImgB11_10m = None
         self.sen2ImgB12_10m = None
+        self.sen2DecodedImgs = []
 
         self.inNoDataVal = 0
         self.inSatDataVal = 65535
@@ -201,11 +206,10 @@ class ARCSISentinel2Sensor (ARCSIAbstractSensor):
         
         """
         valuesList = valuesListNode.findall('VALUES')
-        vals = []
-        for valNode in valuesList:
-            text = valNode.text
-            vals.append([numpy.float32(x) for x in text.strip().split()])
-        return numpy.array(vals)
+        # Convert all the values with a single numpy call rather than value by value.
+        nRows = len(valuesList)
+        vals = numpy.array(' '.join([valNode.text for valNode in valuesList]).split(), dtype=numpy.float32)
+        return vals.reshape((nRows, -1))
 
     def buildViewAngleArr(self, viewingAngleNodeList, angleName):
         """
@@ -229,6 +233,49 @@ class ARCSISentinel2Sensor (ARCSIAbstractSensor):
         return angleArrDict
     ################################
 
+    @staticmethod
+    def readXMLSection(xmlFile, sectionTags):
+        """
+        Incrementally parse (iterparse) the XML file and return the first top level
+        element (i.e., child of the root) with a tag in the list sectionTags. Top
+        level elements which are not needed are cleared as they are parsed and
+        parsing stops once the section has been read, so the rest of the file is
+        not parsed. None is returned if the section is not found.
+        """
+        outElem = None
+        depth = 0
+        with open(xmlFile, 'rb') as xmlFileObj:
+            for event, elem in ET.iterparse(xmlFileObj, events=('start', 'end')):
+                if event == 'start':
+                    depth = depth + 1
+                else:
+                    depth = depth - 1
+                    if depth == 1:
+                        if elem.tag in sectionTags:
+                            outElem = elem
+                            break
+                        elem.clear()
+        return outElem
+
+    def getMetadataCloudCover(self):
+        """
+        Get the proportion (0-1) of the scene covered by cloud from the product header
+        (Cloud_Coverage_Assessment). The Quality_Indicators_Info section is only read
+        when needed as it is not used for the processing.
+        """
+        qualityInfoPSD14 = '{https://psd-14.sentinel2.eo.esa.int/PSD/User_Product_Level-1C.xsd}Quality_Indicators_Info'
+        qualityInfoPSD13 = '{https://psd-13.sentinel2.eo.esa.int/PSD/User_Product_Level-1C.xsd}Quality_Indicators_Info'
+        qualityInfoTag = self.readXMLSection(os.path.join(self.sen2FileBaseDIR, self.headerFileName), [qualityInfoPSD14, qualityInfoPSD13])
+        if qualityInfoTag is None:
+            return None
+        cloudCoverTag = qualityInfoTag.find('Cloud_Coverage_Assessment')
+        if (cloudCoverTag is None) or (cloudCoverTag.text is None):
+            return None
+        cloudCover = ARCSIUtils().str2Float(cloudCoverTag.text.strip(), -1.0)
+        if cloudCover < 0:
+            return None
+        return cloudCover / 100
+
     def extractHeaderParameters(self, inputHeader, wktStr):
         """
         Understands and parses the Sentinel-2 xml header file
@@ -239,18 +286,16 @@ class ARCSISentinel2Sensor (ARCSIAbstractSensor):
             self.headerFileName = os.path.split(inputHeader)[1]
             self.sen2FileBaseDIR = os.path.split(inputHeader)[0]
             
-            tree = ET.parse(inputHeader)
-            root = tree.getroot()
+            # Only the General_Info section of the header is needed.
+            generalInfoPSD14 = '{https://psd-14.sentinel2.eo.esa.int/PSD/User_Product_Level-1C.xsd}General_Info'
+            generalInfoPSD13 = '{https://psd-13.sentinel2.eo.esa.int/PSD/User_Product_Level-1C.xsd}General_Info'
+            generalInfoTag = self.readXMLSection(inputHeader, [generalInfoPSD14, generalInfoPSD13])
 
             hdrFileVersion = 'psd14'
-
-            generalInfoTag = root.find('{https://psd-14.sentinel2.eo.esa.int/PSD/User_Product_Level-1C.xsd}General_Info')
-            if generalInfoTag == None:
-                generalInfoTag = root.find('{https://psd-13.sentinel2.eo.esa.int/PSD/User_Product_Level-1C.xsd}General_Info')
-                if generalInfoTag == None:
-                    raise ARCSIException("Cannot open top level section \'General_Info\' - is this really a Sentinel-2 image file?")
-                else:
-                    hdrFileVersion = 'psd13'
+            if generalInfoTag is None:
+                raise ARCSIException("Cannot open top level section \'General_Info\' - is this really a Sentinel-2 image file?")
+            elif generalInfoTag.tag == generalInfoPSD13:
+                hdrFileVersion = 'psd13'
             else:
                 hdrFileVersion = 'psd14'
 
@@ -709,16 +754,11 @@ class ARCSISentinel2Sensor (ARCSIAbstractSensor):
             else:
                 raise ARCSIException("Do not recognised header format: '" + hdrFileVersion +"'")
 
-            tree = ET.parse(granuleHdr)
-            root = tree.getroot()
-
-            # Get Geometric Info Tag
-            geometricInfoTag = None
-
-            # Try for diffrent versions
+            # Get Geometric Info Tag (only section of the granule header which is needed), trying for diffrent versions
+            geometricInfoTags = []
             for hdr_format_version in [12, 14]:
-                if geometricInfoTag is None:
-                    geometricInfoTag = root.find('{{https://psd-{}.sentinel2.eo.esa.int/PSD/S2_PDI_Level-1C_Tile_Metadata.xsd}}Geometric_Info'.format(hdr_format_version))
+                geometricInfoTags.append('{{https://psd-{}.sentinel2.eo.esa.int/PSD/S2_PDI_Level-1C_Tile_Metadata.xsd}}Geometric_Info'.format(hdr_format_version))
+            geometricInfoTag = self.readXMLSection(granuleHdr, geometricInfoTags)
 
             # If not found raise exception
             if geometricInfoTag is None:
@@ -962,34 +1002,72 @@ class ARCSISentinel2Sensor (ARCSIAbstractSensor):
     def mosaicImageTiles(self, outputPath):
         raise ARCSIException("Image data does not need mosaicking")
 
+    def getInputImgBandAttrs(self):
+        return ['sen2ImgB01', 'sen2ImgB02', 'sen2ImgB03', 'sen2ImgB04', 'sen2ImgB05', 'sen2ImgB06', 'sen2ImgB07', 'sen2ImgB8A', 'sen2ImgB08', 'sen2ImgB09', 'sen2ImgB10', 'sen2ImgB11', 'sen2ImgB12']
+
+    def prefetchImgBands(self, outputPath):
+        """
+        Decode the JPEG2000 image bands concurrently (within the thread budget) to KEA
+        files so the following steps (i.e., resampleImgRes, generateValidImageDataMask
+        and generateCloudMask) read the decoded bands. Only used if more than one thread
+        is available as the decoded bands need additional disk space.
+        """
+        if self.numThreads < 2:
+            return False
+        bandNames = ['B01', 'B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B8A', 'B08', 'B09', 'B10', 'B11', 'B12']
+        jp2Bands = []
+        for bandName in bandNames:
+            bandImg = getattr(self, 'sen2Img' + bandName)
+            if os.path.splitext(bandImg)[1].lower() == '.jp2':
+                jp2Bands.append(bandName)
+        if len(jp2Bands) == 0:
+            return False
+
+        outBaseName = self.generateOutputBaseName()
+        decodeJobs = []
+        for bandName in jp2Bands:
+            decodedImg = os.path.join(outputPath, outBaseName + '_' + bandName + '_decoded.kea')
+            decodeJobs.append((getattr(self, 'sen2Img' + bandName), decodedImg))
+        print("Decoding the Sentinel-2 JPEG2000 image bands.")
+        self.decodeImgBands(decodeJobs)
+        for bandName, decodeJob in zip(jp2Bands, decodeJobs):
+            setattr(self, 'sen2Img' + bandName, decodeJob[1])
+            self.sen2DecodedImgs.append(decodeJob[1])
+        return True
+
     def resampleImgRes(self, outputPath, resampleToLowResImg, resampleMethod='cubic', multicore=False):
         outBaseName = self.generateOutputBaseName()
+        resampleJobs = []
         if resampleToLowResImg:
             # Resample to 20 m
             self.sen2ImgB02_20m = os.path.join(outputPath, outBaseName+'_B02_20m.kea')
-            rsgislib.imageutils.resampleImage2Match(self.sen2ImgB05, self.sen2ImgB02, self.sen2ImgB02_20m, 'KEA', resampleMethod, rsgislib.TYPE_16UINT, 0.0, multicore)
+            resampleJobs.append((self.sen2ImgB05, self.sen2ImgB02, self.sen2ImgB02_20m))
             self.sen2ImgB03_20m = os.path.join(outputPath, outBaseName+'_B03_20m.kea')
-            rsgislib.imageutils.resampleImage2Match(self.sen2ImgB05, self.sen2ImgB03, self.sen2ImgB03_20m, 'KEA', resampleMethod, rsgislib.TYPE_16UINT, 0.0, multicore)
+            resampleJobs.append((self.sen2ImgB05, self.sen2ImgB03, self.sen2ImgB03_20m))
             self.sen2ImgB04_20m = os.path.join(outputPath, outBaseName+'_B04_20m.kea')
-            rsgislib.imageutils.resampleImage2Match(self.sen2ImgB05, self.sen2ImgB04, self.sen2ImgB04_20m, 'KEA', resampleMethod, rsgislib.TYPE_16UINT, 0.0, multicore)
+            resampleJobs.append((self.sen2ImgB05, self.sen2ImgB04, self.sen2ImgB04_20m))
             self.sen2ImgB08_20m = os.path.join(outputPath, outBaseName+'_B08_20m.kea')
-            rsgislib.imageutils.resampleImage2Match(self.sen2ImgB05, self.sen2ImgB08, self.sen2ImgB08_20m, 'KEA', resampleMethod, rsgislib.TYPE_16UINT, 0.0, multicore)
+            resampleJobs.append((self.sen2ImgB05, self.sen2ImgB08, self.sen2ImgB08_20m))
             self.resampleTo20m = True
         else:
             # Resample to 10 m
             self.sen2ImgB05_10m = os.path.join(outputPath, outBaseName+'_B05_10m.kea')
-            rsgislib.imageutils.resampleImage2Match(self.sen2ImgB02, self.sen2ImgB05, self.sen2ImgB05_10m, 'KEA', resampleMethod, rsgislib.TYPE_16UINT, 0.0, multicore)
+            resampleJobs.append((self.sen2ImgB02, self.sen2ImgB05, self.sen2ImgB05_10m))
             self.sen2ImgB06_10m = os.path.join(outputPath, outBaseName+'_B06_10m.kea')
-            rsgislib.imageutils.resampleImage2Match(self.sen2ImgB02, self.sen2ImgB06, self.sen2ImgB06_10m, 'KEA', resampleMethod, rsgislib.TYPE_16UINT, 0.0, multicore)
+            resampleJobs.append((self.sen2ImgB02, self.sen2ImgB06, self.sen2ImgB06_10m))
             self.sen2ImgB07_10m = os.path.join(outputPath, outBaseName+'_B07_10m.kea')
-            rsgislib.imageutils.resampleImage2Match(self.sen2ImgB02, self.sen2ImgB07, self.sen2ImgB07_10m, 'KEA', resampleMethod, rsgislib.TYPE_16UINT, 0.0, multicore)
+            resampleJobs.append((self.sen2ImgB02, self.sen2ImgB07, self.sen2ImgB07_10m))
             self.sen2ImgB8A_10m = os.path.join(outputPath, outBaseName+'_B08A_10m.kea')
-            rsgislib.imageutils.resampleImage2Match(self.sen2ImgB02, self.sen2ImgB8A, self.sen2ImgB8A_10m, 'KEA', resampleMethod, rsgislib.TYPE_16UINT, 0.0, multicore)
+            resampleJobs.append((self.sen2ImgB02, self.sen2ImgB8A, self.sen2ImgB8A_10m))
             self.sen2ImgB11_10m = os.path.join(outputPath, outBaseName+'_B11_10m.kea')
-            rsgislib.imageutils.resampleImage2Match(self.sen2ImgB02, self.sen2ImgB11, self.sen2ImgB11_10m, 'KEA', resampleMethod, rsgislib.TYPE_16UINT, 0.0, multicore)
+            resampleJobs.append((self.sen2ImgB02, self.sen2ImgB11, self.sen2ImgB11_10m))
             self.sen2ImgB12_10m = os.path.join(outputPath, outBaseName+'_B12_10m.kea')
-            rsgislib.imageutils.resampleImage2Match(self.sen2ImgB02, self.sen2ImgB12, self.sen2ImgB12_10m, 'KEA', resampleMethod, rsgislib.TYPE_16UINT, 0.0, multicore)
+            resampleJobs.append((self.sen2ImgB02, self.sen2ImgB12, self.sen2ImgB12_10m))
             self.resampleTo20m = False
+        numThreads = 1
+        if multicore:
+            numThreads = self.numThreads
+        self.resampleImgBands(resampleJobs, resampleMethod, rsgislib.TYPE_16UINT, 0.0, numThreads)
 
     def sharpenLowResRadImgBands(self, inputImg, outputImage, outFormat):
         bandInfo = []
@@ -1215,36 +1293,28 @@ class ARCSISentinel2Sensor (ARCSIAbstractSensor):
             tmpDIRExisted = False
 
         #########################################################################################################
-        # Create 13 band tmp images which has all image bands for input into cloud masking.
-        sen2ImgB01_tmp = os.path.join(tmpBaseDIR, tmpBaseName + '_B01.kea')
-        rsgislib.imageutils.resampleImage2Match(inputReflImage, self.sen2ImgB01, sen2ImgB01_tmp, 'KEA',
-                                                'nearestneighbour', rsgislib.TYPE_16UINT, multicore=False)
-        sen2ImgB09_tmp = os.path.join(tmpBaseDIR, tmpBaseName + '_B09.kea')
-        rsgislib.imageutils.resampleImage2Match(inputReflImage, self.sen2ImgB09, sen2ImgB09_tmp, 'KEA',
-                                                'nearestneighbour', rsgislib.TYPE_16UINT, multicore=False)
-        sen2ImgB10_tmp = os.path.join(tmpBaseDIR, tmpBaseName + '_B10.kea')
-        rsgislib.imageutils.resampleImage2Match(inputReflImage, self.sen2ImgB10, sen2ImgB10_tmp, 'KEA',
-                                                'nearestneighbour', rsgislib.TYPE_16UINT, multicore=False)
-
-        # Stack Image Bands
-        tmpTOAImg = os.path.join(tmpBaseDIR, tmpBaseName + '_pyfmasktmpTOA.kea')
+        # Create a 13 band virtual image (VRT) which has all image bands, in the correct order, for input into
+        # cloud masking. B01, B09 and B10 are resampled (nearest neighbour, and reprojected if the outputs have been
+        # reprojected) onto the reflectance image grid when read so no copies of the image bands are written to disk.
+        startTime = time.time()
+        scaleB1B9B10 = None
         if self.imgIntScaleFactor != 10000:
-            vrtImgB1B9B10 = os.path.join(tmpBaseDIR, tmpBaseName + '_b01b09b10_60mBands.vrt')
-            rsgislib.imageutils.gdal_stack_images_vrt([sen2ImgB01_tmp, sen2ImgB09_tmp, sen2ImgB10_tmp], vrtImgB1B9B10)
-
-            sen2ImgB1B9B10Rescaled = os.path.join(tmpBaseDIR, tmpBaseName + '_B01B09B10Rescaled.kea')
-            rsgislib.imagecalc.imageMath(vrtImgB1B9B10, sen2ImgB1B9B10Rescaled,
-                                         '(b1/10000)*{}'.format(self.imgIntScaleFactor), 'KEA', rsgislib.TYPE_16UINT)
-            rsgislib.imageutils.stackImageBands([inputReflImage, sen2ImgB1B9B10Rescaled], None, tmpTOAImg, None, 0,
-                                                'KEA', rsgislib.TYPE_16UINT)
-        else:
-            rsgislib.imageutils.stackImageBands([inputReflImage, sen2ImgB01_tmp, sen2ImgB09_tmp, sen2ImgB10_tmp], None,
-                                                tmpTOAImg, None, 0, 'KEA', rsgislib.TYPE_16UINT)
-
-        # Re-order image bands to be in correct order.
-        fmaskReflImg = os.path.join(tmpBaseDIR, tmpBaseName + '_pyfmaskRefl.kea')
-        rsgislib.imageutils.selectImageBands(tmpTOAImg, fmaskReflImg, 'KEA', rsgislib.TYPE_16UINT,
-                                             [11, 1, 2, 3, 4, 5, 6, 7, 8, 12, 13, 9, 10])
+            scaleB1B9B10 = [0, 10000, 0, self.imgIntScaleFactor]
+        fmaskReflBands = [(self.sen2ImgB01, 1, scaleB1B9B10)]
+        for band in range(8):
+            fmaskReflBands.append((inputReflImage, band+1, None))
+        fmaskReflBands.append((self.sen2ImgB09, 1, scaleB1B9B10))
+        fmaskReflBands.append((self.sen2ImgB10, 1, scaleB1B9B10))
+        fmaskReflBands.append((inputReflImage, 9, None))
+        fmaskReflBands.append((inputReflImage, 10, None))
+
+        fmaskReflImg = os.path.join(tmpBaseDIR, tmpBaseName + '_pyfmaskRefl.vrt')
+        arcsiUtils = ARCSIUtils()
+        vrtFiles = arcsiUtils.createBandStackVRT(fmaskReflBands, inputReflImage, fmaskReflImg, 'near')
+        vrtBytes = 0
+        for vrtFile in vrtFiles:
+            vrtBytes = vrtBytes + os.path.getsize(vrtFile)
+        print("Created cloud masking band stack: {0} bytes written in {1:.2f} seconds.".format(vrtBytes, time.time() - startTime))
         #########################################################################################################
 
         if (cloud_msk_methods is None) or ((cloud_msk_methods == 'FMASK') or (cloud_msk_methods == 'FMASK_DISP')):
@@ -1282,7 +1352,8 @@ class ARCSISentinel2Sensor (ARCSIAbstractSensor):
 
             run_s2cloudless(fmaskReflImg, out_cloud_msk, inputValidImg, outFormat, tmpBaseDIR,
                             toa_scale_factor=float(self.imgIntScaleFactor),
-                            min_obj_size=10, morph_close_size=5, morph_dilate_size=9)
+                            min_obj_size=10, morph_close_size=5, morph_dilate_size=9,
+                            num_threads=self.numThreads, max_mem_mb=self.memBudgetMB)
 
             run_pyfmask_shadow_masking(fmaskReflImg, inputSatImage, inputViewAngleImg, out_cloud_msk, tmpBaseDIR,
                                        float(self.imgIntScaleFactor), outputImage)
@@ -1292,16 +1363,40 @@ class ARCSISentinel2Sensor (ARCSIAbstractSensor):
             from arcsilib.s2cloudless import run_pyfmask_shadow_masking
 
             out_s2less_cloud_msk = os.path.join(tmpBaseDIR, tmpBaseName + '_s2cloudless_cloud_msk.kea')
-            run_s2cloudless(fmaskReflImg, out_s2less_cloud_msk, inputValidImg, outFormat, tmpBaseDIR,
-                            toa_scale_factor=float(self.imgIntScaleFactor),
-                            min_obj_size=10, morph_close_size=5, morph_dilate_size=9)
-
             out_fmsk_cloud_msk = os.path.join(tmpBaseDIR, tmpBaseName + '_fmsk_cloud_msk.kea')
             use_frantz_disp = False
             if 'S2LESSFMSKD' in cloud_msk_methods:
                 use_frantz_disp = True
-            run_fmask_cloud_msk(fmaskReflImg, inputSatImage, inputViewAngleImg, out_fmsk_cloud_msk, tmpBaseDIR,
-                                float(self.imgIntScaleFactor), use_frantz_disp)
+
+            if self.numThreads > 1:
+                # The two cloud masks are independent so run them concurrently, with
+                # fmask using one thread and s2cloudless the rest of the thread budget.
+                memBudgetMB = None
+                if self.memBudgetMB is not None:
+                    memBudgetMB = self.memBudgetMB / 2
+                pool = ThreadPool(2)
+                try:
+                    s2lessResult = pool.apply_async(run_s2cloudless, (fmaskReflImg, out_s2less_cloud_msk,
+                                                                      inputValidImg, outFormat, tmpBaseDIR),
+                                                    dict(toa_scale_factor=float(self.imgIntScaleFactor),
+                                                         min_obj_size=10, morph_close_size=5, morph_dilate_size=9,
+                                                         num_threads=(self.numThreads - 1), max_mem_mb=memBudgetMB))
+                    fmskResult = pool.apply_async(run_fmask_cloud_msk, (fmaskReflImg, inputSatImage,
+                                                                        inputViewAngleImg, out_fmsk_cloud_msk,
+                                                                        tmpBaseDIR, float(self.imgIntScaleFactor),
+                                                                        use_frantz_disp))
+                    s2lessResult.get()
+                    fmskResult.get()
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                run_s2cloudless(fmaskReflImg, out_s2less_cloud_msk, inputValidImg, outFormat, tmpBaseDIR,
+                                toa_scale_factor=float(self.imgIntScaleFactor),
+                                min_obj_size=10, morph_close_size=5, morph_dilate_size=9,
+                                num_threads=self.numThreads, max_mem_mb=self.memBudgetMB)
+                run_fmask_cloud_msk(fmaskReflImg, inputSatImage, inputViewAngleImg, out_fmsk_cloud_msk, tmpBaseDIR,
+                                    float(self.imgIntScaleFactor), use_frantz_disp)
 
             # Combine cloud masks
             out_cloud_msk = os.path.join(tmpBaseDIR, tmpBaseName + '_fmsk_s2l_cloud_msk.kea')
@@ -1512,85 +1607,11 @@ class ARCSISentinel2Sensor (ARCSIAbstractSensor):
         print("Converting to Surface Reflectance")
         outputImage = os.path.join(outputPath, outputName)
 
-        imgBandCoeffs = list()
-
         sixsCoeffs = self.calc6SCoefficients(aeroProfile, atmosProfile, grdRefl, surfaceAltitude, aotVal, useBRDF)
 
-        imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=1, aX=float(sixsCoeffs[0,0]), bX=float(sixsCoeffs[0,1]), cX=float(sixsCoeffs[0,2]), DirIrr=float(sixsCoeffs[0,3]), DifIrr=float(sixsCoeffs[0,4]), EnvIrr=float(sixsCoeffs[0,5])))
-        imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=2, aX=float(sixsCoeffs[1,0]), bX=float(sixsCoeffs[1,1]), cX=float(sixsCoeffs[1,2]), DirIrr=float(sixsCoeffs[1,3]), DifIrr=float(sixsCoeffs[1,4]), EnvIrr=float(sixsCoeffs[1,5])))
-        imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=3, aX=float(sixsCoeffs[2,0]), bX=float(sixsCoeffs[2,1]), cX=float(sixsCoeffs[2,2]), DirIrr=float(sixsCoeffs[2,3]), DifIrr=float(sixsCoeffs[2,4]), EnvIrr=float(sixsCoeffs[2,5])))
-        imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=4, aX=float(sixsCoeffs[3,0]), bX=float(sixsCoeffs[3,1]), cX=float(sixsCoeffs[3,2]), DirIrr=float(sixsCoeffs[3,3]), DifIrr=float(sixsCoeffs[3,4]), EnvIrr=float(sixsCoeffs[3,5])))
-        imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=5, aX=float(sixsCoeffs[4,0]), bX=float(sixsCoeffs[4,1]), cX=float(sixsCoeffs[4,2]), DirIrr=float(sixsCoeffs[4,3]), DifIrr=float(sixsCoeffs[4,4]), EnvIrr=float(sixsCoeffs[4,5])))
-        imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=6, aX=float(sixsCoeffs[5,0]), bX=float(sixsCoeffs[5,1]), cX=float(sixsCoeffs[5,2]), DirIrr=float(sixsCoeffs[5,3]), DifIrr=float(sixsCoeffs[5,4]), EnvIrr=float(sixsCoeffs[5,5])))
-        imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=7, aX=float(sixsCoeffs[6,0]), bX=float(sixsCoeffs[6,1]), cX=float(sixsCoeffs[6,2]), DirIrr=float(sixsCoeffs[6,3]), DifIrr=float(sixsCoeffs[6,4]), EnvIrr=float(sixsCoeffs[6,5])))
-        imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=8, aX=float(sixsCoeffs[7,0]), bX=float(sixsCoeffs[7,1]), cX=float(sixsCoeffs[7,2]), DirIrr=float(sixsCoeffs[7,3]), DifIrr=float(sixsCoeffs[7,4]), EnvIrr=float(sixsCoeffs[7,5])))
-        imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=9, aX=float(sixsCoeffs[8,0]), bX=float(sixsCoeffs[8,1]), cX=float(sixsCoeffs[8,2]), DirIrr=float(sixsCoeffs[8,3]), DifIrr=float(sixsCoeffs[8,4]), EnvIrr=float(sixsCoeffs[8,5])))
-        imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=10, aX=float(sixsCoeffs[9,0]), bX=float(sixsCoeffs[9,1]), cX=float(sixsCoeffs[9,2]), DirIrr=float(sixsCoeffs[9,3]), DifIrr=float(sixsCoeffs[9,4]), EnvIrr=float(sixsCoeffs[9,5])))
-
-        rsgislib.imagecalibration.apply6SCoeffSingleParam(inputRadImage, outputImage, outFormat, rsgislib.TYPE_16UINT, scaleFactor, 0, True, imgBandCoeffs)
+        self.apply6SCoeffs(inputRadImage, outputImage, outFormat, scaleFactor, sixsCoeffs)
         return outputImage
 
-    def convertImageToSurfaceReflDEMElevLUT(self, inputRadImage, inputDEMFile, outputPath, outputName, outFormat, aeroProfile, atmosProfile, grdRefl, aotVal, useBRDF, surfaceAltitudeMin, surfaceAltitudeMax, scaleFactor, elevCoeffs=None):
-        print("Converting to Surface Reflectance")
-        outputImage = os.path.join(outputPath, outputName)
-
-        if elevCoeffs is None:
-            print("Build an LUT for elevation values.")
-            elev6SCoeffsLUT = self.buildElevation6SCoeffLUT(aeroProfile, atmosProfile, grdRefl, aotVal, useBRDF, surfaceAltitudeMin, surfaceAltitudeMax)
-            print("LUT has been built.")
-
-            elevCoeffs = list()
-            for elevLUT in elev6SCoeffsLUT:
-                imgBandCoeffs = list()
-                sixsCoeffs = elevLUT.Coeffs
-                elevVal = elevLUT.Elev
-                imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=1, aX=float(sixsCoeffs[0,0]), bX=float(sixsCoeffs[0,1]), cX=float(sixsCoeffs[0,2]), DirIrr=float(sixsCoeffs[0,3]), DifIrr=float(sixsCoeffs[0,4]), EnvIrr=float(sixsCoeffs[0,5])))
-                imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=2, aX=float(sixsCoeffs[1,0]), bX=float(sixsCoeffs[1,1]), cX=float(sixsCoeffs[1,2]), DirIrr=float(sixsCoeffs[1,3]), DifIrr=float(sixsCoeffs[1,4]), EnvIrr=float(sixsCoeffs[1,5])))
-                imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=3, aX=float(sixsCoeffs[2,0]), bX=float(sixsCoeffs[2,1]), cX=float(sixsCoeffs[2,2]), DirIrr=float(sixsCoeffs[2,3]), DifIrr=float(sixsCoeffs[2,4]), EnvIrr=float(sixsCoeffs[2,5])))
-                imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=4, aX=float(sixsCoeffs[3,0]), bX=float(sixsCoeffs[3,1]), cX=float(sixsCoeffs[3,2]), DirIrr=float(sixsCoeffs[3,3]), DifIrr=float(sixsCoeffs[3,4]), EnvIrr=float(sixsCoeffs[3,5])))
-                imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=5, aX=float(sixsCoeffs[4,0]), bX=float(sixsCoeffs[4,1]), cX=float(sixsCoeffs[4,2]), DirIrr=float(sixsCoeffs[4,3]), DifIrr=float(sixsCoeffs[4,4]), EnvIrr=float(sixsCoeffs[4,5])))
-                imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=6, aX=float(sixsCoeffs[5,0]), bX=float(sixsCoeffs[5,1]), cX=float(sixsCoeffs[5,2]), DirIrr=float(sixsCoeffs[5,3]), DifIrr=float(sixsCoeffs[5,4]), EnvIrr=float(sixsCoeffs[5,5])))
-                imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=7, aX=float(sixsCoeffs[6,0]), bX=float(sixsCoeffs[6,1]), cX=float(sixsCoeffs[6,2]), DirIrr=float(sixsCoeffs[6,3]), DifIrr=float(sixsCoeffs[6,4]), EnvIrr=float(sixsCoeffs[6,5])))
-                imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=8, aX=float(sixsCoeffs[7,0]), bX=float(sixsCoeffs[7,1]), cX=float(sixsCoeffs[7,2]), DirIrr=float(sixsCoeffs[7,3]), DifIrr=float(sixsCoeffs[7,4]), EnvIrr=float(sixsCoeffs[7,5])))
-                imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=9, aX=float(sixsCoeffs[8,0]), bX=float(sixsCoeffs[8,1]), cX=float(sixsCoeffs[8,2]), DirIrr=float(sixsCoeffs[8,3]), DifIrr=float(sixsCoeffs[8,4]), EnvIrr=float(sixsCoeffs[8,5])))
-                imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=10, aX=float(sixsCoeffs[9,0]), bX=float(sixsCoeffs[9,1]), cX=float(sixsCoeffs[9,2]), DirIrr=float(sixsCoeffs[9,3]), DifIrr=float(sixsCoeffs[9,4]), EnvIrr=float(sixsCoeffs[9,5])))
-                elevCoeffs.append(rsgislib.imagecalibration.ElevLUTFeat(Elev=float(elevVal), Coeffs=imgBandCoeffs))
-
-        rsgislib.imagecalibration.apply6SCoeffElevLUTParam(inputRadImage, inputDEMFile, outputImage, outFormat, rsgislib.TYPE_16UINT, scaleFactor, 0, True, elevCoeffs)
-        return outputImage, elevCoeffs
-
-    def convertImageToSurfaceReflAOTDEMElevLUT(self, inputRadImage, inputDEMFile, inputAOTImage, outputPath, outputName, outFormat, aeroProfile, atmosProfile, grdRefl, useBRDF, surfaceAltitudeMin, surfaceAltitudeMax, aotMin, aotMax, scaleFactor, elevAOTCoeffs=None):
-        print("Converting to Surface Reflectance")
-        outputImage = os.path.join(outputPath, outputName)
-
-        if elevAOTCoeffs is None:
-            print("Build an LUT for elevation and AOT values.")
-            elevAOT6SCoeffsLUT = self.buildElevationAOT6SCoeffLUT(aeroProfile, atmosProfile, grdRefl, useBRDF, surfaceAltitudeMin, surfaceAltitudeMax, aotMin, aotMax)
-
-            elevAOTCoeffs = list()
-            for elevLUT in elevAOT6SCoeffsLUT:
-                elevVal = elevLUT.Elev
-                aotLUT = elevLUT.Coeffs
-                aot6SCoeffsOut = list()
-                for aotFeat in aotLUT:
-                    sixsCoeffs = aotFeat.Coeffs
-                    aotVal = aotFeat.AOT
-                    imgBandCoeffs = list()
-                    imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=1, aX=float(sixsCoeffs[0,0]), bX=float(sixsCoeffs[0,1]), cX=float(sixsCoeffs[0,2]), DirIrr=float(sixsCoeffs[0,3]), DifIrr=float(sixsCoeffs[0,4]), EnvIrr=float(sixsCoeffs[0,5])))
-                    imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=2, aX=float(sixsCoeffs[1,0]), bX=float(sixsCoeffs[1,1]), cX=float(sixsCoeffs[1,2]), DirIrr=float(sixsCoeffs[1,3]), DifIrr=float(sixsCoeffs[1,4]), EnvIrr=float(sixsCoeffs[1,5])))
-                    imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=3, aX=float(sixsCoeffs[2,0]), bX=float(sixsCoeffs[2,1]), cX=float(sixsCoeffs[2,2]), DirIrr=float(sixsCoeffs[2,3]), DifIrr=float(sixsCoeffs[2,4]), EnvIrr=float(sixsCoeffs[2,5])))
-                    imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=4, aX=float(sixsCoeffs[3,0]), bX=float(sixsCoeffs[3,1]), cX=float(sixsCoeffs[3,2]), DirIrr=float(sixsCoeffs[3,3]), DifIrr=float(sixsCoeffs[3,4]), EnvIrr=float(sixsCoeffs[3,5])))
-                    imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=5, aX=float(sixsCoeffs[4,0]), bX=float(sixsCoeffs[4,1]), cX=float(sixsCoeffs[4,2]), DirIrr=float(sixsCoeffs[4,3]), DifIrr=float(sixsCoeffs[4,4]), EnvIrr=float(sixsCoeffs[4,5])))
-                    imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=6, aX=float(sixsCoeffs[5,0]), bX=float(sixsCoeffs[5,1]), cX=float(sixsCoeffs[5,2]), DirIrr=float(sixsCoeffs[5,3]), DifIrr=float(sixsCoeffs[5,4]), EnvIrr=float(sixsCoeffs[5,5])))
-                    imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=7, aX=float(sixsCoeffs[6,0]), bX=float(sixsCoeffs[6,1]), cX=float(sixsCoeffs[6,2]), DirIrr=float(sixsCoeffs[6,3]), DifIrr=float(sixsCoeffs[6,4]), EnvIrr=float(sixsCoeffs[6,5])))
-                    imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=8, aX=float(sixsCoeffs[7,0]), bX=float(sixsCoeffs[7,1]), cX=float(sixsCoeffs[7,2]), DirIrr=float(sixsCoeffs[7,3]), DifIrr=float(sixsCoeffs[7,4]), EnvIrr=float(sixsCoeffs[7,5])))
-                    imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=9, aX=float(sixsCoeffs[8,0]), bX=float(sixsCoeffs[8,1]), cX=float(sixsCoeffs[8,2]), DirIrr=float(sixsCoeffs[8,3]), DifIrr=float(sixsCoeffs[8,4]), EnvIrr=float(sixsCoeffs[8,5])))
-                    imgBandCoeffs.append(rsgislib.imagecalibration.Band6SCoeff(band=10, aX=float(sixsCoeffs[9,0]), bX=float(sixsCoeffs[9,1]), cX=float(sixsCoeffs[9,2]), DirIrr=float(sixsCoeffs[9,3]), DifIrr=float(sixsCoeffs[9,4]), EnvIrr=float(sixsCoeffs[9,5])))
-                    aot6SCoeffsOut.append(rsgislib.imagecalibration.AOTLUTFeat(AOT=float(aotVal), Coeffs=imgBandCoeffs))
-                elevAOTCoeffs.append(rsgislib.imagecalibration.ElevLUTFeat(Elev=float(elevVal), Coeffs=aot6SCoeffsOut))
-
-        rsgislib.imagecalibration.apply6SCoeffElevAOTLUTParam(inputRadImage, inputDEMFile, inputAOTImage, outputImage, outFormat, rsgislib.TYPE_16UINT, scaleFactor, 0, True, elevAOTCoeffs)
-
     def run6SToOptimiseAODValue(self, aotVal, radBlueVal, predBlueVal, aeroProfile, atmosProfile, grdRefl, surfaceAltitude):
         """Used as part of the optimastion for identifying values of AOD"""
         print("Testing AOD Val: ", aotVal,)
@@ -1664,6 +1685,8 @@ class ARCSISentinel2Sensor (ARCSIAbstractSensor):
     def cleanLocalFollowProcessing(self):
         if not self.debugMode:
             gdalDriver = gdal.GetDriverByName('KEA')
+            for decodedImg in self.sen2DecodedImgs:
+                gdalDriver.Delete(decodedImg)
             if self.resampleTo20m:
                 gdalDriver.Delete(self.sen2ImgB02_20m)
                 gdalDriver.Delete(self.sen2ImgB03_20m)
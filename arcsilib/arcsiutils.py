@@ -42,6 +42,8 @@ from __future__ import division
 from .arcsiexception import ARCSIException
 # Import the OS python module
 import os
+# Import the system module
+import sys
 # Import the OSGEO GDAL module
 import osgeo.gdal as gdal
 # Import the numpy library
@@ -54,6 +56,37 @@ from osgeo import ogr
 import scipy.interpolate
 # Import the maths module
 import math
+# Import the JSON module
+import json
+# Import the contextlib module
+import contextlib
+# Import the RSGISLib image calculation module
+import rsgislib.imagecalc
+# Import the RSGISLib image utilities module
+import rsgislib.imageutils
+# Import the base RSGISLib module
+import rsgislib
+# Import the RSGISLib raster GIS module
+import rsgislib.rastergis
+# Import the RSGISLib image calibration module
+import rsgislib.imagecalibration
+# Import the RSGISLib segmentation module
+import rsgislib.segmentation
+# Import the RSGISLib segmentation utilities module
+import rsgislib.segmentation.segutils
+# Import the hashlib module
+import hashlib
+# Import the time module
+import time
+# Import the python threading module
+import threading
+# Import the python queue module
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+# Import the GDAL numpy array module
+from osgeo import gdal_array
 
 def ARCSIEnum(*sequential, **named):
     """Handy way to fake an enumerated type in Python
@@ -248,6 +281,136 @@ class ARCSIUtils (object):
             outVar = None
         return outVar
 
+    @contextlib.contextmanager
+    def gdalConfigScope(self, configOptions=None, cacheMaxMB=None):
+        """
+        A context manager which sets GDAL configuration options (a dict of option
+        name to value) and/or the GDAL block cache size (MB) for the code within the
+        'with' block. The previous values are restored on exit (including on error)
+        so the process-global settings do not leak into other scenes run within the
+        same process (e.g., in the worker or a multiprocessing Pool).
+        """
+        if configOptions is None:
+            configOptions = dict()
+        prevConfigOptions = dict()
+        for optName in configOptions:
+            prevConfigOptions[optName] = gdal.GetConfigOption(optName, None)
+        prevCacheMax = gdal.GetCacheMax()
+        try:
+            for optName, optVal in configOptions.items():
+                gdal.SetConfigOption(optName, optVal)
+            if cacheMaxMB is not None:
+                gdal.SetCacheMax(int(cacheMaxMB * 1024 * 1024))
+            yield
+        finally:
+            for optName, optVal in prevConfigOptions.items():
+                gdal.SetConfigOption(optName, optVal)
+            gdal.SetCacheMax(prevCacheMax)
+
+    def getBlockSize(self, memBudgetMB, bytesPerPxl, defaultSize=200, minSize=64, maxSize=4096):
+        """
+        Get the size (pixels) of the square image blocks to be processed such that
+        the working memory for a block is no more than a quarter of the memory budget.
+        If no budget is provided (None) then defaultSize is returned.
+        """
+        if memBudgetMB is None:
+            return defaultSize
+        blockSize = int(math.sqrt((memBudgetMB * 1024 * 1024 * 0.25) / bytesPerPxl))
+        return max(minSize, min(blockSize, maxSize))
+
+    def createBandStackVRT(self, bandsLst, tarImg, outVRTFile, resampleAlg='near', dataType=gdal.GDT_UInt16):
+        """
+        Create a VRT which stacks (and orders) the image bands listed onto the
+        grid of tarImg. Bands which are not on the grid of tarImg (i.e., a different
+        resolution, extent or projection, such as when the outputs have been
+        reprojected) are warped onto the grid on the fly using a warped VRT.
+        bandsLst is a list of tuples (image file, band (starting at 1), scale) where
+        scale is a list [srcMin, srcMax, dstMin, dstMax] for a linear rescaling of the
+        band values or None. No image data is written, the list of VRT files created
+        is returned.
+        """
+        tarDS = gdal.Open(tarImg, gdal.GA_ReadOnly)
+        if tarDS is None:
+            raise ARCSIException("Could not open target image: " + tarImg)
+        tarGeoTrans = tarDS.GetGeoTransform()
+        tarXSize = tarDS.RasterXSize
+        tarYSize = tarDS.RasterYSize
+        tarProjWKT = tarDS.GetProjection()
+        xMin = tarGeoTrans[0]
+        yMax = tarGeoTrans[3]
+        xMax = xMin + (tarXSize * tarGeoTrans[1])
+        yMin = yMax + (tarYSize * tarGeoTrans[5])
+        tarDS = None
+        tarSpatRef = osr.SpatialReference()
+        tarSpatRef.ImportFromWkt(tarProjWKT)
+
+        outBaseName = os.path.splitext(outVRTFile)[0]
+        vrtFiles = []
+        bandVRTFiles = []
+        for i, (imgFile, band, scale) in enumerate(bandsLst):
+            bandVRTFile = '{0}_b{1}.vrt'.format(outBaseName, i+1)
+            if scale is None:
+                gdal.Translate(bandVRTFile, imgFile, format='VRT', bandList=[band], outputType=dataType)
+            else:
+                gdal.Translate(bandVRTFile, imgFile, format='VRT', bandList=[band], outputType=dataType, scaleParams=[scale])
+            vrtFiles.append(bandVRTFile)
+
+            imgDS = gdal.Open(imgFile, gdal.GA_ReadOnly)
+            if imgDS is None:
+                raise ARCSIException("Could not open image: " + imgFile)
+            imgSpatRef = osr.SpatialReference()
+            imgSpatRef.ImportFromWkt(imgDS.GetProjection())
+            onTarGrid = (imgDS.RasterXSize == tarXSize) and (imgDS.RasterYSize == tarYSize) and numpy.allclose(imgDS.GetGeoTransform(), tarGeoTrans) and bool(imgSpatRef.IsSame(tarSpatRef))
+            imgDS = None
+            if not onTarGrid:
+                warpVRTFile = '{0}_b{1}_warp.vrt'.format(outBaseName, i+1)
+                warpOpts = gdal.WarpOptions(format='VRT', dstSRS=tarProjWKT, outputBounds=[xMin, yMin, xMax, yMax], xRes=abs(tarGeoTrans[1]), yRes=abs(tarGeoTrans[5]), resampleAlg=resampleAlg, outputType=dataType)
+                warpDS = gdal.Warp(warpVRTFile, bandVRTFile, options=warpOpts)
+                if warpDS is None:
+                    raise ARCSIException("Could not create the warped VRT: " + warpVRTFile)
+                warpDS = None
+                vrtFiles.append(warpVRTFile)
+                bandVRTFile = warpVRTFile
+            bandVRTFiles.append(bandVRTFile)
+
+        vrtOpts = gdal.BuildVRTOptions(separate=True, resolution='user', xRes=abs(tarGeoTrans[1]), yRes=abs(tarGeoTrans[5]), outputBounds=[xMin, yMin, xMax, yMax], resampleAlg=resampleAlg)
+        vrtDS = gdal.BuildVRT(outVRTFile, bandVRTFiles, options=vrtOpts)
+        if vrtDS is None:
+            raise ARCSIException("Could not create the VRT: " + outVRTFile)
+        vrtDS = None
+        return vrtFiles + [outVRTFile]
+
+    def createDecimatedImage(self, inputImg, outputImg, decimateFactor, resampleAlg='near', outFormat='VRT'):
+        """
+        Create an image (a VRT by default, so no image data is written) which reads
+        inputImg at 1/decimateFactor of its resolution. The image is decimated when
+        it is read, using the image overviews (or JPEG2000 resolution levels) where
+        available. The output pixel size is a multiple of the input pixel size so
+        images at different resolutions decimated by the same factor keep the
+        same relative alignment.
+        """
+        imgDS = gdal.Open(inputImg, gdal.GA_ReadOnly)
+        if imgDS is None:
+            raise ARCSIException("Could not open image: " + inputImg)
+        geoTransform = imgDS.GetGeoTransform()
+        imgDS = None
+        outDS = gdal.Translate(outputImg, os.path.abspath(inputImg), format=outFormat, xRes=abs(geoTransform[1])*decimateFactor, yRes=abs(geoTransform[5])*decimateFactor, resampleAlg=resampleAlg)
+        if outDS is None:
+            raise ARCSIException("Could not create the decimated image: " + outputImg)
+        outDS = None
+        return outputImg
+
+    def getNumWorkers(self, memBudgetMB, memPerWorkerMB, numThreads):
+        """
+        Get the number of workers (no more than numThreads) which can run
+        concurrently such that the memory used by the workers is no more than
+        half of the memory budget. If no budget is provided (None) then
+        numThreads is returned.
+        """
+        if memBudgetMB is None:
+            return max(1, numThreads)
+        return max(1, min(numThreads, int((memBudgetMB * 0.5) / memPerWorkerMB)))
+
     def setImgThematic(self, imageFile):
         ds = gdal.Open(imageFile, gdal.GA_Update)
         for bandnum in range(ds.RasterCount):
@@ -422,11 +585,1071 @@ class ARCSIUtils (object):
         return aotVal
 
 
+class ARCSIProfileLookup(object):
+    """
+    A class which resolves the aerosol and atmosphere profiles from the
+    world profile images (i.e., WorldAerosolParams.kea and WorldAtmosphereParams.kea).
+    The mode found within a lat/long envelope is cached for the lifetime of the
+    process so scenes processed by the same process (e.g., runARCSIMulti or the
+    MPI master) do not re-read the images. Optionally, the cache can also be
+    stored on disk as a JSON file (set with setCacheFile or the
+    ARCSI_PROFILE_CACHE environmental variable) so it persists between runs.
+    """
+    modeCache = dict()
+    cacheFile = None
+    cacheFileLoaded = False
+    cacheModified = False
+
+    @staticmethod
+    def setCacheFile(cacheFile):
+        """
+        Set the JSON file used to store the profile look ups on disk. If the
+        file exists then the values it contains are loaded into the cache.
+        """
+        ARCSIProfileLookup.cacheFile = cacheFile
+        ARCSIProfileLookup.cacheFileLoaded = True
+        if (cacheFile is not None) and os.path.exists(cacheFile):
+            try:
+                with open(cacheFile, 'r') as cacheFileObj:
+                    ARCSIProfileLookup.modeCache.update(json.load(cacheFileObj))
+            except (IOError, OSError, ValueError):
+                print("Warning: could not read profile cache file: " + cacheFile, file=sys.stderr)
+
+    @staticmethod
+    def flushCacheFile():
+        """
+        Write the cache to the JSON file (if one has been set). The file is only
+        written if new profiles have been looked up since it was last written, so
+        this should be called once after a scene or a batch of scenes has been prepared.
+        """
+        if (ARCSIProfileLookup.cacheFile is not None) and ARCSIProfileLookup.cacheModified:
+            try:
+                tmpCacheFile = ARCSIProfileLookup.cacheFile + '.tmp' + str(os.getpid())
+                with open(tmpCacheFile, 'w') as cacheFileObj:
+                    json.dump(ARCSIProfileLookup.modeCache, cacheFileObj, indent=1, sort_keys=True)
+                os.rename(tmpCacheFile, ARCSIProfileLookup.cacheFile)
+                ARCSIProfileLookup.cacheModified = False
+            except (IOError, OSError):
+                print("Warning: could not write profile cache file: " + ARCSIProfileLookup.cacheFile, file=sys.stderr)
+
+    @staticmethod
+    def getImageModeInEnv(profileImg, lonTL, lonBR, latBR, latTL):
+        """
+        Get the mode of band 1 of the profile image within the envelope. Values
+        are keyed on the image path, size and modification time and the envelope
+        so the result is identical to calling rsgislib.imagecalc.getImageBandModeInEnv.
+        """
+        if not ARCSIProfileLookup.cacheFileLoaded:
+            ARCSIProfileLookup.setCacheFile(ARCSIUtils().getEnvironmentVariable("ARCSI_PROFILE_CACHE"))
+        profileImg = os.path.abspath(profileImg)
+        imgStat = os.stat(profileImg)
+        cacheKey = "{0}:{1}:{2}:{3!r}:{4!r}:{5!r}:{6!r}".format(profileImg, imgStat.st_size, int(imgStat.st_mtime), float(lonTL), float(lonBR), float(latBR), float(latTL))
+        if cacheKey not in ARCSIProfileLookup.modeCache:
+            ARCSIProfileLookup.modeCache[cacheKey] = int(rsgislib.imagecalc.getImageBandModeInEnv(profileImg, 1, 1, None, lonTL, lonBR, latBR, latTL)[0])
+            ARCSIProfileLookup.cacheModified = True
+        return ARCSIProfileLookup.modeCache[cacheKey]
+
+    @staticmethod
+    def getAeroProfile(aeroProfileImg, lonTL, lonBR, latBR, latTL):
+        """
+        Get the name of the aerosol profile (Maritime or Continental) for the envelope.
+        """
+        aeroProfileMode = ARCSIProfileLookup.getImageModeInEnv(aeroProfileImg, lonTL, lonBR, latBR, latTL)
+        if aeroProfileMode == 1:
+            return "Maritime"
+        elif aeroProfileMode == 2:
+            return "Continental"
+        raise ARCSIException("The aerosol profile from the input image was not recognised.")
+
+    @staticmethod
+    def getAtmosProfile(atmosProfileImg, lonTL, lonBR, latBR, latTL, latCentre, lonCentre, acquisitionTime):
+        """
+        Get the name of the atmosphere profile for the envelope, where the
+        summer or winter profile is selected using the acquisition date.
+        """
+        atmosProfileMode = ARCSIProfileLookup.getImageModeInEnv(atmosProfileImg, lonTL, lonBR, latBR, latTL)
+        if atmosProfileMode == 1:
+            return "Tropical"
+        elif (atmosProfileMode == 2) or (atmosProfileMode == 3):
+            summerWinter = ARCSIUtils().isSummerOrWinter(latCentre, lonCentre, acquisitionTime)
+            profilePrefix = "Midlatitude"
+            if atmosProfileMode == 3:
+                profilePrefix = "Subarctic"
+            if summerWinter == 1:
+                return profilePrefix + "Summer"
+            elif summerWinter == 2:
+                return profilePrefix + "Winter"
+            raise ARCSIException("Not recognised as being summer or winter.")
+        raise ARCSIException("The atmosphere profile from the input image was not recognised.")
+
+
+class ARCSIDEMCache(object):
+    """
+    A class which prepares the DEM subset for an image grid. The input DEM is
+    only read within a window covering the output grid (so only the region
+    needed of a large national DEM is touched) and, if a cache directory is
+    provided, the reprojected DEM is stored keyed on the target grid (projection,
+    extent, resolution and resampling) so later scenes on the same footprint
+    (e.g., a time-series over one Sentinel-2 tile) reuse it.
+    """
+
+    @staticmethod
+    def getCacheKey(demFile, tarImg, resampling, noDataVal):
+        """
+        Get a key which uniquely identifies the DEM reprojected onto the grid of tarImg.
+        """
+        demFile = os.path.abspath(demFile)
+        demStat = os.stat(demFile)
+        tarDS = gdal.Open(tarImg, gdal.GA_ReadOnly)
+        if tarDS is None:
+            raise ARCSIException("Could not open target image: " + tarImg)
+        keyStr = "{0}:{1}:{2}:{3}:{4!r}:{5}:{6}:{7}:{8!r}".format(demFile, demStat.st_size, int(demStat.st_mtime), tarDS.GetProjection(), tarDS.GetGeoTransform(), tarDS.RasterXSize, tarDS.RasterYSize, resampling, float(noDataVal))
+        tarDS = None
+        return hashlib.md5(keyStr.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def createDEMSubsetVRT(inDEMDS, tarDS, outVRTFile, bufPxls=4):
+        """
+        Create a VRT which only references the region of the input DEM covering
+        the target dataset (with a buffer for the interpolation kernel). Returns
+        None if the window could not be calculated (e.g., rotated DEM) or covers
+        the whole DEM.
+        """
+        demGeoTrans = inDEMDS.GetGeoTransform()
+        tarGeoTrans = tarDS.GetGeoTransform()
+        if (demGeoTrans[2] != 0) or (demGeoTrans[4] != 0) or (inDEMDS.GetProjection() == ""):
+            return None
+        tarProj = osr.SpatialReference()
+        tarProj.ImportFromWkt(tarDS.GetProjection())
+        demProj = osr.SpatialReference()
+        demProj.ImportFromWkt(inDEMDS.GetProjection())
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            tarProj.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            demProj.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        coordTrans = osr.CoordinateTransformation(tarProj, demProj)
+
+        # Sample the edges of the target grid as the envelope may curve once reprojected.
+        nSamples = 10
+        xCoords = []
+        yCoords = []
+        for i in range(nSamples+1):
+            for j in range(nSamples+1):
+                if (i == 0) or (i == nSamples) or (j == 0) or (j == nSamples):
+                    pxlX = tarDS.RasterXSize * (i / nSamples)
+                    pxlY = tarDS.RasterYSize * (j / nSamples)
+                    x = tarGeoTrans[0] + pxlX * tarGeoTrans[1] + pxlY * tarGeoTrans[2]
+                    y = tarGeoTrans[3] + pxlX * tarGeoTrans[4] + pxlY * tarGeoTrans[5]
+                    try:
+                        pt = coordTrans.TransformPoint(x, y)
+                    except Exception:
+                        return None
+                    xCoords.append(pt[0])
+                    yCoords.append(pt[1])
+
+        colA = (min(xCoords) - demGeoTrans[0]) / demGeoTrans[1]
+        colB = (max(xCoords) - demGeoTrans[0]) / demGeoTrans[1]
+        rowA = (min(yCoords) - demGeoTrans[3]) / demGeoTrans[5]
+        rowB = (max(yCoords) - demGeoTrans[3]) / demGeoTrans[5]
+        colMin = int(math.floor(min(colA, colB))) - bufPxls
+        colMax = int(math.ceil(max(colA, colB))) + bufPxls
+        rowMin = int(math.floor(min(rowA, rowB))) - bufPxls
+        rowMax = int(math.ceil(max(rowA, rowB))) + bufPxls
+        colMin = max(colMin, 0)
+        rowMin = max(rowMin, 0)
+        colMax = min(colMax, inDEMDS.RasterXSize)
+        rowMax = min(rowMax, inDEMDS.RasterYSize)
+        if (colMax <= colMin) or (rowMax <= rowMin):
+            raise ARCSIException("The DEM does not overlap with the input image.")
+        if (colMin == 0) and (rowMin == 0) and (colMax == inDEMDS.RasterXSize) and (rowMax == inDEMDS.RasterYSize):
+            return None
+        gdal.Translate(outVRTFile, inDEMDS, format='VRT', srcWin=[colMin, rowMin, colMax-colMin, rowMax-rowMin])
+        return outVRTFile
+
+    @staticmethod
+    def reprojectDEM(demFile, tarImg, outDEMFile, outFormat, noDataVal, resampling=gdal.GRA_CubicSpline, warpMemMB=None):
+        """
+        Reproject and subset the DEM onto the grid of tarImg, only reading the
+        window of the DEM covering tarImg. warpMemMB is the memory limit for the
+        GDAL warper (None for the GDAL default).
+        """
+        warpMemBytes = 0.0
+        if warpMemMB is not None:
+            warpMemBytes = float(warpMemMB * 1024 * 1024)
+        rsgislib.imageutils.createCopyImage(tarImg, outDEMFile, 1, noDataVal, outFormat, rsgislib.TYPE_32FLOAT)
+
+        inDEMDS = gdal.Open(demFile, gdal.GA_ReadOnly)
+        if inDEMDS is None:
+            raise ARCSIException("Could not open the DEM: " + demFile)
+        outDEMDS = gdal.Open(outDEMFile, gdal.GA_Update)
+        subVRTFile = '/vsimem/arcsi_dem_subset_' + str(os.getpid()) + '_' + ARCSIUtils().uidGenerator() + '.vrt'
+        subDEMFile = ARCSIDEMCache.createDEMSubsetVRT(inDEMDS, outDEMDS, subVRTFile)
+        if subDEMFile is not None:
+            subDEMDS = gdal.Open(subDEMFile, gdal.GA_ReadOnly)
+            gdal.ReprojectImage(subDEMDS, outDEMDS, None, None, resampling, warpMemBytes)
+            subDEMDS = None
+            gdal.Unlink(subDEMFile)
+        else:
+            gdal.ReprojectImage(inDEMDS, outDEMDS, None, None, resampling, warpMemBytes)
+        inDEMDS = None
+        outDEMDS = None
+
+    @staticmethod
+    def getDEMSubset(demFile, tarImg, cacheDIR, noDataVal, resampling=gdal.GRA_CubicSpline, warpMemMB=None):
+        """
+        Get the cached DEM for the grid of tarImg, creating it if it is not
+        already within the cache. Returns the cached file path and whether
+        it was already present (i.e., a warm cache).
+        """
+        cacheKey = ARCSIDEMCache.getCacheKey(demFile, tarImg, resampling, noDataVal)
+        cacheFile = os.path.join(cacheDIR, 'arcsi_dem_' + cacheKey + '.kea')
+        if os.path.exists(cacheFile):
+            return cacheFile, True
+        if not os.path.exists(cacheDIR):
+            os.makedirs(cacheDIR)
+        # Write to a temporary file so a partially written DEM is never read by another process.
+        tmpCacheFile = os.path.join(cacheDIR, 'arcsi_dem_' + cacheKey + '_tmp' + str(os.getpid()) + '.kea')
+        ARCSIDEMCache.reprojectDEM(demFile, tarImg, tmpCacheFile, 'KEA', noDataVal, resampling, warpMemMB)
+        os.rename(tmpCacheFile, cacheFile)
+        return cacheFile, False
+
+
+class ARCSISegmentCache(object):
+    """
+    A class which produces the (Shepherd et al.) segmentation of a scene used by
+    the DOS AOT estimation, and the clumps used by the clear-sky and local DOS
+    stages. The segmentation can optionally be produced at a coarser resolution
+    (ARCSI_SEG_RESOLUTION, in the units of the image projection) and the outputs
+    stored within a cache directory (ARCSI_SEG_CACHE), so they are reused when a
+    scene is re-run. The intermediate images are rewritten on every run, so the
+    cached outputs are keyed on a fingerprint of the image content (see
+    getContentFingerprint) and the parameters rather than on the file.
+    """
+    cacheDIR = None
+    segResolution = None
+    configLoaded = False
+    # The maximum size (pixels) of the decimated read used to fingerprint the segmented images.
+    fingerprintSize = 1024
+
+    @staticmethod
+    def setCacheConfig(cacheDIR=None, segResolution=None):
+        """
+        Set the directory used to store the segmentations between runs and the
+        resolution at which the segmentation is produced (None for the image resolution).
+        """
+        ARCSISegmentCache.cacheDIR = cacheDIR
+        ARCSISegmentCache.segResolution = segResolution
+        ARCSISegmentCache.configLoaded = True
+
+    @staticmethod
+    def _loadConfig():
+        if not ARCSISegmentCache.configLoaded:
+            arcsiUtils = ARCSIUtils()
+            segResolution = arcsiUtils.getEnvironmentVariable("ARCSI_SEG_RESOLUTION")
+            if segResolution is not None:
+                segResolution = arcsiUtils.str2Float(segResolution)
+            ARCSISegmentCache.setCacheConfig(arcsiUtils.getEnvironmentVariable("ARCSI_SEG_CACHE"), segResolution)
+
+    @staticmethod
+    def getContentFingerprint(inputImg, bands=None, maxSize=None):
+        """
+        Get a fingerprint (md5 hex digest) of the image size, geotransform, projection
+        and the pixel values of the bands (None for all the bands). If maxSize is provided
+        the bands are read decimated to no more than maxSize pixels along each axis,
+        otherwise they are read in full (in strips of rows).
+        """
+        imgDS = gdal.Open(inputImg, gdal.GA_ReadOnly)
+        if imgDS is None:
+            raise ARCSIException("Could not open image: " + inputImg)
+        xSize = imgDS.RasterXSize
+        ySize = imgDS.RasterYSize
+        if bands is None:
+            bands = list(range(1, imgDS.RasterCount+1))
+        keyHash = hashlib.md5()
+        keyHash.update("{0}:{1}:{2!r}:{3}".format(xSize, ySize, imgDS.GetGeoTransform(), imgDS.GetProjection()).encode('utf-8'))
+        for band in bands:
+            imgBand = imgDS.GetRasterBand(band)
+            if (maxSize is not None) and (max(xSize, ySize) > maxSize):
+                scale = maxSize / max(xSize, ySize)
+                bufXSize = max(1, int(round(xSize * scale)))
+                bufYSize = max(1, int(round(ySize * scale)))
+                keyHash.update(numpy.ascontiguousarray(imgBand.ReadAsArray(0, 0, xSize, ySize, buf_xsize=bufXSize, buf_ysize=bufYSize)).tobytes())
+            else:
+                stripRows = 1024
+                for yoff in range(0, ySize, stripRows):
+                    keyHash.update(numpy.ascontiguousarray(imgBand.ReadAsArray(0, yoff, xSize, min(stripRows, ySize - yoff))).tobytes())
+        imgDS = None
+        return keyHash.hexdigest()
+
+    @staticmethod
+    def getCacheKey(inputImg, bands, numClusters, minPxls, segResolution):
+        """
+        Get the key of a segmentation from a fingerprint of a decimated read of the
+        image bands (and the image geotransform) and the segmentation parameters.
+        """
+        keyHash = hashlib.md5()
+        keyHash.update("{0}:{1!r}:{2}:{3}:{4!r}".format(ARCSISegmentCache.getContentFingerprint(inputImg, bands, ARCSISegmentCache.fingerprintSize), list(bands), numClusters, minPxls, segResolution).encode('utf-8'))
+        return keyHash.hexdigest()
+
+    @staticmethod
+    def createSegmentation(inputImg, outClumpsImg, tmpPath, bands, numClusters, minPxls, segResolution=None):
+        """
+        Run the Shepherd segmentation on the image bands. If segResolution is coarser
+        than the image resolution the bands are averaged to that resolution (ignoring
+        the no data value of 0), segmented and the clumps resampled (nearest neighbour)
+        back onto the image grid.
+        """
+        imgDS = gdal.Open(inputImg, gdal.GA_ReadOnly)
+        if imgDS is None:
+            raise ARCSIException("Could not open image: " + inputImg)
+        imgGeoTrans = imgDS.GetGeoTransform()
+        xSize = imgDS.RasterXSize
+        ySize = imgDS.RasterYSize
+        imgDS = None
+        if (segResolution is None) or (segResolution <= abs(imgGeoTrans[1])):
+            rsgislib.segmentation.segutils.runShepherdSegmentation(inputImg, outClumpsImg, tmpath=tmpPath, gdalformat="KEA", numClusters=numClusters, minPxls=minPxls, bands=bands, processInMem=True)
+        else:
+            uid = ARCSIUtils().uidGenerator()
+            lowResImg = os.path.join(tmpPath, "arcsi_seg_lowres_" + uid + ".kea")
+            lowResClumpsImg = os.path.join(tmpPath, "arcsi_seg_lowres_clumps_" + uid + ".kea")
+            # Select the bands and average to the coarser resolution; the no data
+            # value (0) is excluded so it isn't mixed into the pixels at the image edge.
+            bandsVRTDS = gdal.Translate('', inputImg, format='VRT', bandList=bands)
+            gdal.Warp(lowResImg, bandsVRTDS, format='KEA', xRes=segResolution, yRes=segResolution, resampleAlg='average', srcNodata=0, dstNodata=0)
+            bandsVRTDS = None
+            # Scale the minimum segment size to the coarser pixels.
+            lowResMinPxls = max(1, int(round(minPxls * (abs(imgGeoTrans[1] * imgGeoTrans[5]) / (segResolution * segResolution)))))
+            rsgislib.segmentation.segutils.runShepherdSegmentation(lowResImg, lowResClumpsImg, tmpath=tmpPath, gdalformat="KEA", numClusters=numClusters, minPxls=lowResMinPxls, bands=list(range(1, len(bands)+1)), processInMem=True)
+            imgBBOX = [imgGeoTrans[0], imgGeoTrans[3], imgGeoTrans[0] + (xSize * imgGeoTrans[1]), imgGeoTrans[3] + (ySize * imgGeoTrans[5])]
+            gdal.Translate(outClumpsImg, lowResClumpsImg, format='KEA', projWin=imgBBOX, width=xSize, height=ySize, resampleAlg='near')
+            rsgislib.rastergis.populateStats(outClumpsImg, True, True)
+            gdalDriver = gdal.GetDriverByName('KEA')
+            gdalDriver.Delete(lowResImg)
+            gdalDriver.Delete(lowResClumpsImg)
+
+    @staticmethod
+    def _getCachedImage(cacheFile, outImg, outFormat, createFunc):
+        """
+        Copy the cached image to outImg, creating it (createFunc(outputImage)) within the
+        cache if it doesn't exist. Returns True if the cached image was reused.
+        """
+        gdalDriver = gdal.GetDriverByName(outFormat)
+        if os.path.exists(cacheFile):
+            gdalDriver.CopyFiles(outImg, cacheFile)
+            return True
+        if not os.path.exists(ARCSISegmentCache.cacheDIR):
+            os.makedirs(ARCSISegmentCache.cacheDIR)
+        # Write to a temporary file so a partially written image is never read by another process.
+        cacheBase, cacheExt = os.path.splitext(cacheFile)
+        tmpCacheFile = cacheBase + '_tmp' + str(os.getpid()) + cacheExt
+        createFunc(tmpCacheFile)
+        gdalDriver.Rename(cacheFile, tmpCacheFile)
+        gdalDriver.CopyFiles(outImg, cacheFile)
+        return False
+
+    @staticmethod
+    def getSegmentation(inputImg, outClumpsImg, tmpPath, bands, numClusters, minPxls):
+        """
+        Get the segmentation of the image bands as outClumpsImg (a copy, so the
+        RAT can be edited by the caller), producing it if it is not within the
+        cache for the same image content and parameters. Returns the output clumps image.
+        """
+        ARCSISegmentCache._loadConfig()
+        startTime = time.time()
+        segResolution = ARCSISegmentCache.segResolution
+        if ARCSISegmentCache.cacheDIR is None:
+            # No cache so there is nothing to reuse; segment directly to the output.
+            ARCSISegmentCache.createSegmentation(inputImg, outClumpsImg, tmpPath, bands, numClusters, minPxls, segResolution)
+            print("Produced the segmentation in {0:.1f} seconds".format(time.time() - startTime))
+            return outClumpsImg
+        cacheKey = ARCSISegmentCache.getCacheKey(inputImg, bands, numClusters, minPxls, segResolution)
+        segFile = os.path.join(ARCSISegmentCache.cacheDIR, 'arcsi_segs_' + cacheKey + '.kea')
+        if ARCSISegmentCache._getCachedImage(segFile, outClumpsImg, 'KEA', lambda outImg: ARCSISegmentCache.createSegmentation(inputImg, outImg, tmpPath, bands, numClusters, minPxls, segResolution)):
+            print("Reused the segmentation ({0}) in {1:.1f} seconds".format(segFile, time.time() - startTime))
+        else:
+            print("Produced the segmentation ({0}) in {1:.1f} seconds".format(segFile, time.time() - startTime))
+        return outClumpsImg
+
+    @staticmethod
+    def getClumps(inputImg, outClumpsImg, outFormat, processInMem, noDataVal, addRatPxlVals=None):
+        """
+        Get the clumps (rsgislib.segmentation.clump) of a (categorical) image as outClumpsImg,
+        reusing a cached clumps image for the same image content (a full read, as a small
+        change to a categorical image changes the clumps). Returns the output clumps image.
+        """
+        def _createClumps(outImg):
+            if addRatPxlVals is None:
+                rsgislib.segmentation.clump(inputImg, outImg, outFormat, processInMem, noDataVal)
+            else:
+                rsgislib.segmentation.clump(inputImg, outImg, outFormat, processInMem, noDataVal, addRatPxlVals)
+
+        ARCSISegmentCache._loadConfig()
+        if ARCSISegmentCache.cacheDIR is None:
+            _createClumps(outClumpsImg)
+            return outClumpsImg
+        keyHash = hashlib.md5()
+        keyHash.update("{0}:{1}:{2}:{3!r}:{4!r}".format(ARCSISegmentCache.getContentFingerprint(inputImg), outFormat, processInMem, noDataVal, addRatPxlVals).encode('utf-8'))
+        clumpsFile = os.path.join(ARCSISegmentCache.cacheDIR, 'arcsi_clumps_' + keyHash.hexdigest() + ARCSIUtils().getFileExtension(outFormat))
+        if ARCSISegmentCache._getCachedImage(clumpsFile, outClumpsImg, outFormat, _createClumps):
+            print("Reused the clumps ({0})".format(clumpsFile))
+        return outClumpsImg
+
+    @staticmethod
+    def getClearSkyRegions(cloudsImg, inputValidImg, outputImage, outFormat, tmpPath, deleteTmpFiles, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, morphSize):
+        """
+        Get the clear-sky regions (rsgislib.imagecalibration.calcClearSkyRegions, which clumps
+        the clear-sky areas) as outputImage, reusing a cached output for the same cloud and
+        valid image content and parameters. Returns the output image.
+        """
+        def _createClearSky(outImg):
+            rsgislib.imagecalibration.calcClearSkyRegions(cloudsImg, inputValidImg, outImg, outFormat, tmpPath, deleteTmpFiles, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, morphSize)
+
+        ARCSISegmentCache._loadConfig()
+        if ARCSISegmentCache.cacheDIR is None:
+            _createClearSky(outputImage)
+            return outputImage
+        keyHash = hashlib.md5()
+        keyHash.update("{0}:{1}:{2}:{3!r}:{4!r}:{5!r}:{6!r}".format(ARCSISegmentCache.getContentFingerprint(cloudsImg), ARCSISegmentCache.getContentFingerprint(inputValidImg), outFormat, initClearSkyRegionDist, initClearSkyRegionMinSize, finalClearSkyRegionDist, morphSize).encode('utf-8'))
+        clearSkyFile = os.path.join(ARCSISegmentCache.cacheDIR, 'arcsi_clearsky_' + keyHash.hexdigest() + ARCSIUtils().getFileExtension(outFormat))
+        if ARCSISegmentCache._getCachedImage(clearSkyFile, outputImage, outFormat, _createClearSky):
+            print("Reused the clear-sky regions ({0})".format(clearSkyFile))
+        return outputImage
+
+class ARCSIBlockInfo(object):
+    """
+    A class describing a block being processed by ARCSIBlockProcessor
+    (offset and size in pixels, not including the overlap, the overlap in
+    pixels, the image geotransform and the image size in pixels).
+    """
+    def __init__(self, blockIdx, xoff, yoff, xsize, ysize, geoTrans, overlap=0, imgXSize=None, imgYSize=None):
+        self.blockIdx = blockIdx
+        self.xoff = xoff
+        self.yoff = yoff
+        self.xsize = xsize
+        self.ysize = ysize
+        self.geoTrans = geoTrans
+        self.overlap = overlap
+        self.imgXSize = imgXSize
+        self.imgYSize = imgYSize
+
+    def getInImageMask(self):
+        """
+        Return a boolean array (the block including the overlap) which is False for
+        the pixels of the overlap outside of the image (i.e., those which are padded).
+        """
+        rows = numpy.arange(self.yoff - self.overlap, self.yoff + self.ysize + self.overlap)
+        cols = numpy.arange(self.xoff - self.overlap, self.xoff + self.xsize + self.overlap)
+        return numpy.outer((rows >= 0) & (rows < self.imgYSize), (cols >= 0) & (cols < self.imgXSize))
+
+    def getBlockCoordArrays(self):
+        """
+        Return a tuple of arrays (x, y) with the coordinates of the centre of each
+        pixel within the block (the same as rios.readerinfo.getBlockCoordArrays).
+        """
+        xCoords = self.geoTrans[0] + ((numpy.arange(self.xsize) + self.xoff + 0.5) * self.geoTrans[1])
+        yCoords = self.geoTrans[3] + ((numpy.arange(self.ysize) + self.yoff + 0.5) * self.geoTrans[5])
+        return numpy.meshgrid(xCoords, yCoords)
+
+
+class ARCSIBlockProcessor(object):
+    """
+    A class which processes an image block by block, overlapping the reading,
+    computing and writing of blocks. A reader thread reads the blocks of the
+    input images into a bounded queue, a pool of compute threads runs the block
+    function (pure numpy, which releases the GIL for the heavy lifting) on
+    several blocks concurrently and a writer thread writes the output blocks.
+    Only the reader thread accesses the input datasets and only the writer
+    thread the output datasets, as GDAL datasets are not thread safe, and the
+    reading and writing is serialised behind a single lock as the GDAL drivers
+    (e.g., KEA with HDF5 builds which are not thread-safe) may share state
+    between datasets; the computing overlaps with the I/O.
+
+    The input images must all be on the same pixel grid (size, geotransform and
+    projection) as the reference image, as blocks are read using the same pixel
+    offsets from each image; this is checked before processing. Images on other
+    grids need to be warped first (e.g., ARCSIUtils.createBandStackVRT).
+    """
+
+    @staticmethod
+    def getMaxBlocksInFlight(numThreads=1, queueSize=None):
+        """
+        Get the maximum number of blocks held in memory at once: the read and write queues
+        (queueSize each), the blocks being computed (one per compute thread) and the blocks
+        held by the reader and writer threads.
+        """
+        numThreads = max(1, numThreads)
+        if queueSize is None:
+            queueSize = 2 * numThreads
+        return (2 * queueSize) + numThreads + 2
+
+    @staticmethod
+    def checkSameGrid(inputImages, refImage):
+        """
+        Check the input images are on the same pixel grid (size, geotransform and
+        projection) as the reference image, raising an ARCSIException if not.
+        """
+        refDS = gdal.Open(refImage, gdal.GA_ReadOnly)
+        if refDS is None:
+            raise ARCSIException("Could not open image: " + refImage)
+        refGeoTrans = refDS.GetGeoTransform()
+        refSpatRef = osr.SpatialReference()
+        refSpatRef.ImportFromWkt(refDS.GetProjection())
+        for inImg in inputImages:
+            inDS = gdal.Open(inImg, gdal.GA_ReadOnly)
+            if inDS is None:
+                raise ARCSIException("Could not open image: " + inImg)
+            if (inDS.RasterXSize != refDS.RasterXSize) or (inDS.RasterYSize != refDS.RasterYSize):
+                raise ARCSIException("Input images must be on the same pixel grid; the size of '" + inImg + "' differs from '" + refImage + "'.")
+            pxlTol = abs(refGeoTrans[1]) * 1e-3
+            if max([abs(inGeoTransVal - refGeoTransVal) for inGeoTransVal, refGeoTransVal in zip(inDS.GetGeoTransform(), refGeoTrans)]) > pxlTol:
+                raise ARCSIException("Input images must be on the same pixel grid; the geotransform of '" + inImg + "' differs from '" + refImage + "'.")
+            inSpatRef = osr.SpatialReference()
+            inSpatRef.ImportFromWkt(inDS.GetProjection())
+            if (inDS.GetProjection() != "") and (refDS.GetProjection() != "") and (not inSpatRef.IsSame(refSpatRef)):
+                raise ARCSIException("Input images must be on the same pixel grid; the projection of '" + inImg + "' differs from '" + refImage + "'.")
+            inDS = None
+        refDS = None
+
+    @staticmethod
+    def processImageBlocks(inputImages, outputImage, blockFunc, outFormat='KEA', blockSize=200, numThreads=1, queueSize=None, calcStats=False, refImage=None, noDataVal=None, memBudgetMB=None, bytesPerPxl=None, overlap=0, inputBands=None, accumFunc=None):
+        """
+        Apply blockFunc to each block of the input images, writing the blocks returned to the output image(s).
+
+        :param inputImages: list of input images (all on the same pixel grid as the reference image;
+                            see checkSameGrid).
+        :param outputImage: the output image (created with the grid of the reference image), a list of
+                            output images or None if nothing is to be written (see accumFunc).
+        :param blockFunc: function (info, blocks) returning the output block (a 3D array [bands, rows, cols];
+                          a list of blocks, one per output image, if outputImage is a list) where info is an
+                          ARCSIBlockInfo and blocks a list of the input image blocks (3D arrays) in the order
+                          of inputImages.
+        :param outFormat: the GDAL format of the output image.
+        :param blockSize: the size (pixels) of the square blocks (used as the default if memBudgetMB is provided).
+        :param numThreads: the number of compute threads.
+        :param queueSize: the maximum number of blocks waiting to be processed or written
+                          (Default: None; twice the number of compute threads).
+        :param calcStats: calculate the image statistics and pyramids for the output image.
+        :param refImage: the image defining the pixel grid (Default: None; the first input image).
+                         If only the grid is needed then inputImages can be an empty list.
+        :param noDataVal: the no data value to be defined for the output image bands (Default: None; not defined).
+        :param memBudgetMB: the memory budget (MB); if provided (with bytesPerPxl) the block size is
+                            calculated (ARCSIUtils.getBlockSize) for the budget shared between all the
+                            blocks in flight (see getMaxBlocksInFlight).
+        :param bytesPerPxl: the working memory (bytes) per pixel of a block.
+        :param overlap: the number of pixels of overlap around each block (as rios.applier); the input
+                        blocks include the overlap (outside of the image filled with the no data value
+                        of the image or 0; see ARCSIBlockInfo.getInImageMask) and the output blocks
+                        returned must include it, it is trimmed before writing.
+        :param inputBands: list (in the order of inputImages) of the lists of bands (starting at 1) to be
+                           read from each image or None for all the bands (Default: None; all bands).
+        :param accumFunc: optional function (info, result) called, within the writer thread (i.e., one block
+                          at a time), with the value returned by blockFunc for each block; used to accumulate
+                          values (e.g., statistics) across the blocks. If outputImage is None then nothing
+                          is written and blockFunc can return any value.
+        :return: the processing throughput (Mpixels/s).
+
+        """
+        numThreads = max(1, numThreads)
+        if queueSize is None:
+            queueSize = 2 * numThreads
+        startTime = time.time()
+
+        if (memBudgetMB is not None) and (bytesPerPxl is not None):
+            # Each block in flight (queued, computing or being read/written) needs its working memory.
+            blockSize = ARCSIUtils().getBlockSize(memBudgetMB / ARCSIBlockProcessor.getMaxBlocksInFlight(numThreads, queueSize), bytesPerPxl, blockSize)
+
+        if refImage is None:
+            refImage = inputImages[0]
+        ARCSIBlockProcessor.checkSameGrid(inputImages, refImage)
+        refDS = gdal.Open(refImage, gdal.GA_ReadOnly)
+        xSize = refDS.RasterXSize
+        ySize = refDS.RasterYSize
+        geoTrans = refDS.GetGeoTransform()
+        proj = refDS.GetProjection()
+        refDS = None
+
+        outputImages = outputImage
+        if outputImage is None:
+            outputImages = list()
+        elif not isinstance(outputImage, list):
+            outputImages = [outputImage]
+        if inputBands is None:
+            inputBands = [None] * len(inputImages)
+
+        blocksInfo = list()
+        for yoff in range(0, ySize, blockSize):
+            for xoff in range(0, xSize, blockSize):
+                blocksInfo.append(ARCSIBlockInfo(len(blocksInfo), xoff, yoff, min(blockSize, xSize - xoff), min(blockSize, ySize - yoff), geoTrans, overlap, xSize, ySize))
+
+        readQueue = queue.Queue(maxsize=queueSize)
+        writeQueue = queue.Queue(maxsize=queueSize)
+        errors = list()
+        stopEvent = threading.Event()
+        # GDAL (and the HDF5 library used by KEA) is not guaranteed to be thread-safe,
+        # so all dataset I/O (open, read, create, write and close) is serialised; only
+        # the compute overlaps with the I/O.
+        gdalIOLock = threading.Lock()
+
+        def _putItem(itemQueue, item):
+            while not stopEvent.is_set():
+                try:
+                    itemQueue.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def _readBlock(inDS, bands, info):
+            # Read the block with the overlap (clipped to the image) and pad to the full size.
+            xStart = max(0, info.xoff - overlap)
+            yStart = max(0, info.yoff - overlap)
+            xEnd = min(xSize, info.xoff + info.xsize + overlap)
+            yEnd = min(ySize, info.yoff + info.ysize + overlap)
+            if bands is None:
+                bands = list(range(1, inDS.RasterCount+1))
+            block = numpy.array([inDS.GetRasterBand(band).ReadAsArray(xStart, yStart, xEnd - xStart, yEnd - yStart) for band in bands])
+            if overlap > 0:
+                padVal = inDS.GetRasterBand(bands[0]).GetNoDataValue()
+                if padVal is None:
+                    padVal = 0
+                padWidths = ((0,0), (overlap - (info.yoff - yStart), (info.yoff + info.ysize + overlap) - yEnd), (overlap - (info.xoff - xStart), (info.xoff + info.xsize + overlap) - xEnd))
+                block = numpy.pad(block, padWidths, mode='constant', constant_values=padVal)
+            return block
+
+        def _reader():
+            try:
+                inDatasets = list()
+                with gdalIOLock:
+                    for inImg in inputImages:
+                        inDS = gdal.Open(inImg, gdal.GA_ReadOnly)
+                        if inDS is None:
+                            raise ARCSIException("Could not open image: " + inImg)
+                        inDatasets.append(inDS)
+                for info in blocksInfo:
+                    with gdalIOLock:
+                        blocks = [_readBlock(inDS, bands, info) for inDS, bands in zip(inDatasets, inputBands)]
+                    if not _putItem(readQueue, (info, blocks)):
+                        break
+            except Exception as e:
+                errors.append(e)
+                stopEvent.set()
+            finally:
+                with gdalIOLock:
+                    inDatasets = None
+                for i in range(numThreads):
+                    _putItem(readQueue, None)
+
+        def _compute():
+            try:
+                while not stopEvent.is_set():
+                    try:
+                        item = readQueue.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    if item is None:
+                        break
+                    info, blocks = item
+                    if not _putItem(writeQueue, (info, blockFunc(info, blocks))):
+                        break
+            except Exception as e:
+                errors.append(e)
+                stopEvent.set()
+
+        def _writer():
+            outDatasets = [None] * len(outputImages)
+            try:
+                numWritten = 0
+                while (numWritten < len(blocksInfo)) and (not stopEvent.is_set()):
+                    try:
+                        item = writeQueue.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    info, result = item
+                    if accumFunc is not None:
+                        accumFunc(info, result)
+                    outBlocks = list()
+                    if isinstance(outputImage, list):
+                        outBlocks = result
+                    elif outputImage is not None:
+                        outBlocks = [result]
+                    for outIdx, outBlock in enumerate(outBlocks):
+                        if outBlock.ndim == 2:
+                            outBlock = numpy.expand_dims(outBlock, axis=0)
+                        if overlap > 0:
+                            outBlock = outBlock[:, overlap:overlap+info.ysize, overlap:overlap+info.xsize]
+                        with gdalIOLock:
+                            if outDatasets[outIdx] is None:
+                                gdalDataType = gdal_array.NumericTypeCodeToGDALTypeCode(outBlock.dtype)
+                                gdalDriver = gdal.GetDriverByName(outFormat)
+                                outDS = gdalDriver.Create(outputImages[outIdx], xSize, ySize, outBlock.shape[0], gdalDataType)
+                                if outDS is None:
+                                    raise ARCSIException("Could not create output image: " + outputImages[outIdx])
+                                outDS.SetGeoTransform(geoTrans)
+                                outDS.SetProjection(proj)
+                                if noDataVal is not None:
+                                    for band in range(outBlock.shape[0]):
+                                        outDS.GetRasterBand(band+1).SetNoDataValue(noDataVal)
+                                outDatasets[outIdx] = outDS
+                            for band in range(outBlock.shape[0]):
+                                outDatasets[outIdx].GetRasterBand(band+1).WriteArray(outBlock[band], info.xoff, info.yoff)
+                    numWritten = numWritten + 1
+            except Exception as e:
+                errors.append(e)
+                stopEvent.set()
+            finally:
+                with gdalIOLock:
+                    outDatasets = None
+
+        readerThread = threading.Thread(target=_reader)
+        computeThreads = [threading.Thread(target=_compute) for i in range(numThreads)]
+        writerThread = threading.Thread(target=_writer)
+        readerThread.start()
+        for computeThread in computeThreads:
+            computeThread.start()
+        writerThread.start()
+        writerThread.join()
+        stopEvent.set()
+        readerThread.join()
+        for computeThread in computeThreads:
+            computeThread.join()
+        if len(errors) > 0:
+            raise errors[0]
+
+        if calcStats:
+            for outImg in outputImages:
+                rsgislib.imageutils.popImageStats(outImg, False, 0, True)
+
+        procTime = time.time() - startTime
+        mPxls = (xSize * ySize) / 1e6
+        mPxlsPerSec = 0.0
+        if procTime > 0:
+            mPxlsPerSec = mPxls / procTime
+        print("Processed {0} blocks ({1:.1f} Mpixels) in {2:.1f} seconds ({3:.2f} Mpixels/s) using {4} compute threads".format(len(blocksInfo), mPxls, procTime, mPxlsPerSec, numThreads))
+        return mPxlsPerSec
+
+
+class ARCSI6SCoeffLUT(object):
+    """
+    A class holding a LUT of 6S coefficients as a dense numpy array with the
+    shape (n elevations, n AOTs, n bands, 6), where the number of AOTs is 1
+    if the LUT is only for elevation (aots is None). The coefficients are in the
+    order aX, bX, cX, DirIrr, DifIrr, EnvIrr. The LUT is converted to the
+    structures required by rsgislib.imagecalibration.apply6SCoeff* using
+    getRSGISLibLUT and can be written to a JSON file for inspection.
+    """
+    coeffNames = ['aX', 'bX', 'cX', 'DirIrr', 'DifIrr', 'EnvIrr']
+    applyBackends = ['RSGISLIB', 'NUMPY', 'VALIDATE']
+    applyBackend = None
+
+    @staticmethod
+    def setApplyBackend(applyBackend=None):
+        """
+        Set the backend used to apply the 6S coefficients to the radiance images:
+        'RSGISLIB' (rsgislib.imagecalibration.apply6SCoeff*), 'NUMPY' (block-wise
+        numpy, see calcSREFBlock) or 'VALIDATE' (both, reporting the differences and
+        throughput; the rsgislib output is kept). If None then the ARCSI_SREF_BACKEND
+        environment variable is used, defaulting to 'RSGISLIB'.
+        """
+        if applyBackend is None:
+            applyBackend = ARCSIUtils().getEnvironmentVariable("ARCSI_SREF_BACKEND")
+            if applyBackend is None:
+                applyBackend = 'RSGISLIB'
+        applyBackend = applyBackend.upper()
+        if applyBackend not in ARCSI6SCoeffLUT.applyBackends:
+            raise ARCSIException("The 6S coefficients backend '" + applyBackend + "' is not recognised; options are: " + ", ".join(ARCSI6SCoeffLUT.applyBackends))
+        ARCSI6SCoeffLUT.applyBackend = applyBackend
+
+    @staticmethod
+    def getApplyBackend():
+        if ARCSI6SCoeffLUT.applyBackend is None:
+            ARCSI6SCoeffLUT.setApplyBackend()
+        return ARCSI6SCoeffLUT.applyBackend
+
+    stdSREFBackends = ['RSGISLIB', 'NUMPY', 'VALIDATE']
+    stdSREFBackend = None
+    # The maximum difference (reflectance) from rsgislib accepted when validating the numpy standardised reflectance.
+    stdSREFValidateTol = 0.01
+
+    @staticmethod
+    def setStdSREFBackend(stdSREFBackend=None):
+        """
+        Set the backend used to calculate the standardised reflectance: 'RSGISLIB'
+        (rsgislib.imagecalibration.calcIrradianceImageElevLUT and calcStandardisedReflectanceSD2010),
+        'NUMPY' (a single block-wise numpy pass) or 'VALIDATE' (both, reporting the differences
+        and runtimes; the rsgislib output is kept). If None then the ARCSI_STDSREF_BACKEND
+        environment variable is used, defaulting to 'RSGISLIB'.
+        """
+        if stdSREFBackend is None:
+            stdSREFBackend = ARCSIUtils().getEnvironmentVariable("ARCSI_STDSREF_BACKEND")
+            if stdSREFBackend is None:
+                stdSREFBackend = 'RSGISLIB'
+        stdSREFBackend = stdSREFBackend.upper()
+        if stdSREFBackend not in ARCSI6SCoeffLUT.stdSREFBackends:
+            raise ARCSIException("The standardised reflectance backend '" + stdSREFBackend + "' is not recognised; options are: " + ", ".join(ARCSI6SCoeffLUT.stdSREFBackends))
+        ARCSI6SCoeffLUT.stdSREFBackend = stdSREFBackend
+
+    @staticmethod
+    def getStdSREFBackend():
+        if ARCSI6SCoeffLUT.stdSREFBackend is None:
+            ARCSI6SCoeffLUT.setStdSREFBackend()
+        return ARCSI6SCoeffLUT.stdSREFBackend
+
+    lutInterps = ['NEAREST', 'LINEAR']
+    lutInterp = None
+    lutElevStep = None
+    lutAOTStep = None
+
+    @staticmethod
+    def setLUTConfig(lutInterp=None, elevStep=None, aotStep=None):
+        """
+        Set how the coefficients are looked up from the LUT nodes ('NEAREST' or 'LINEAR';
+        bilinear interpolation between the elevation and AOT nodes) and the spacing of the
+        LUT nodes for elevation (metres) and AOT. If None then the ARCSI_LUT_INTERP,
+        ARCSI_LUT_ELEV_STEP and ARCSI_LUT_AOT_STEP environment variables are used,
+        defaulting to 'NEAREST', 100 and 0.05 respectively. Note, rsgislib only supports
+        the nearest node so when interpolating the numpy backend is used to apply the LUT.
+        """
+        arcsiUtils = ARCSIUtils()
+        if lutInterp is None:
+            lutInterp = arcsiUtils.getEnvironmentVariable("ARCSI_LUT_INTERP")
+            if lutInterp is None:
+                lutInterp = 'NEAREST'
+        lutInterp = lutInterp.upper()
+        if lutInterp not in ARCSI6SCoeffLUT.lutInterps:
+            raise ARCSIException("The LUT interpolation '" + lutInterp + "' is not recognised; options are: " + ", ".join(ARCSI6SCoeffLUT.lutInterps))
+        if elevStep is None:
+            elevStep = arcsiUtils.str2Float(arcsiUtils.getEnvironmentVariable("ARCSI_LUT_ELEV_STEP"), 100.0)
+        if aotStep is None:
+            aotStep = arcsiUtils.str2Float(arcsiUtils.getEnvironmentVariable("ARCSI_LUT_AOT_STEP"), 0.05)
+        if (elevStep <= 0) or (aotStep <= 0):
+            raise ARCSIException("The LUT elevation and AOT steps must be greater than zero.")
+        ARCSI6SCoeffLUT.lutInterp = lutInterp
+        ARCSI6SCoeffLUT.lutElevStep = float(elevStep)
+        ARCSI6SCoeffLUT.lutAOTStep = float(aotStep)
+
+    @staticmethod
+    def getLUTConfig():
+        """
+        :return: tuple (interpolation, elevation step, AOT step)
+        """
+        if ARCSI6SCoeffLUT.lutInterp is None:
+            ARCSI6SCoeffLUT.setLUTConfig()
+        return ARCSI6SCoeffLUT.lutInterp, ARCSI6SCoeffLUT.lutElevStep, ARCSI6SCoeffLUT.lutAOTStep
+
+    def __init__(self, elevs, coeffs, aots=None):
+        self.elevs = numpy.array(elevs, dtype=numpy.float64)
+        self.aots = None
+        if aots is not None:
+            self.aots = numpy.array(aots, dtype=numpy.float64)
+        self.coeffs = numpy.array(coeffs, dtype=numpy.float64)
+        nAOTs = 1
+        if self.aots is not None:
+            nAOTs = self.aots.shape[0]
+        if (self.coeffs.ndim != 4) or (self.coeffs.shape[0] != self.elevs.shape[0]) or (self.coeffs.shape[1] != nAOTs) or (self.coeffs.shape[3] != 6):
+            raise ARCSIException("The shape of the 6S coefficients array " + str(self.coeffs.shape) + " does not match the elevations and AOTs of the LUT.")
+        self.rsgisLUT = None
+
+    def isAOTLUT(self):
+        return self.aots is not None
+
+    def getNumBands(self):
+        return self.coeffs.shape[2]
+
+    def getRSGISLibLUT(self):
+        """
+        Get the LUT as a list of rsgislib.imagecalibration.ElevLUTFeat, each containing a
+        list of rsgislib.imagecalibration.Band6SCoeff or, for an AOT LUT, a list of
+        rsgislib.imagecalibration.AOTLUTFeat. The list is only created once.
+        """
+        if self.rsgisLUT is None:
+            def _bandCoeffs(sixsCoeffs):
+                return [rsgislib.imagecalibration.Band6SCoeff(band=int(i+1), aX=float(bandCoeffs[0]), bX=float(bandCoeffs[1]), cX=float(bandCoeffs[2]), DirIrr=float(bandCoeffs[3]), DifIrr=float(bandCoeffs[4]), EnvIrr=float(bandCoeffs[5])) for i, bandCoeffs in enumerate(sixsCoeffs.tolist())]
+
+            self.rsgisLUT = list()
+            for i, elevVal in enumerate(self.elevs.tolist()):
+                if self.isAOTLUT():
+                    aotCoeffs = [rsgislib.imagecalibration.AOTLUTFeat(AOT=float(aotVal), Coeffs=_bandCoeffs(self.coeffs[i,j])) for j, aotVal in enumerate(self.aots.tolist())]
+                    self.rsgisLUT.append(rsgislib.imagecalibration.ElevLUTFeat(Elev=float(elevVal), Coeffs=aotCoeffs))
+                else:
+                    self.rsgisLUT.append(rsgislib.imagecalibration.ElevLUTFeat(Elev=float(elevVal), Coeffs=_bandCoeffs(self.coeffs[i,0])))
+        return self.rsgisLUT
+
+    @staticmethod
+    def getNearestNodeIdxs(vals, lutVals):
+        """
+        Get the index of the nearest LUT node (lutVals, ascending) for each of the values.
+        """
+        if lutVals.shape[0] == 1:
+            return numpy.zeros(numpy.shape(vals), dtype=numpy.int64)
+        return numpy.searchsorted((lutVals[:-1] + lutVals[1:]) / 2, vals)
+
+    @staticmethod
+    def getLinearNodeWeights(vals, lutVals):
+        """
+        Get the indexes of the LUT nodes (lutVals, ascending) either side of each of the
+        values and the weight of the upper node (values outside of the LUT are clamped).
+
+        :return: tuple (lower node indexes, upper node indexes, upper node weights)
+        """
+        if lutVals.shape[0] == 1:
+            nodeIdxs = numpy.zeros(numpy.shape(vals), dtype=numpy.int64)
+            return nodeIdxs, nodeIdxs, numpy.zeros(numpy.shape(vals), dtype=numpy.float64)
+        lowerIdxs = numpy.clip(numpy.searchsorted(lutVals, vals, side='right') - 1, 0, lutVals.shape[0] - 2)
+        upperWeights = numpy.clip((vals - lutVals[lowerIdxs]) / (lutVals[lowerIdxs+1] - lutVals[lowerIdxs]), 0.0, 1.0)
+        return lowerIdxs, lowerIdxs + 1, upperWeights
+
+    def getPixelCoeffs(self, elevVals=None, aotVals=None, coeffIdxs=None, lutInterp=None):
+        """
+        Get the coefficients for each pixel for the elevation (and, for an AOT LUT, the AOT)
+        of the pixel, either from the nearest LUT node or bilinearly interpolated between
+        the nodes.
+
+        :param elevVals: 2D array of elevations (not required if the LUT has a single node).
+        :param aotVals: 2D array of AOT values (only required for an AOT LUT).
+        :param coeffIdxs: list of the indexes of the coefficients required (Default: all 6).
+        :param lutInterp: 'NEAREST' or 'LINEAR' (Default: None; see setLUTConfig).
+        :return: array with the shape (n bands, n coefficients, rows, cols), where rows and
+                 cols are 1 if the LUT has a single node.
+        """
+        if coeffIdxs is None:
+            coeffIdxs = list(range(6))
+        if lutInterp is None:
+            lutInterp = ARCSI6SCoeffLUT.getLUTConfig()[0]
+        if (self.coeffs.shape[0] == 1) and (self.coeffs.shape[1] == 1):
+            return self.coeffs[0,0][:,coeffIdxs][...,numpy.newaxis,numpy.newaxis]
+        if elevVals is None:
+            raise ARCSIException("Elevation values are required to look up coefficients from an elevation LUT.")
+        if self.isAOTLUT() and (aotVals is None):
+            raise ARCSIException("AOT values are required to look up coefficients from an AOT LUT.")
+        lutCoeffs = self.coeffs[...,coeffIdxs]
+
+        if lutInterp == 'LINEAR':
+            elevIdx0, elevIdx1, elevWeight = ARCSI6SCoeffLUT.getLinearNodeWeights(elevVals, self.elevs)
+            elevWeight = elevWeight[...,numpy.newaxis,numpy.newaxis]
+            if self.isAOTLUT():
+                aotIdx0, aotIdx1, aotWeight = ARCSI6SCoeffLUT.getLinearNodeWeights(aotVals, self.aots)
+                aotWeight = aotWeight[...,numpy.newaxis,numpy.newaxis]
+                pxlCoeffs = ((1 - elevWeight) * (1 - aotWeight) * lutCoeffs[elevIdx0, aotIdx0]) + ((1 - elevWeight) * aotWeight * lutCoeffs[elevIdx0, aotIdx1]) + (elevWeight * (1 - aotWeight) * lutCoeffs[elevIdx1, aotIdx0]) + (elevWeight * aotWeight * lutCoeffs[elevIdx1, aotIdx1])
+            else:
+                pxlCoeffs = ((1 - elevWeight) * lutCoeffs[elevIdx0, 0]) + (elevWeight * lutCoeffs[elevIdx1, 0])
+        else:
+            elevIdx = ARCSI6SCoeffLUT.getNearestNodeIdxs(elevVals, self.elevs)
+            aotIdx = 0
+            if self.isAOTLUT():
+                aotIdx = ARCSI6SCoeffLUT.getNearestNodeIdxs(aotVals, self.aots)
+            pxlCoeffs = lutCoeffs[elevIdx, aotIdx]
+        return pxlCoeffs.transpose((2,3,0,1))
+
+    def getNodesSubset(self, elevNodeStep, aotNodeStep=1):
+        """
+        Get a LUT using every elevNodeStep elevation node and aotNodeStep AOT node of this
+        LUT (always including the last nodes so the same range is covered).
+
+        :return: ARCSI6SCoeffLUT
+        """
+        def _nodeIdxs(numNodes, nodeStep):
+            nodeIdxs = list(range(0, numNodes, nodeStep))
+            if nodeIdxs[-1] != (numNodes - 1):
+                nodeIdxs.append(numNodes - 1)
+            return nodeIdxs
+        elevIdxs = _nodeIdxs(self.elevs.shape[0], elevNodeStep)
+        if self.isAOTLUT():
+            aotIdxs = _nodeIdxs(self.aots.shape[0], aotNodeStep)
+            return ARCSI6SCoeffLUT(self.elevs[elevIdxs], self.coeffs[elevIdxs][:,aotIdxs], self.aots[aotIdxs])
+        return ARCSI6SCoeffLUT(self.elevs[elevIdxs], self.coeffs[elevIdxs])
+
+    def getElevationLUT(self, aotVal):
+        """
+        Get an elevation LUT from this AOT LUT using the AOT node nearest to aotVal
+        (e.g., so the output using an AOT LUT can be compared with rsgislib, which
+        only supports an elevation LUT).
+
+        :return: ARCSI6SCoeffLUT
+        """
+        if not self.isAOTLUT():
+            return self
+        aotIdx = int(ARCSI6SCoeffLUT.getNearestNodeIdxs(numpy.array([aotVal]), self.aots)[0])
+        return ARCSI6SCoeffLUT(self.elevs, self.coeffs[:,aotIdx:aotIdx+1])
+
+    def calcSREFError(self, refLUT, lutInterp, refls=(0.02, 0.05, 0.1, 0.2, 0.4, 0.6)):
+        """
+        Calculate the error in surface reflectance from using this LUT, rather than the
+        (denser) reference LUT, at each of the nodes of the reference LUT. For each reference
+        node and band the radiances which give the reflectances (refls) with the reference
+        coefficients are calculated and converted to reflectance with this LUT.
+
+        :return: tuple (mean absolute error, maximum absolute error) in reflectance (0-1).
+        """
+        refls = numpy.array(refls, dtype=numpy.float64)
+        refAOTs = refLUT.aots
+        if refAOTs is None:
+            refAOTs = numpy.zeros(1)
+        elevVals, aotVals = numpy.meshgrid(refLUT.elevs, refAOTs, indexing='ij')
+        refCoeffs = refLUT.coeffs[...,numpy.newaxis]
+        y = refls / (1.0 - (refCoeffs[:,:,:,2] * refls))
+        radVals = (y + refCoeffs[:,:,:,1]) / refCoeffs[:,:,:,0]
+        pxlCoeffs = self.getPixelCoeffs(elevVals, aotVals, [0,1,2], lutInterp)[...,numpy.newaxis]
+        y = (pxlCoeffs[:,0] * radVals.transpose((2,0,1,3))) - pxlCoeffs[:,1]
+        srefErr = numpy.abs((y / (1.0 + (pxlCoeffs[:,2] * y))) - refls)
+        return float(numpy.mean(srefErr)), float(numpy.max(srefErr))
+
+    def calcSREFBlock(self, radArr, elevArr=None, aotArr=None):
+        """
+        Apply the 6S coefficients to a block of radiance values (3D array [bands, rows, cols]),
+        following rsgislib.imagecalibration.apply6SCoeff*: y = (aX * radiance) - bX and
+        reflectance = y / (1 + (cX * y)).
+
+        :return: 3D array (float64) of surface reflectance (0-1) for the block.
+        """
+        if radArr.shape[0] != self.getNumBands():
+            raise ARCSIException("The number of image bands (" + str(radArr.shape[0]) + ") does not match the 6S coefficients LUT (" + str(self.getNumBands()) + ").")
+        pxlCoeffs = self.getPixelCoeffs(elevArr, aotArr, [0,1,2])
+        y = (pxlCoeffs[:,0] * radArr) - pxlCoeffs[:,1]
+        return y / (1.0 + (pxlCoeffs[:,2] * y))
+
+    def writeJSONFile(self, outFile):
+        """
+        Write the LUT to a JSON file (the elevations, AOTs, coefficient names and
+        the coefficients array as nested lists).
+        """
+        lutInfo = dict()
+        lutInfo['elevs'] = self.elevs.tolist()
+        lutInfo['aots'] = None
+        if self.isAOTLUT():
+            lutInfo['aots'] = self.aots.tolist()
+        lutInfo['coeffNames'] = ARCSI6SCoeffLUT.coeffNames
+        lutInfo['coeffs'] = self.coeffs.tolist()
+        with open(outFile, 'w') as outJSONFile:
+            json.dump(lutInfo, outJSONFile)
+
+
 class ARCSILandsatMetaUtils(object):
     """
     A class with common functions for parsing Landsat
     metadata
     """
+    mtlCache = dict()
+
+    @staticmethod
+    def readMTLFile(mtlFile):
+        """
+        Read the Landsat MTL header file into a dict of key and value pairs (with
+        quotes removed). The dict is the same as that returned by
+        fmask.config.readMTLFile so can be used for both ARCSI and python-fmask.
+        The file is parsed once per process and cached, keyed on the file path,
+        size and modification time. A copy of the cached dict is returned.
+        """
+        mtlFile = os.path.abspath(mtlFile)
+        mtlStat = os.stat(mtlFile)
+        cacheKey = "{0}:{1}:{2}".format(mtlFile, mtlStat.st_size, mtlStat.st_mtime)
+        if not cacheKey in ARCSILandsatMetaUtils.mtlCache:
+            headerParams = dict()
+            with open(mtlFile, 'r') as hFile:
+                for line in hFile:
+                    lineVals = line.split('=')
+                    if len(lineVals) == 2:
+                        headerParams[lineVals[0].strip()] = lineVals[1].strip().replace('"','')
+            ARCSILandsatMetaUtils.mtlCache[cacheKey] = headerParams
+        return dict(ARCSILandsatMetaUtils.mtlCache[cacheKey])
 
     @staticmethod
     def getGeographicCorners(headerParams):
@@ -0,0 +1,429 @@
+"""
+Module that contains the functions for running ARCSI as a long running
+worker which processes scenes from a job queue.
+"""
+############################################################################
+#  arcsiworker.py
+#
+#  Copyright 2013 ARCSI.
+#
+#  ARCSI: 'Atmospheric and Radiometric Correction of Satellite Imagery'
+#
+#  ARCSI is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  ARCSI is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with ARCSI.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Purpose:  A worker mode for ARCSI which processes scene jobs from a
+#           local spool directory. The worker process is kept alive
+#           between jobs so the imported modules and the in memory caches
+#           (e.g., aerosol/atmosphere profiles and DEM subsets) are warm.
+#
+# Author: ARCSI Contributors
+# Email: rsgislib-support@googlegroups.com
+# Date: 18/10/2026
+# Version: 1.0
+#
+# History:
+# Version 1.0 - Created.
+#
+############################################################################
+
+# Import updated print function into python 2.7
+from __future__ import print_function
+# Import updated division operator into python 2.7
+from __future__ import division
+# Import the system library
+import sys
+# Import the OS python module
+import os
+# Import the time module
+import time
+# Import the datetime module
+import datetime
+# Import the JSON module
+import json
+# Import the glob module
+import glob
+# Import the errno module
+import errno
+# Import the signal module
+import signal
+# Import ARCSI library
+import arcsilib
+# Import the ARCSI exception class
+from arcsilib.arcsiexception import ARCSIException
+# Import the ARCSI utilities class
+from arcsilib.arcsiutils import ARCSIUtils
+# Import the ARCSI run module
+import arcsilib.arcsirun
+# Import the multiprocessing Pool module
+from multiprocessing import Pool
+# Import the python queue module
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def getDefaultJobParams():
+    """
+    A function which returns a dict with the default parameters for a job, these
+    are the same as the defaults for the arcsi.py command. The keys are the names
+    of the parameters of arcsilib.arcsirun.runARCSI.
+    """
+    jobParams = dict()
+    jobParams['inputHeader'] = None
+    jobParams['inputImage'] = None
+    jobParams['cloudMaskUsrImg'] = None
+    jobParams['sensorStr'] = None
+    jobParams['inWKTFile'] = None
+    jobParams['outFormat'] = 'KEA'
+    jobParams['outFilePath'] = None
+    jobParams['outBaseName'] = None
+    jobParams['outWKTFile'] = None
+    jobParams['outProj4File'] = None
+    jobParams['projAbbv'] = None
+    jobParams['xPxlResUsr'] = None
+    jobParams['yPxlResUsr'] = None
+    jobParams['productsStr'] = None
+    jobParams['calcStatsPy'] = False
+    jobParams['aeroProfileOption'] = None
+    jobParams['atmosProfileOption'] = None
+    jobParams['aeroProfileOptionImg'] = arcsilib.DEFAULT_ARCSI_AEROIMG_PATH
+    jobParams['atmosProfileOptionImg'] = arcsilib.DEFAULT_ARCSI_ATMOSIMG_PATH
+    jobParams['grdReflOption'] = 'GreenVegetation'
+    jobParams['surfaceAltitude'] = 0.0
+    jobParams['atmosOZoneVal'] = None
+    jobParams['atmosWaterVal'] = None
+    jobParams['aeroWaterVal'] = None
+    jobParams['aeroDustVal'] = None
+    jobParams['aeroOceanicVal'] = None
+    jobParams['aeroSootVal'] = None
+    jobParams['aotVal'] = None
+    jobParams['visVal'] = None
+    jobParams['tmpPath'] = None
+    jobParams['minAOT'] = 0.05
+    jobParams['maxAOT'] = 0.5
+    jobParams['lowAOT'] = 0.1
+    jobParams['upAOT'] = 0.4
+    jobParams['demFile'] = None
+    jobParams['demNoDataUsrVal'] = None
+    jobParams['aotFile'] = None
+    jobParams['globalDOS'] = True
+    jobParams['dosOutRefl'] = 20
+    jobParams['simpleDOS'] = False
+    jobParams['debugMode'] = False
+    jobParams['scaleFactor'] = 1000
+    jobParams['interpAlgor'] = 'cubic'
+    jobParams['interpAlgorResample'] = 'near'
+    jobParams['initClearSkyRegionDist'] = 3000
+    jobParams['initClearSkyRegionMinSize'] = 3000
+    jobParams['finalClearSkyRegionDist'] = 1000
+    jobParams['clearSkyMorphSize'] = 21
+    jobParams['fullImgOuts'] = False
+    jobParams['checkOutputs'] = False
+    jobParams['classmlclouds'] = False
+    jobParams['cloudtrainclouds'] = None
+    jobParams['cloudtrainother'] = None
+    jobParams['resample2LowResImg'] = False
+    jobParams['fileEnding2Keep'] = None
+    jobParams['cloud_methods'] = None
+    jobParams['demCacheDIR'] = None
+    jobParams['numThreads'] = 1
+    jobParams['maxMemMB'] = None
+    jobParams['previewFactor'] = None
+    jobParams['preScreenMaxCloud'] = None
+    return jobParams
+
+
+class ARCSIJobSpool (object):
+    """
+    A class which manages a queue of scene jobs stored as JSON files within
+    a spool directory. Jobs are moved between the 'pending', 'running', 'done'
+    and 'failed' sub-directories; a job is claimed by renaming it into the
+    'running' directory, which is atomic so multiple workers can share a spool.
+    """
+
+    def __init__(self, spoolDIR):
+        self.spoolDIR = os.path.abspath(spoolDIR)
+        self.pendingDIR = os.path.join(self.spoolDIR, 'pending')
+        self.runningDIR = os.path.join(self.spoolDIR, 'running')
+        self.doneDIR = os.path.join(self.spoolDIR, 'done')
+        self.failedDIR = os.path.join(self.spoolDIR, 'failed')
+        for spoolSubDIR in [self.pendingDIR, self.runningDIR, self.doneDIR, self.failedDIR]:
+            if not os.path.exists(spoolSubDIR):
+                os.makedirs(spoolSubDIR)
+
+    def submitJob(self, jobParams, jobName=None):
+        """
+        Add a job to the queue. jobParams is a dict using the parameter names of
+        arcsilib.arcsirun.runARCSI (see getDefaultJobParams), only the values which
+        differ from the defaults need to be provided. Returns the job file path.
+        """
+        if ('inputHeader' not in jobParams) or (jobParams['inputHeader'] is None):
+            raise ARCSIException("A job must specify the 'inputHeader'.")
+        defaultParams = getDefaultJobParams()
+        for key in jobParams:
+            if key not in defaultParams:
+                raise ARCSIException("Job parameter '" + key + "' is not recognised.")
+        if jobName is None:
+            jobName = datetime.datetime.now().strftime("%Y%m%d%H%M%S%f") + '_' + ARCSIUtils().uidGenerator()
+        jobFile = os.path.join(self.pendingDIR, jobName + '.json')
+        tmpJobFile = os.path.join(self.spoolDIR, '.' + jobName + '.json.tmp')
+        with open(tmpJobFile, 'w') as jobFileObj:
+            json.dump({'params': jobParams}, jobFileObj, indent=4, sort_keys=True)
+        os.rename(tmpJobFile, jobFile)
+        return jobFile
+
+    def listJobs(self, status='pending'):
+        """
+        List the job files with the status (pending, running, done or failed).
+        """
+        return sorted(glob.glob(os.path.join(os.path.join(self.spoolDIR, status), '*.json')))
+
+    def claimJob(self):
+        """
+        Claim the oldest pending job, returning the path to the job file within the
+        running directory or None if there are no pending jobs.
+        """
+        for jobFile in self.listJobs('pending'):
+            runningJobFile = os.path.join(self.runningDIR, os.path.basename(jobFile))
+            try:
+                os.rename(jobFile, runningJobFile)
+            except OSError:
+                # Another worker claimed the job.
+                continue
+            return runningJobFile
+        return None
+
+    def finishJob(self, runningJobFile, jobReport):
+        """
+        Move a running job to either the done or failed directory, writing the
+        job report (i.e., status and timing) into the job file.
+        """
+        with open(runningJobFile, 'r') as jobFileObj:
+            jobInfo = json.load(jobFileObj)
+        jobInfo['report'] = jobReport
+        outDIR = self.doneDIR
+        if jobReport['status'] != 'done':
+            outDIR = self.failedDIR
+        outJobFile = os.path.join(outDIR, os.path.basename(runningJobFile))
+        with open(outJobFile, 'w') as jobFileObj:
+            json.dump(jobInfo, jobFileObj, indent=4, sort_keys=True)
+        os.remove(runningJobFile)
+        jobPIDFile = ARCSIJobSpool.getJobPIDFile(runningJobFile)
+        if os.path.exists(jobPIDFile):
+            os.remove(jobPIDFile)
+        return outJobFile
+
+    @staticmethod
+    def getJobPIDFile(runningJobFile):
+        """
+        Get the path of the file in which the process running the job records its pid.
+        """
+        return runningJobFile + '.pid'
+
+    @staticmethod
+    def getJobPID(runningJobFile):
+        """
+        Get the pid of the process running the job, or None if the job has not started.
+        """
+        try:
+            with open(ARCSIJobSpool.getJobPIDFile(runningJobFile), 'r') as pidFileObj:
+                return int(pidFileObj.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+
+def isProcessAlive(pid):
+    """
+    A function which checks whether the process is alive. This can only be checked
+    on POSIX systems (without terminating the process), elsewhere True is returned.
+    """
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def getFailedJobReport(jobFile, error, startTime, pid=None):
+    """
+    A function which returns a failed job report (see runARCSIJob) for a job which
+    did not return a report (e.g., its process died or it timed out).
+    """
+    jobReport = dict()
+    jobReport['job'] = os.path.basename(jobFile)
+    jobReport['pid'] = pid
+    jobReport['start'] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(startTime))
+    jobReport['status'] = 'failed'
+    jobReport['failed_products'] = []
+    jobReport['error'] = error
+    jobReport['end'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    jobReport['time'] = time.time() - startTime
+    print("Job '{0}' failed: {1}".format(jobReport['job'], error), file=sys.stderr)
+    return jobReport
+
+
+def runARCSIJob(jobFile):
+    """
+    A function which runs the job defined within the JSON job file, returning a
+    dict reporting the status and timing of the job.
+    """
+    jobReport = dict()
+    jobReport['job'] = os.path.basename(jobFile)
+    jobReport['pid'] = os.getpid()
+    jobReport['start'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    jobReport['status'] = 'failed'
+    jobReport['failed_products'] = []
+    jobReport['error'] = None
+    startTime = time.time()
+    try:
+        # Record the pid so the worker can check the process running the job is alive.
+        with open(ARCSIJobSpool.getJobPIDFile(jobFile), 'w') as pidFileObj:
+            pidFileObj.write(str(os.getpid()))
+        with open(jobFile, 'r') as jobFileObj:
+            jobInfo = json.load(jobFileObj)
+        jobParams = getDefaultJobParams()
+        jobParams.update(jobInfo['params'])
+
+        atmosOZoneWaterSpecified = (jobParams['atmosOZoneVal'] is not None) and (jobParams['atmosWaterVal'] is not None)
+        aeroComponentsSpecified = False
+        for aeroParam in ['aeroWaterVal', 'aeroDustVal', 'aeroOceanicVal', 'aeroSootVal']:
+            if jobParams[aeroParam] is not None:
+                aeroComponentsSpecified = True
+        jobParams['atmosOZoneWaterSpecified'] = atmosOZoneWaterSpecified
+        jobParams['aeroComponentsSpecified'] = aeroComponentsSpecified
+        jobReport['input_header'] = jobParams['inputHeader']
+
+        paramsObj = arcsilib.arcsirun.runARCSI(**jobParams)
+
+        if paramsObj is not None:
+            for key in paramsObj.prodsToCalc.keys():
+                if paramsObj.prodsToCalc[key] is not paramsObj.prodsCalculated[key]:
+                    jobReport['failed_products'].append(key)
+            jobReport['out_base_name'] = paramsObj.outBaseName
+            jobReport['dem_prep_time'] = paramsObj.demPrepTime
+            jobReport['stats_imgs_skipped'] = paramsObj.numStatsImgsSkipped
+            if len(jobReport['failed_products']) == 0:
+                jobReport['status'] = 'done'
+    except Exception as e:
+        jobReport['error'] = "{}".format(e)
+        print("Error: {}".format(e), file=sys.stderr)
+    jobReport['end'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    jobReport['time'] = time.time() - startTime
+    print("Job '{0}' {1} in {2:.2f} seconds.".format(jobReport['job'], jobReport['status'], jobReport['time']))
+    return jobReport
+
+
+def runARCSIWorker(spoolDIR, ncores=1, pollInterval=10, exitWhenEmpty=False, maxJobs=None, jobTimeout=None):
+    """
+    A function which runs ARCSI as a worker, processing jobs from the spool
+    directory until it is empty (if exitWhenEmpty is True), maxJobs have been
+    processed or the process is killed. If ncores is greater than 1 then jobs are
+    processed with a bounded pool of processes which are kept alive between jobs;
+    a new job is claimed from the spool as soon as any process becomes free so
+    a slow scene does not hold up the other processes. A pool job which raises an
+    error, whose process dies or which runs for longer than jobTimeout (seconds;
+    its process is then terminated) is reported as failed rather than left running.
+    Returns a list of the job reports.
+    """
+    jobSpool = ARCSIJobSpool(spoolDIR)
+    plObj = None
+    if ncores > 1:
+        plObj = Pool(ncores)
+    # Queue to which the pool result handler passes the finished jobs.
+    finishedJobsQueue = queue.Queue()
+    # The start time of the jobs running within the pool.
+    runningJobs = dict()
+    # Whether a pool job was reported without returning (i.e., its process died or was terminated).
+    jobsAbandoned = False
+    jobReports = []
+    nJobsClaimed = 0
+    try:
+        while True:
+            # Claim jobs until every process is busy or the spool is empty.
+            spoolEmpty = False
+            while ((maxJobs is None) or (nJobsClaimed < maxJobs)) and (len(runningJobs) < ncores):
+                runningJobFile = jobSpool.claimJob()
+                if runningJobFile is None:
+                    spoolEmpty = True
+                    break
+                nJobsClaimed = nJobsClaimed + 1
+                if plObj is not None:
+                    runningJobs[runningJobFile] = time.time()
+                    asyncArgs = dict()
+                    asyncArgs['callback'] = lambda jobReport, jobFile=runningJobFile: finishedJobsQueue.put((jobFile, jobReport))
+                    if sys.version_info[0] >= 3:
+                        asyncArgs['error_callback'] = lambda err, jobFile=runningJobFile, jobStart=runningJobs[runningJobFile]: finishedJobsQueue.put((jobFile, getFailedJobReport(jobFile, "{}".format(err), jobStart)))
+                    plObj.apply_async(runARCSIJob, (runningJobFile,), **asyncArgs)
+                else:
+                    finishedJobsQueue.put((runningJobFile, runARCSIJob(runningJobFile)))
+
+            if (len(runningJobs) > 0) and finishedJobsQueue.empty():
+                # Wait for a job to finish, checking the spool for new jobs at least every pollInterval.
+                try:
+                    finishedJobsQueue.put(finishedJobsQueue.get(timeout=pollInterval))
+                except queue.Empty:
+                    pass
+
+            # Check the pool jobs which haven't returned are alive and within the time limit.
+            for runningJobFile, jobStart in list(runningJobs.items()):
+                jobPID = ARCSIJobSpool.getJobPID(runningJobFile)
+                if (jobPID is not None) and (not isProcessAlive(jobPID)):
+                    jobsAbandoned = True
+                    finishedJobsQueue.put((runningJobFile, getFailedJobReport(runningJobFile, "The process ({0}) running the job exited.".format(jobPID), jobStart, jobPID)))
+                elif (jobTimeout is not None) and ((time.time() - jobStart) > jobTimeout):
+                    jobsAbandoned = True
+                    if jobPID is not None:
+                        try:
+                            os.kill(jobPID, signal.SIGTERM)
+                        except OSError:
+                            pass
+                    finishedJobsQueue.put((runningJobFile, getFailedJobReport(runningJobFile, "The job timed out after {0} seconds.".format(jobTimeout), jobStart, jobPID)))
+
+            while not finishedJobsQueue.empty():
+                runningJobFile, jobReport = finishedJobsQueue.get()
+                if plObj is not None:
+                    if runningJobFile not in runningJobs:
+                        # The job has already been reported (e.g., timed out).
+                        continue
+                    del runningJobs[runningJobFile]
+                jobSpool.finishJob(runningJobFile, jobReport)
+                jobReports.append(jobReport)
+
+            if len(runningJobs) == 0:
+                if (maxJobs is not None) and (nJobsClaimed >= maxJobs):
+                    break
+                if spoolEmpty:
+                    if exitWhenEmpty:
+                        break
+                    time.sleep(pollInterval)
+    finally:
+        if plObj is not None:
+            if (len(runningJobs) > 0) or jobsAbandoned:
+                plObj.terminate()
+            else:
+                plObj.close()
+            plObj.join()
+
+    nDone = 0
+    totalTime = 0.0
+    for jobReport in jobReports:
+        if jobReport['status'] == 'done':
+            nDone = nDone + 1
+        totalTime = totalTime + jobReport['time']
+    print("Worker processed {0} jobs ({1} done, {2} failed) in a total job time of {3:.2f} seconds.".format(len(jobReports), nDone, len(jobReports)-nDone, totalTime))
+    return jobReports
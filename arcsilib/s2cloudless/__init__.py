@@ -7,11 +7,16 @@ This module lists all externally useful classes and functions
 #from .RunS2Cloudless import run_s2cloudless
 
 import os
+import time
+
+import numpy
+import scipy.ndimage
+
+import osgeo.gdal as gdal
 
 import rsgislib
 import rsgislib.imagecalc
 import rsgislib.imageutils
-import rsgislib.classification.classlightgbm
 import rsgislib.imagemorphology
 import rsgislib.segmentation
 import rsgislib.rastergis
@@ -20,6 +25,14 @@ import rsgislib.rastergis
 import fmask.config
 import fmask.fmask
 
+from rios import applier
+from rios import cuiprogress
+from rios import rat
+
+import lightgbm
+
+from arcsilib.arcsiutils import ARCSIUtils
+
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -146,9 +159,56 @@ def run_pyfmask_shadow_masking(sen2_toa_img, sen2_sat_img, sen2_view_angles_img,
     rsgislib.imagecalc.bandMath(out_cloud_cldshad_msk_img, 'cld==1?1:shd==1?2:0', 'KEA', rsgislib.TYPE_8UINT, bandDefns)
 
 
+def calc_cloud_scores(classifier, s2_blk, vmsk_blk, img_bands, toa_scale_factor=1.0, num_threads=1):
+    """
+    Calculate the cloud scores (probability * 10000) for the pixels of an image block within the valid mask.
+
+    :param classifier: the lightgbm.Booster cloud classifier.
+    :param s2_blk: the image block (bands, rows, cols).
+    :param vmsk_blk: the valid mask block (1, rows, cols); 1 is valid.
+    :param img_bands: list of the image bands (starting at 1) used by the classifier.
+    :param toa_scale_factor: the scale factor the image values are divided by before classification.
+    :param num_threads: the number of threads for the lightgbm prediction.
+    :return: numpy array (rows, cols) of uint16 scores.
+
+    """
+    out_score_vals = numpy.zeros_like(vmsk_blk[0], dtype=numpy.uint16)
+    if numpy.any(vmsk_blk == 1):
+        out_score_vals = out_score_vals.flatten()
+        vmsk_vals = vmsk_blk.flatten()
+        ID = numpy.arange(vmsk_vals.shape[0])[vmsk_vals == 1]
+        cls_vars = numpy.zeros((ID.shape[0], len(img_bands)), dtype=numpy.float64)
+        for i, band in enumerate(img_bands):
+            cls_vars[..., i] = s2_blk[band - 1].flatten()[ID] / toa_scale_factor
+        pred_vals = classifier.predict(cls_vars, num_threads=max(1, num_threads))
+        out_score_vals[ID] = numpy.around(pred_vals * 10000)
+        out_score_vals = out_score_vals.reshape((vmsk_blk.shape[1], vmsk_blk.shape[2]))
+    return out_score_vals
+
+
+def create_circular_footprint(op_size):
+    """
+    Create a circular (boolean) footprint for a morphological operator, the equivalent
+    of the operator created by rsgislib.imagemorphology.createCircularOp.
+
+    :param op_size: the size (pixels) of the operator.
+    :return: numpy array (op_size, op_size).
+
+    """
+    radius = (op_size - 1) / 2.0
+    y, x = numpy.ogrid[:op_size, :op_size]
+    return ((x - radius) ** 2 + (y - radius) ** 2) <= (radius ** 2)
+
+
 def run_s2cloudless(s2img, out_cloud_msk, s2_vmsk_img, gdalformat, tmp_dir, toa_scale_factor=10000.0, min_obj_size=10,
-                    morph_close_size=5, morph_dilate_size=9):
+                    morph_close_size=5, morph_dilate_size=9, num_threads=1, max_mem_mb=None):
     """
+    Run the s2cloudless cloud classifier and post-processing. The steps are composed into
+    block-wise passes over the image (with an overlap for the morphological operators):
+
+    1. scale the input, apply the classifier, threshold the scores and apply the morphological closing.
+    2. clump the cloud features and find their size (whole image).
+    3. remove the small clumps and apply the morphological dilation.
 
     :param s2img:
     :param out_cloud_msk:
@@ -159,44 +219,104 @@ def run_s2cloudless(s2img, out_cloud_msk, s2_vmsk_img, gdalformat, tmp_dir, toa_
     :param min_obj_size:
     :param morph_close_size:
     :param morph_dilate_size:
+    :param num_threads: the number of threads used to apply the classifier.
+    :param max_mem_mb: the memory budget (MB) used to size the image blocks for the classifier.
+    :return: dict with the time (seconds) for each stage and the bytes of the temporary files.
 
     """
     basename = os.path.splitext(os.path.basename(s2img))[0]
-    s2_tmp_img = os.path.join(tmp_dir, '{}_s2img_flt.kea'.format(basename))
-    rsgislib.imagecalc.imageMath(s2img, s2_tmp_img, 'b1/{}'.format(toa_scale_factor), 'KEA', rsgislib.TYPE_32FLOAT)
-
-    imgs_info = [
-        rsgislib.imageutils.ImageBandInfo(fileName=s2_tmp_img, name='sen2', bands=[1, 2, 4, 5, 8, 9, 10, 11, 12, 13])]
-
-    out_score_img = os.path.join(tmp_dir, '{}_s2cls_tmp_score.kea'.format(basename))
-    out_cls_img = os.path.join(tmp_dir, '{}_s2cls_tmp_cls.kea'.format(basename))
-    rsgislib.classification.classlightgbm.apply_lightgbm_binary_classifier(DEFAULT_ARCSI_S2CLOUDLESS_MODEL, s2_vmsk_img,
-                                                                           1, imgs_info, out_score_img, 'KEA',
-                                                                           out_cls_img, class_thres=5000)
+    img_bands = [1, 2, 4, 5, 8, 9, 10, 11, 12, 13]
+    stage_times = dict()
+    tmp_files = []
 
-    morph_close_opt = os.path.join(tmp_dir, 'morph_circ_close')
-    morph_close_opt_file = '{}.gmtxt'.format(morph_close_opt)
-    rsgislib.imagemorphology.createCircularOp(morph_close_opt, morph_close_size)
+    # Input bands (uint16), classifier variables (float64), prediction, mask and morphology.
+    block_size = ARCSIUtils().getBlockSize(max_mem_mb, (2 * 13) + (8 * len(img_bands)) + 8 + 6, 256)
 
+    # Pass 1: classify and close the cloud features.
+    start_time = time.time()
     out_cls_morph_img = os.path.join(tmp_dir, '{}_s2cls_tmp_cls_morph.kea'.format(basename))
-    out_cls_morph_tmp_img = os.path.join(tmp_dir, '{}_s2cls_tmp_cls_morph_tmp.kea'.format(basename))
-    rsgislib.imagemorphology.imageClosing(out_cls_img, out_cls_morph_img, out_cls_morph_tmp_img,
-                                          morph_close_opt_file, True, morph_close_size, 'KEA', rsgislib.TYPE_8UINT)
-
+    tmp_files.append(out_cls_morph_img)
+
+    def _classify_close_clouds(info, inputs, outputs, otherargs):
+        score_vals = calc_cloud_scores(otherargs.classifier, inputs.s2img, inputs.vmsk, otherargs.img_bands,
+                                       otherargs.toa_scale_factor, otherargs.num_threads)
+        cls_vals = score_vals > otherargs.class_thres
+        # The closing is applied as a dilation followed by an erosion. Outside the image
+        # is treated as cloud by the erosion so features at the image edge are not removed.
+        cls_vals = scipy.ndimage.binary_dilation(cls_vals, structure=otherargs.footprint)
+        cls_vals = scipy.ndimage.binary_erosion(cls_vals, structure=otherargs.footprint, border_value=1)
+        outputs.out_cls = numpy.expand_dims(cls_vals.astype(numpy.uint8), axis=0)
+
+    infiles = applier.FilenameAssociations()
+    infiles.vmsk = s2_vmsk_img
+    infiles.s2img = s2img
+    outfiles = applier.FilenameAssociations()
+    outfiles.out_cls = out_cls_morph_img
+    otherargs = applier.OtherInputs()
+    otherargs.classifier = lightgbm.Booster(model_file=DEFAULT_ARCSI_S2CLOUDLESS_MODEL)
+    otherargs.img_bands = img_bands
+    otherargs.toa_scale_factor = float(toa_scale_factor)
+    otherargs.num_threads = num_threads
+    otherargs.class_thres = 5000
+    otherargs.footprint = create_circular_footprint(morph_close_size)
+    aControls = applier.ApplierControls()
+    aControls.progress = cuiprogress.CUIProgressBar()
+    aControls.drivername = 'KEA'
+    aControls.omitPyramids = True
+    aControls.calcStats = False
+    aControls.setWindowXsize(block_size)
+    aControls.setWindowYsize(block_size)
+    # The dilation and erosion each need the radius of the operator.
+    aControls.setOverlap(morph_close_size)
+    applier.apply(_classify_close_clouds, infiles, outfiles, otherargs, controls=aControls)
+    stage_times['classify_close'] = time.time() - start_time
+
+    # Pass 2: clump the cloud features and find their size (whole image).
+    start_time = time.time()
     out_cls_img_clumps = os.path.join(tmp_dir, '{}_s2cls_tmp_cls_clumps.kea'.format(basename))
-    out_cls_img_clumps_rmsml = os.path.join(tmp_dir, '{}_s2cls_tmp_cls_clumps_rmsml.kea'.format(basename))
+    tmp_files.append(out_cls_img_clumps)
     rsgislib.segmentation.clump(out_cls_morph_img, out_cls_img_clumps, 'KEA', False, 0, False)
-    rsgislib.rastergis.populateStats(clumps=out_cls_img_clumps, addclrtab=True, calcpyramids=False, ignorezero=True)
-    rsgislib.segmentation.rmSmallClumps(out_cls_img_clumps, out_cls_img_clumps_rmsml, min_obj_size, 'KEA')
-
-    out_cloud_cls_img = os.path.join(tmp_dir, '{}_s2cls_tmp_cls_clumps.kea'.format(basename))
-    rsgislib.imagecalc.imageMath(out_cls_img_clumps_rmsml, out_cloud_cls_img, 'b1>0?1:0', gdalformat,
-                                 rsgislib.TYPE_8UINT)
-
-    morph_dilate_opt = os.path.join(tmp_dir, 'morph_circ_dilate')
-    morph_dilate_opt_file = '{}.gmtxt'.format(morph_dilate_opt)
-    rsgislib.imagemorphology.createCircularOp(morph_dilate_opt, morph_dilate_size)
-    rsgislib.imagemorphology.imageDilate(out_cloud_cls_img, out_cloud_msk, morph_dilate_opt_file,
-                                         True, morph_dilate_size, 'KEA', rsgislib.TYPE_8UINT)
-
-
+    rsgislib.rastergis.populateStats(clumps=out_cls_img_clumps, addclrtab=False, calcpyramids=False,
+                                     ignorezero=True)
+    clumps_ds = gdal.Open(out_cls_img_clumps, gdal.GA_ReadOnly)
+    clump_sizes = rat.readColumn(clumps_ds, 'Histogram')
+    clumps_ds = None
+    keep_clumps = (clump_sizes >= min_obj_size)
+    keep_clumps[0] = False
+    stage_times['clump'] = time.time() - start_time
+
+    # Pass 3: remove the small cloud features and dilate.
+    start_time = time.time()
+
+    def _rm_small_dilate_clouds(info, inputs, outputs, otherargs):
+        cls_vals = otherargs.keep_clumps[inputs.clumps[0]]
+        cls_vals = scipy.ndimage.binary_dilation(cls_vals, structure=otherargs.footprint)
+        outputs.out_msk = numpy.expand_dims(cls_vals.astype(numpy.uint8), axis=0)
+
+    infiles = applier.FilenameAssociations()
+    infiles.clumps = out_cls_img_clumps
+    outfiles = applier.FilenameAssociations()
+    outfiles.out_msk = out_cloud_msk
+    otherargs = applier.OtherInputs()
+    otherargs.keep_clumps = keep_clumps
+    otherargs.footprint = create_circular_footprint(morph_dilate_size)
+    aControls = applier.ApplierControls()
+    aControls.progress = cuiprogress.CUIProgressBar()
+    aControls.drivername = 'KEA'
+    aControls.omitPyramids = True
+    aControls.calcStats = False
+    aControls.setWindowXsize(block_size)
+    aControls.setWindowYsize(block_size)
+    aControls.setOverlap(int(morph_dilate_size / 2) + 1)
+    applier.apply(_rm_small_dilate_clouds, infiles, outfiles, otherargs, controls=aControls)
+    stage_times['rm_small_dilate'] = time.time() - start_time
+
+    tmp_bytes = 0
+    for tmp_file in tmp_files:
+        if os.path.exists(tmp_file):
+            tmp_bytes += os.path.getsize(tmp_file)
+
+    print("s2cloudless: temporary files {0:.1f} MB".format(tmp_bytes / (1024 * 1024)))
+    for stage in ['classify_close', 'clump', 'rm_small_dilate']:
+        print("s2cloudless: {0} {1:.1f} seconds".format(stage, stage_times[stage]))
+    return {'stage_times': stage_times, 'tmp_bytes': tmp_bytes}
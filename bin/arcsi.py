@@ -167,6 +167,10 @@ don't currently support the sensor you require.''')
                         an LUT and applying 6S coefficients with respect to elevation.''')
     parser.add_argument("--demnodata", type=float,
                         help='''Specify a no data value for the input DEM image file.''')
+    parser.add_argument("--demcache", type=str,
+                        help='''Specify a directory where the DEM subset reprojected onto each image
+                        grid is cached so it can be reused by other scenes on the same footprint
+                        (e.g., a time-series of a Sentinel-2 tile).''')
     # Define the argument for specifying the output image base file name if it is
     # not to be automatically generated.
     parser.add_argument("--outbasename", type=str,
@@ -354,9 +358,38 @@ don't currently support the sensor you require.''')
     parser.add_argument("--ncores", type=int, default=1,
                         help='''Number of cores available for processing when using the --multi option.
                                 If a value of -1 is provided then all available cores will be used.''')
+    # Define the argument for the number of threads used to process a scene.
+    parser.add_argument("--nthreads", type=int, default=None,
+                        help='''The number of threads available for processing each scene (e.g., resampling
+                                image bands). (Default: 1 or the ARCSI_NUM_THREADS environment variable)''')
+    # Define the argument for the memory budget used to process a scene.
+    parser.add_argument("--maxmem", type=float, default=None,
+                        help='''The memory (MB) available for processing each scene, used to size the image
+                                blocks processed, the GDAL cache and warp memory and the number of concurrent workers.
+                                ARCSI will exit if the scene cannot be processed within the memory available.
+                                (Default: no limit or the ARCSI_MAX_MEMORY environment variable)''')
+    # Define the argument for the pre-screen cloud cover threshold.
+    parser.add_argument("--prescreencloud", type=float, default=None,
+                        help='''The maximum proportion (0-1) of cloud cover reported within the scene metadata
+                                (Landsat and Sentinel-2) for the scene to be processed. Scenes above the threshold
+                                are skipped before processing and only the meta-data file, with the reason the scene
+                                was skipped, is produced. (Default: no pre-screen or the ARCSI_PRESCREEN_MAX_CLOUD
+                                environment variable)''')
+    # Define the argument for a decimated preview of the processing.
+    parser.add_argument("--preview", type=int, choices=[4, 8], default=None,
+                        help='''Process a decimated preview of the scene (1/4 or 1/8 resolution) using the same
+                                processing chain and 6S parameterisation as the full resolution processing. The outputs
+                                are marked with a '_preview<factor>' suffix to the output base name.
+                                (Default: no preview or the ARCSI_PREVIEW environment variable)''')
     # Provide a list of file ends which are to be kept, all others will be deleted from the output directory.
     parser.add_argument("-k", "--keepfileends", type=str, nargs='+', default=None,
                         help='''Provide a list of file endings which are to be kept following the completion of the processing.''')
+    # Define the argument to plan (dry run) the processing.
+    parser.add_argument("--plan", action='store_true', default=False,
+                        help='''Plan the processing, estimating the number of 6S runs, the disk space and the run time
+                        for the scene (or the list of scenes if --multi is specified) without processing the image data.''')
+    parser.add_argument("--planout", type=str, default=None,
+                        help='''Output JSON file for the per scene and aggregate estimates when using --plan.''')
 
     # Call the parser to parse the arguments.
     args = parser.parse_args()
@@ -513,6 +546,38 @@ don't currently support the sensor you require.''')
                 args.dem = envVar
                 print("Taking DEM path from environment variable.")
 
+        if args.demcache == None:
+            envVar = arcsiUtils.getEnvironmentVariable("ARCSI_DEM_CACHE")
+            if not envVar == None:
+                args.demcache = envVar
+                print("Taking DEM cache path from environment variable.")
+
+        if args.nthreads == None:
+            envVar = arcsiUtils.getEnvironmentVariable("ARCSI_NUM_THREADS")
+            if not envVar == None:
+                args.nthreads = int(envVar)
+                print("Taking number of threads from environment variable.")
+            else:
+                args.nthreads = 1
+
+        if args.maxmem == None:
+            envVar = arcsiUtils.getEnvironmentVariable("ARCSI_MAX_MEMORY")
+            if not envVar == None:
+                args.maxmem = float(envVar)
+                print("Taking memory budget from environment variable.")
+
+        if args.prescreencloud == None:
+            envVar = arcsiUtils.getEnvironmentVariable("ARCSI_PRESCREEN_MAX_CLOUD")
+            if not envVar == None:
+                args.prescreencloud = float(envVar)
+                print("Taking pre-screen cloud cover threshold from environment variable.")
+
+        if args.preview == None:
+            envVar = arcsiUtils.getEnvironmentVariable("ARCSI_PREVIEW")
+            if not envVar == None:
+                args.preview = int(envVar)
+                print("Taking preview factor from environment variable.")
+
         if needDEM:
             if (args.dem == None) or (not os.path.exists(args.dem)):
                 print("Error: A file path to a DEM has either not been specified or does exist, please check it and run again.\n")
@@ -602,12 +667,21 @@ don't currently support the sensor you require.''')
         if not envVar == None:
             args.scalefac = int(envVar)
 
+        if args.plan:
+            if args.multi:
+                rsgisUtils = rsgislib.RSGISPyUtils()
+                inputHeadersLst = rsgisUtils.readTextFile2List(args.inputheader)
+            else:
+                inputHeadersLst = [args.inputheader]
+            arcsilib.arcsirun.runARCSIPlan(inputHeadersLst, args.sensor, args.inwkt, args.format, args.outpath, args.outbasename, args.outwkt, args.outproj4, args.projabbv, args.ximgres, args.yimgres, args.prods, args.stats, args.aeropro, args.atmospro, args.aeroimg, args.atmosimg, args.grdrefl, args.surfacealtitude, args.atmosozone, args.atmoswater, atmosOZoneWaterSpecified, args.aerowater, args.aerodust, args.aerooceanic, args.aerosoot, aeroComponentsSpecified, args.aot, args.vis, args.tmpath, args.minaot, args.maxaot, args.lowaot, args.upaot, args.dem, args.demnodata, args.aotfile, (not args.localdos), args.dosout, args.simpledos, args.debug, args.scalefac, args.interp, args.interpresamp, args.cs_initdist, args.cs_initminsize, args.cs_finaldist, args.cs_morphop, args.fullimgouts, args.checkouts, args.classmlclouds, args.cloudtrainclouds, args.cloudtrainother, args.resample2lowres, args.keepfileends, args.cloudmethods, args.demcache, args.nthreads, args.maxmem, args.preview, args.planout)
+            sys.exit()
+
         runTimer = rsgislib.RSGISTime()
         runTimer.start(True)
         if args.multi:
-            arcsilib.arcsirun.runARCSIMulti(args.inputheader, args.sensor, args.inwkt, args.format, args.outpath, args.outbasename, args.outwkt, args.outproj4, args.projabbv, args.ximgres, args.yimgres, args.prods, args.stats, args.aeropro, args.atmospro, args.aeroimg, args.atmosimg, args.grdrefl, args.surfacealtitude, args.atmosozone, args.atmoswater, atmosOZoneWaterSpecified, args.aerowater, args.aerodust, args.aerooceanic, args.aerosoot, aeroComponentsSpecified, args.aot, args.vis, args.tmpath, args.minaot, args.maxaot, args.lowaot, args.upaot, args.dem, args.demnodata, args.aotfile, (not args.localdos), args.dosout, args.simpledos, args.debug, args.scalefac, args.interp, args.interpresamp, args.cs_initdist, args.cs_initminsize, args.cs_finaldist, args.cs_morphop, args.fullimgouts, args.checkouts, args.classmlclouds, args.cloudtrainclouds, args.cloudtrainother, args.resample2lowres, args.ncores, args.keepfileends, args.cloudmethods)
+            arcsilib.arcsirun.runARCSIMulti(args.inputheader, args.sensor, args.inwkt, args.format, args.outpath, args.outbasename, args.outwkt, args.outproj4, args.projabbv, args.ximgres, args.yimgres, args.prods, args.stats, args.aeropro, args.atmospro, args.aeroimg, args.atmosimg, args.grdrefl, args.surfacealtitude, args.atmosozone, args.atmoswater, atmosOZoneWaterSpecified, args.aerowater, args.aerodust, args.aerooceanic, args.aerosoot, aeroComponentsSpecified, args.aot, args.vis, args.tmpath, args.minaot, args.maxaot, args.lowaot, args.upaot, args.dem, args.demnodata, args.aotfile, (not args.localdos), args.dosout, args.simpledos, args.debug, args.scalefac, args.interp, args.interpresamp, args.cs_initdist, args.cs_initminsize, args.cs_finaldist, args.cs_morphop, args.fullimgouts, args.checkouts, args.classmlclouds, args.cloudtrainclouds, args.cloudtrainother, args.resample2lowres, args.ncores, args.keepfileends, args.cloudmethods, args.demcache, args.nthreads, args.maxmem, args.preview, args.prescreencloud)
         else:
-            arcsilib.arcsirun.runARCSI(args.inputheader, args.imagefile, args.cloudmask, args.sensor, args.inwkt, args.format, args.outpath, args.outbasename, args.outwkt, args.outproj4, args.projabbv, args.ximgres, args.yimgres, args.prods, args.stats, args.aeropro, args.atmospro, args.aeroimg, args.atmosimg, args.grdrefl, args.surfacealtitude, args.atmosozone, args.atmoswater, atmosOZoneWaterSpecified, args.aerowater, args.aerodust, args.aerooceanic, args.aerosoot, aeroComponentsSpecified, args.aot, args.vis, args.tmpath, args.minaot, args.maxaot, args.lowaot, args.upaot, args.dem, args.demnodata, args.aotfile, (not args.localdos), args.dosout, args.simpledos, args.debug, args.scalefac, args.interp, args.interpresamp, args.cs_initdist, args.cs_initminsize, args.cs_finaldist, args.cs_morphop, args.fullimgouts, args.checkouts, args.classmlclouds, args.cloudtrainclouds, args.cloudtrainother, args.resample2lowres, args.keepfileends, args.cloudmethods)
+            arcsilib.arcsirun.runARCSI(args.inputheader, args.imagefile, args.cloudmask, args.sensor, args.inwkt, args.format, args.outpath, args.outbasename, args.outwkt, args.outproj4, args.projabbv, args.ximgres, args.yimgres, args.prods, args.stats, args.aeropro, args.atmospro, args.aeroimg, args.atmosimg, args.grdrefl, args.surfacealtitude, args.atmosozone, args.atmoswater, atmosOZoneWaterSpecified, args.aerowater, args.aerodust, args.aerooceanic, args.aerosoot, aeroComponentsSpecified, args.aot, args.vis, args.tmpath, args.minaot, args.maxaot, args.lowaot, args.upaot, args.dem, args.demnodata, args.aotfile, (not args.localdos), args.dosout, args.simpledos, args.debug, args.scalefac, args.interp, args.interpresamp, args.cs_initdist, args.cs_initminsize, args.cs_finaldist, args.cs_morphop, args.fullimgouts, args.checkouts, args.classmlclouds, args.cloudtrainclouds, args.cloudtrainother, args.resample2lowres, args.keepfileends, args.cloudmethods, args.demcache, args.nthreads, args.maxmem, args.preview, args.prescreencloud)
 
         runTimer.end(True, "ARCSI took ", " to process the input image. Thank you for using ARCSI.")
         print("\n\n")
@@ -0,0 +1,203 @@
+#! /usr/bin/env python
+
+"""
+Module that contains the ARSCI command to benchmark the accuracy of the
+surface reflectance against the number of 6S runs used to build the LUT.
+"""
+
+############################################################################
+#  arcsibenchmarklut.py
+#
+#  Copyright 2017 ARCSI.
+#
+#  ARCSI: 'Atmospheric and Radiometric Correction of Satellite Imagery'
+#
+#  ARCSI is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  ARCSI is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with ARCSI.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Purpose:  A script to benchmark the accuracy of the surface reflectance
+#           against the number of 6S runs for LUTs of increasing node
+#           spacing, using the nearest node and bilinear interpolation.
+#           This is a utility to choose ARCSI_LUT_ELEV_STEP,
+#           ARCSI_LUT_AOT_STEP and ARCSI_LUT_INTERP for a sensor and is
+#           not part of the processing chain.
+#
+# Author: Pete Bunting
+# Email: pfb@aber.ac.uk
+# Date: 18/10/2026
+# Version: 1.0
+#
+# History:
+# Version 1.0 - Created.
+#
+############################################################################
+
+# Import updated print function into python 2.7
+from __future__ import print_function
+# Import updated division operator into python 2.7
+from __future__ import division
+# Import the python Argument parser
+import argparse
+# Import the JSON module
+import json
+# Import the Py6S module
+import Py6S
+# Import the ARCSI exception class
+from arcsilib.arcsiexception import ARCSIException
+# Import the ARCSI sensor factory class
+from arcsilib.arcsiutils import ARCSISensorFactory
+# Import the ARCSI utilities class
+from arcsilib.arcsiutils import ARCSIUtils
+# Import the arcsi version number
+from arcsilib import ARCSI_VERSION
+# Import the list of sensors arcsi supports
+from arcsilib import ARCSI_SENSORS_LIST
+
+def benchmark6SCoeffLUTInterp(sensorClass, aeroProfile, atmosProfile, grdRefl, useBRDF, surfaceAltitudeMin, surfaceAltitudeMax, aotVal=None, aotMin=None, aotMax=None, refElevStep=25, refAOTStep=0.0125, nodeSteps=(1, 2, 4, 8, 16)):
+    """
+    A function which benchmarks the accuracy of the surface reflectance against the number
+    of 6S runs for LUTs of increasing node spacing, using the nearest node and bilinear
+    interpolation. A dense reference LUT (refElevStep, refAOTStep) is built and the LUTs
+    using every n-th node (nodeSteps) of the reference are compared to it at each of
+    the reference nodes (see ARCSI6SCoeffLUT.calcSREFError). If aotMin and aotMax are
+    None then an elevation LUT is used (with aotVal).
+
+    :return: list of dicts (elevStep, aotStep, num6SRuns, nearestMeanErr, nearestMaxErr,
+             linearMeanErr, linearMaxErr), with the errors in reflectance (0-1).
+    """
+    aotLUT = (aotMin is not None) and (aotMax is not None)
+    print("Building the reference LUT for the benchmark...")
+    if aotLUT:
+        refLUT = sensorClass.buildElevationAOT6SCoeffLUT(aeroProfile, atmosProfile, grdRefl, useBRDF, surfaceAltitudeMin, surfaceAltitudeMax, aotMin, aotMax, refElevStep, refAOTStep)
+    else:
+        refLUT = sensorClass.buildElevation6SCoeffLUT(aeroProfile, atmosProfile, grdRefl, aotVal, useBRDF, surfaceAltitudeMin, surfaceAltitudeMax, refElevStep)
+
+    benchmarkResults = list()
+    print("Elev. Step, AOT Step, 6S Runs, Nearest (Mean, Max Error), Linear (Mean, Max Error)")
+    for nodeStep in nodeSteps:
+        lut = refLUT.getNodesSubset(nodeStep, nodeStep)
+        nearestMeanErr, nearestMaxErr = lut.calcSREFError(refLUT, 'NEAREST')
+        linearMeanErr, linearMaxErr = lut.calcSREFError(refLUT, 'LINEAR')
+        result = dict()
+        result['elevStep'] = refElevStep * nodeStep
+        result['aotStep'] = None
+        if aotLUT:
+            result['aotStep'] = refAOTStep * nodeStep
+        result['num6SRuns'] = lut.coeffs.shape[0] * lut.coeffs.shape[1] * lut.getNumBands()
+        result['nearestMeanErr'] = nearestMeanErr
+        result['nearestMaxErr'] = nearestMaxErr
+        result['linearMeanErr'] = linearMeanErr
+        result['linearMaxErr'] = linearMaxErr
+        print("{0}, {1}, {2}, ({3:.6f}, {4:.6f}), ({5:.6f}, {6:.6f})".format(result['elevStep'], result['aotStep'], result['num6SRuns'], nearestMeanErr, nearestMaxErr, linearMeanErr, linearMaxErr))
+        benchmarkResults.append(result)
+    return benchmarkResults
+
+def runLUTBenchmark(sensorStr, inputHeader, inWKTFile, aeroProfileOption, atmosProfileOption, grdReflOption, minElev, maxElev, aotVal, minAOT, maxAOT, refElevStep, refAOTStep, nodeSteps, outputFile):
+    """
+    A function which creates the sensor class from the input header and the Py6S
+    profiles (as arcsi.py does) and runs benchmark6SCoeffLUTInterp, writing the
+    results to a JSON file if outputFile is not None.
+    """
+    if (aotVal is None) and ((minAOT is None) or (maxAOT is None)):
+        raise ARCSIException("Either an AOT value or the minimum and maximum AOT must be specified.")
+
+    wktStr = None
+    if inWKTFile is not None:
+        wktStr = ARCSIUtils().readTextFile(inWKTFile)
+
+    sensorClass = ARCSISensorFactory().getSensorClassFromName(sensorStr, False, None)
+    sensorClass.extractHeaderParameters(inputHeader, wktStr)
+
+    aeroProfile = Py6S.AeroProfile.PredefinedType(getattr(Py6S.AeroProfile, aeroProfileOption))
+    atmosProfile = Py6S.AtmosProfile.PredefinedType(getattr(Py6S.AtmosProfile, atmosProfileOption))
+    useBRDF = False
+    if grdReflOption == "BRDFHapke":
+        grdRefl = Py6S.GroundReflectance.HomogeneousHapke(0.101, -0.263, 0.589, 0.046)
+        useBRDF = True
+    else:
+        grdRefl = Py6S.GroundReflectance.HomogeneousLambertian(getattr(Py6S.GroundReflectance, grdReflOption))
+
+    if (minAOT is not None) and (maxAOT is not None):
+        benchmarkResults = benchmark6SCoeffLUTInterp(sensorClass, aeroProfile, atmosProfile, grdRefl, useBRDF, minElev, maxElev, aotMin=minAOT, aotMax=maxAOT, refElevStep=refElevStep, refAOTStep=refAOTStep, nodeSteps=nodeSteps)
+    else:
+        benchmarkResults = benchmark6SCoeffLUTInterp(sensorClass, aeroProfile, atmosProfile, grdRefl, useBRDF, minElev, maxElev, aotVal=aotVal, refElevStep=refElevStep, refAOTStep=refAOTStep, nodeSteps=nodeSteps)
+
+    if outputFile is not None:
+        with open(outputFile, 'w') as outfile:
+            json.dump(benchmarkResults, outfile, sort_keys=True,indent=4, separators=(',', ': '), ensure_ascii=False)
+
+if __name__ == '__main__':
+    """
+    The command line user interface to the ARCSI LUT benchmark.
+    """
+    parser = argparse.ArgumentParser(prog='arcsibenchmarklut.py',
+                                    description='''ARCSI command to benchmark the accuracy of the surface reflectance
+                                                   against the number of 6S runs used to build the LUT.''')
+    # Request the version number.
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s version ' + ARCSI_VERSION)
+
+    parser.add_argument("-s", "--sensor", choices=ARCSI_SENSORS_LIST, required=True,
+                        help='''Specify the sensor of the scene.''')
+
+    parser.add_argument("-i", "--inputheader", type=str, required=True,
+                        help='''Specify the input image header file, defining the scene geometry.''')
+
+    parser.add_argument("-k", "--inwkt", type=str,
+                        help='''Specify the WKT projection of the input image with projection defined with WKT.''')
+
+    parser.add_argument("--aeropro", type=str, required=True, choices=['NoAerosols', 'Continental',
+                        'Maritime', 'Urban', 'Desert', 'BiomassBurning', 'Stratospheric'],
+                        help='''Specify the 6S defined aersol profile to use.''')
+
+    parser.add_argument("--atmospro", type=str, required=True, choices=['NoGaseousAbsorption', 'Tropical',
+                        'MidlatitudeSummer', 'MidlatitudeWinter', 'SubarcticSummer', 'SubarcticWinter',
+                        'USStandard1962'],
+                        help='''Specify the 6S defined atmospheric profile to use.''')
+
+    parser.add_argument("--grdrefl", type=str, default="GreenVegetation", choices=['GreenVegetation',
+                        'ClearWater', 'Sand', 'LakeWater', 'BRDFHapke'],
+                        help='''Specify the ground reflectance used for the 6S model.''')
+
+    parser.add_argument("--minelev", type=float, required=True,
+                        help='''Specify the minimum elevation (metres) of the LUT.''')
+
+    parser.add_argument("--maxelev", type=float, required=True,
+                        help='''Specify the maximum elevation (metres) of the LUT.''')
+
+    parser.add_argument("--aot", type=float,
+                        help='''Specify the AOT value for an elevation LUT.''')
+
+    parser.add_argument("--minaot", type=float,
+                        help='''Specify the minimum AOT value for an elevation and AOT LUT.''')
+
+    parser.add_argument("--maxaot", type=float,
+                        help='''Specify the maximum AOT value for an elevation and AOT LUT.''')
+
+    parser.add_argument("--refelevstep", type=float, default=25,
+                        help='''Specify the elevation step (metres) of the reference LUT (Default: 25).''')
+
+    parser.add_argument("--refaotstep", type=float, default=0.0125,
+                        help='''Specify the AOT step of the reference LUT (Default: 0.0125).''')
+
+    parser.add_argument("--nodesteps", type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                        help='''Specify the node spacings, as multiples of the reference steps, to
+                                benchmark (Default: 1 2 4 8 16).''')
+
+    parser.add_argument("-o", "--output", type=str,
+                        help='''Specify an output JSON file for the benchmark results.''')
+
+    # Call the parser to parse the arguments.
+    args = parser.parse_args()
+
+    runLUTBenchmark(args.sensor, args.inputheader, args.inwkt, args.aeropro, args.atmospro, args.grdrefl, args.minelev, args.maxelev, args.aot, args.minaot, args.maxaot, args.refelevstep, args.refaotstep, args.nodesteps, args.output)
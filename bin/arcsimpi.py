@@ -56,6 +56,8 @@ import arcsilib.arcsirun
 from arcsilib.arcsiutils import ARCSIUtils
 # Import the ARCSI enum
 from arcsilib.arcsiutils import ARCSIEnum
+# Import the ARCSI profile lookup class
+from arcsilib.arcsiutils import ARCSIProfileLookup
 # Import the ARCSI exception class
 from arcsilib.arcsiexception import ARCSIException
 # Import the arcsi version number
@@ -153,6 +155,10 @@ if (__name__ == '__main__') and (mpiRank == 0):
                             an LUT and applying 6S coefficients with respect to elevation.''')
         parser.add_argument("--demnodata", type=float,
                             help='''Specify a no data value for the input DEM image file.''')
+        parser.add_argument("--demcache", type=str,
+                            help='''Specify a directory where the DEM subset reprojected onto each image
+                            grid is cached so it can be reused by other scenes on the same footprint
+                            (e.g., a time-series of a Sentinel-2 tile).''')
         # Define the argument for specifying the output image base file name if it is
         # not to be automatically generated.
         parser.add_argument("--outbasename", type=str,
@@ -332,6 +338,23 @@ if (__name__ == '__main__') and (mpiRank == 0):
                                     same resolution as the lower resolution images (Default: lower resolution are 
                                     resampled to the higher resolution). Example, using this switch will mean Sentinel-2
                                     imagery outputted at 20m rather than 10m resolution.''')
+        # Define the argument for the number of threads used to process a scene.
+        parser.add_argument("--nthreads", type=int, default=None,
+                            help='''The number of threads available for processing each scene (e.g., resampling
+                                    image bands). (Default: 1 or the ARCSI_NUM_THREADS environment variable)''')
+        # Define the argument for the memory budget used to process a scene.
+        parser.add_argument("--maxmem", type=float, default=None,
+                            help='''The memory (MB) available for processing each scene, used to size the image
+                                    blocks processed, the GDAL cache and warp memory and the number of concurrent workers.
+                                    ARCSI will exit if the scene cannot be processed within the memory available.
+                                    (Default: no limit or the ARCSI_MAX_MEMORY environment variable)''')
+        # Define the argument for the pre-screen cloud cover threshold.
+        parser.add_argument("--prescreencloud", type=float, default=None,
+                            help='''The maximum proportion (0-1) of cloud cover reported within the scene metadata
+                                    (Landsat and Sentinel-2) for the scene to be processed. Scenes above the threshold
+                                    are skipped before processing and only the meta-data file, with the reason the scene
+                                    was skipped, is produced. (Default: no pre-screen or the ARCSI_PRESCREEN_MAX_CLOUD
+                                    environment variable)''')
         # Provide a list of file ends which are to be kept, all others will be deleted from the output directory.
         parser.add_argument("-k", "--keepfileends", type=str, nargs='+', default=None,
                             help='''Provide a list of file endings which are to be kept following the completion of the processing.''')
@@ -477,6 +500,32 @@ if (__name__ == '__main__') and (mpiRank == 0):
                     args.dem = envVar
                     print("Taking DEM path from environment variable.")
 
+            if args.demcache == None:
+                envVar = arcsiUtils.getEnvironmentVariable("ARCSI_DEM_CACHE")
+                if not envVar == None:
+                    args.demcache = envVar
+                    print("Taking DEM cache path from environment variable.")
+
+            if args.nthreads == None:
+                envVar = arcsiUtils.getEnvironmentVariable("ARCSI_NUM_THREADS")
+                if not envVar == None:
+                    args.nthreads = int(envVar)
+                    print("Taking number of threads from environment variable.")
+                else:
+                    args.nthreads = 1
+
+            if args.maxmem == None:
+                envVar = arcsiUtils.getEnvironmentVariable("ARCSI_MAX_MEMORY")
+                if not envVar == None:
+                    args.maxmem = float(envVar)
+                    print("Taking memory budget from environment variable.")
+
+            if args.prescreencloud == None:
+                envVar = arcsiUtils.getEnvironmentVariable("ARCSI_PRESCREEN_MAX_CLOUD")
+                if not envVar == None:
+                    args.prescreencloud = float(envVar)
+                    print("Taking pre-screen cloud cover threshold from environment variable.")
+
             if needDEM:
                 if (args.dem == None) or (not os.path.exists(args.dem)):
                     print("Error: A file path to a DEM has either not been specified or does exist, please check it and run again.\n")
@@ -581,7 +630,7 @@ if (__name__ == '__main__') and (mpiRank == 0):
                 first = True
                 for inputHeader in inputHeadersLst:
                     paramsObj = None
-                    paramsObj = arcsilib.arcsirun.prepParametersObj(inputHeader, None, None, args.sensor, args.inwkt, args.format, args.outpath, args.outbasename, args.outwkt, args.outproj4, args.projabbv, args.ximgres, args.yimgres, args.prods, args.stats, args.aeropro, args.atmospro, args.aeroimg, args.atmosimg, args.grdrefl, args.surfacealtitude, args.atmosozone, args.atmoswater, atmosOZoneWaterSpecified, args.aerowater, args.aerodust, args.aerooceanic, args.aerosoot, aeroComponentsSpecified, args.aot, args.vis, args.tmpath, args.minaot, args.maxaot, args.lowaot, args.upaot, args.dem, args.demnodata, args.aotfile, (not args.localdos), args.dosout, args.simpledos, args.debug, args.scalefac, args.interp, args.interpresamp, args.cs_initdist, args.cs_initminsize, args.cs_finaldist, args.cs_morphop, args.fullimgouts, args.checkouts, args.classmlclouds, args.cloudtrainclouds, args.cloudtrainother, args.resample2lowres, args.keepfileends)
+                    paramsObj = arcsilib.arcsirun.prepParametersObj(inputHeader, None, None, args.sensor, args.inwkt, args.format, args.outpath, args.outbasename, args.outwkt, args.outproj4, args.projabbv, args.ximgres, args.yimgres, args.prods, args.stats, args.aeropro, args.atmospro, args.aeroimg, args.atmosimg, args.grdrefl, args.surfacealtitude, args.atmosozone, args.atmoswater, atmosOZoneWaterSpecified, args.aerowater, args.aerodust, args.aerooceanic, args.aerosoot, aeroComponentsSpecified, args.aot, args.vis, args.tmpath, args.minaot, args.maxaot, args.lowaot, args.upaot, args.dem, args.demnodata, args.aotfile, (not args.localdos), args.dosout, args.simpledos, args.debug, args.scalefac, args.interp, args.interpresamp, args.cs_initdist, args.cs_initminsize, args.cs_finaldist, args.cs_morphop, args.fullimgouts, args.checkouts, args.classmlclouds, args.cloudtrainclouds, args.cloudtrainother, args.resample2lowres, args.keepfileends, None, args.demcache, args.nthreads, args.maxmem, preScreenMaxCloud=args.prescreencloud)
                     paramsLst.append(paramsObj)
                     if first:
                         if paramsObj.prodsToCalc["DDVAOT"] or paramsObj.prodsToCalc["DOSAOT"] or paramsObj.prodsToCalc["DOSAOTSGL"]:
@@ -593,6 +642,7 @@ if (__name__ == '__main__') and (mpiRank == 0):
                         if paramsObj.prodsToCalc["METADATA"]:
                             exportMetaData = True
                         first = False
+                ARCSIProfileLookup.flushCacheFile()
                 ##############################
 
 
@@ -618,6 +668,10 @@ if (__name__ == '__main__') and (mpiRank == 0):
                     elif tag == tags.EXIT:
                         raise ARCSIException("MPI worker was closed - worker was still needed so there is a bug here somewhere... Please report to mailing list.")
                 paramsLst = paramsLstTmp
+                for paramsObj in paramsLst:
+                    # A skipped scene always exports the meta-data file with the skip reason.
+                    if paramsObj.sceneSkipped:
+                        exportMetaData = True
                 ##############################
 
                 
@@ -0,0 +1,117 @@
+#! /usr/bin/env python
+
+"""
+Module that contains the ARSCI command to run ARCSI as a worker processing
+scene jobs from a spool directory.
+"""
+
+############################################################################
+#  arcsiworker.py
+#
+#  Copyright 2013 ARCSI.
+#
+#  ARCSI: 'Atmospheric and Radiometric Correction of Satellite Imagery'
+#
+#  ARCSI is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  ARCSI is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with ARCSI.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# Purpose:  A script to run ARCSI as a long running worker which processes
+#           scene jobs (JSON files) from a spool directory, or to submit
+#           jobs to the spool directory.
+#
+# Author: ARCSI Contributors
+# Email: rsgislib-support@googlegroups.com
+# Date: 18/10/2026
+# Version: 1.0
+#
+# History:
+# Version 1.0 - Created.
+#
+############################################################################
+
+# Import updated print function into python 2.7
+from __future__ import print_function
+# Import updated division operator into python 2.7
+from __future__ import division
+# Import the python sys module
+import sys
+# Import the python Argument parser
+import argparse
+# Import the JSON module
+import json
+# Import the arcsi version number
+from arcsilib import ARCSI_VERSION
+# Import the ARCSI utilities class
+from arcsilib.arcsiutils import ARCSIUtils
+# Import the ARCSI worker module
+import arcsilib.arcsiworker
+
+
+if __name__ == '__main__':
+    """
+    The command line user interface to the ARCSI worker.
+    """
+    parser = argparse.ArgumentParser(prog='arcsiworker.py',
+                                    description='''ARCSI command to process scene jobs from a spool directory,
+                                                keeping the process (and its caches) alive between jobs.''',
+                                    epilog='''Jobs are JSON files with a 'params' dict using the parameter
+                                           names of arcsilib.arcsirun.runARCSI (e.g., inputHeader, sensorStr,
+                                           productsStr, outFilePath, tmpPath, demFile). Parameters which are
+                                           not provided take the same defaults as arcsi.py.''')
+    # Request the version number.
+    parser.add_argument('-v', '--version', action='version', version='%(prog)s version ' + ARCSI_VERSION)
+
+    parser.add_argument("--spool", type=str, default=None,
+                        help='''The spool directory for the job queue (Default: ARCSI_WORKER_SPOOL environment variable).''')
+    parser.add_argument("--submit", type=str, nargs='+', default=None,
+                        help='''JSON file(s) with the job parameters (a dict or a list of dicts) to be added
+                        to the queue. The worker is not run if this option is specified.''')
+    parser.add_argument("--status", action='store_true', default=False,
+                        help='''List the number of jobs pending, running, done and failed.''')
+    parser.add_argument("--ncores", type=int, default=1,
+                        help='''The number of jobs to process in parallel (Default: 1; jobs processed sequentially).''')
+    parser.add_argument("--poll", type=float, default=10,
+                        help='''The time (seconds) to wait before checking for new jobs when the queue is empty.''')
+    parser.add_argument("--exitempty", action='store_true', default=False,
+                        help='''Exit when the queue is empty rather than waiting for new jobs.''')
+    parser.add_argument("--maxjobs", type=int, default=None,
+                        help='''The maximum number of jobs to be processed before the worker exits.''')
+    parser.add_argument("--jobtimeout", type=float, default=None,
+                        help='''The maximum time (seconds) a job can run (with --ncores > 1) before its
+                        process is terminated and the job is reported as failed (Default: None; no limit).''')
+
+    # Call the parser to parse the arguments.
+    args = parser.parse_args()
+
+    arcsiUtils = ARCSIUtils()
+    if args.spool == None:
+        args.spool = arcsiUtils.getEnvironmentVariable("ARCSI_WORKER_SPOOL")
+        if args.spool == None:
+            print("Error: A spool directory needs to be provided (--spool or ARCSI_WORKER_SPOOL).\n")
+            sys.exit()
+
+    jobSpool = arcsilib.arcsiworker.ARCSIJobSpool(args.spool)
+    if args.submit is not None:
+        for jobsFile in args.submit:
+            with open(jobsFile, 'r') as jobsFileObj:
+                jobsParams = json.load(jobsFileObj)
+            if isinstance(jobsParams, dict):
+                jobsParams = [jobsParams]
+            for jobParams in jobsParams:
+                print("Submitted: " + jobSpool.submitJob(jobParams))
+    elif args.status:
+        for status in ['pending', 'running', 'done', 'failed']:
+            print("{0}: {1}".format(status, len(jobSpool.listJobs(status))))
+    else:
+        arcsilib.arcsiworker.runARCSIWorker(args.spool, args.ncores, args.poll, args.exitempty, args.maxjobs, args.jobtimeout)